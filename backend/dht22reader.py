@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import subprocess
+import select
+import threading
+import json
+
+class Dht22Reader():
+    """
+    DHT22 reader
+
+    Keeps dht22 binary running in daemon mode (GPIO layer initialized once) and requests it
+    sensor values through a line-delimited pipe: one pin number per request line, one json
+    result per response line.
+    Helper process is started on first read and restarted if it dies or stops answering.
+
+    Binaries built before daemon mode was introduced don't know "--daemon" option: daemon mode support
+    is detected from binary usage (binary launched without argument does not touch gpios) and reader
+    falls back to one process per read if not supported.
+    """
+
+    DHT22_BIN = u'/usr/local/bin/dht22'
+    DAEMON_OPTION = u'--daemon'
+    READ_TIMEOUT = 11.0
+
+    def __init__(self, logger, binary=None):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            binary (string): path to dht22 binary. Default DHT22_BIN
+        """
+        self.logger = logger
+        self.binary = binary or self.DHT22_BIN
+        self.__process = None
+        self.__lock = threading.Lock()
+        #daemon mode support (None until checked)
+        self.__daemon = None
+
+    def __start(self):
+        """
+        Start dht22 helper process
+        """
+        self.logger.debug(u'Start DHT22 helper "%s"' % self.binary)
+        self.__process = subprocess.Popen(
+            [self.binary, self.DAEMON_OPTION],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            close_fds=True
+        )
+
+    def __kill(self):
+        """
+        Kill dht22 helper process
+        """
+        if self.__process is None:
+            return
+
+        try:
+            if self.__process.poll() is None:
+                self.__process.kill()
+            self.__process.wait()
+        except:
+            self.logger.exception(u'Unable to kill DHT22 helper:')
+        self.__process = None
+
+    def __readline(self, process):
+        """
+        Read one line from process output
+
+        Args:
+            process (Popen): process instance
+
+        Returns:
+            string: line read
+
+        Raises:
+            Exception if process doesn't answer in time or closes its output
+        """
+        (readables, _, _) = select.select([process.stdout], [], [], self.READ_TIMEOUT)
+        if not readables:
+            raise Exception(u'DHT22 helper timed out')
+        line = process.stdout.readline()
+        if not line:
+            raise Exception(u'DHT22 helper closed its output')
+
+        return line.decode(u'utf-8')
+
+    def __check_daemon(self):
+        """
+        Check binary supports daemon mode. Binary is launched without argument so it only displays
+        its usage (no gpio is initialized) that lists daemon option if supported
+
+        Returns:
+            bool: True if daemon mode is supported
+        """
+        try:
+            process = subprocess.Popen(
+                [self.binary],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                close_fds=True
+            )
+            (output, _) = process.communicate()
+        except:
+            self.logger.exception(u'Unable to check DHT22 binary "%s" daemon mode:' % self.binary)
+            return False
+
+        return self.DAEMON_OPTION in output.decode(u'utf-8', u'replace')
+
+    def __read_once(self, pin):
+        """
+        Read sensor values launching one helper process for this read only
+
+        Args:
+            pin (int): physical pin number sensor is connected to
+
+        Returns:
+            dict: dht22 values (see read)
+        """
+        process = subprocess.Popen(
+            [self.binary, u'%s' % pin],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            close_fds=True
+        )
+        try:
+            return json.loads(self.__readline(process))
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+    def is_running(self):
+        """
+        Return helper process status
+
+        Returns:
+            bool: True if helper is running
+        """
+        return self.__process is not None and self.__process.poll() is None
+
+    def read(self, pin):
+        """
+        Request sensor values to dht22 helper
+
+        Args:
+            pin (int): physical pin number sensor is connected to
+
+        Returns:
+            dict: dht22 values::
+
+                {
+                    celsius (float): temperature
+                    humidity (float): humidity
+                    error (string): error message (empty if no error)
+                }
+
+        Raises:
+            Exception if helper fails or doesn't answer in time
+        """
+        with self.__lock:
+            if self.__daemon is None:
+                self.__daemon = self.__check_daemon()
+                if not self.__daemon:
+                    self.logger.warning(u'DHT22 binary "%s" does not support daemon mode, one process is launched per read' % self.binary)
+
+            if not self.__daemon:
+                return self.__read_once(pin)
+
+            if not self.is_running():
+                self.__kill()
+                self.__start()
+
+            try:
+                self.__process.stdin.write((u'%s\n' % pin).encode(u'utf-8'))
+                self.__process.stdin.flush()
+
+                return json.loads(self.__readline(self.__process))
+
+            except:
+                #protocol state is unknown, restart helper on next read
+                self.__kill()
+                raise
+
+    def stop(self):
+        """
+        Stop dht22 helper
+        """
+        with self.__lock:
+            if self.__process is not None and self.__process.poll() is None:
+                try:
+                    self.__process.stdin.close()
+                except:
+                    pass
+            self.__kill()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import threading
+import glob
+import time
+try:
+    import pyinotify
+except ImportError: # pragma: no cover
+    pyinotify = None
+
+class OnewireDiscovery():
+    """
+    Onewire devices discovery cache
+
+    Devices found on 1wire bus are cached with their first and last seen timestamps. Cache is refreshed
+    by scan function, called periodically (polling) and on bus directory changes when pyinotify is
+    available. Lost callback is called when a device disappears from bus.
+    """
+
+    DEVICES_PATTERN = u'28*'
+    SLAVE = u'w1_slave'
+
+    def __init__(self, logger, path, lost_callback=None):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            path (string): 1wire devices directory
+            lost_callback (callable): function called with device data when device disappears (optional)
+        """
+        self.logger = logger
+        self.path = path
+        self.lost_callback = lost_callback
+        self.__devices = {}
+        self.__scanned = False
+        self.__notifier = None
+        self.__lock = threading.Lock()
+
+    def scan(self):
+        """
+        Scan 1wire bus devices and update cache
+        """
+        now = int(time.time())
+        found = [os.path.basename(path) for path in glob.glob(os.path.join(self.path, self.DEVICES_PATTERN))]
+
+        lost = []
+        with self.__lock:
+            for name in found:
+                device = self.__devices.get(name)
+                if device is None or not device[u'present']:
+                    self.logger.debug(u'Onewire device "%s" found' % name)
+                    device = {
+                        u'device': name,
+                        u'path': os.path.join(self.path, name, self.SLAVE),
+                        u'firstseen': now if device is None else device[u'firstseen'],
+                        u'lastseen': now,
+                        u'present': True,
+                    }
+                    self.__devices[name] = device
+                device[u'lastseen'] = now
+
+            for name, device in self.__devices.items():
+                if device[u'present'] and name not in found:
+                    self.logger.info(u'Onewire device "%s" lost' % name)
+                    device[u'present'] = False
+                    lost.append(dict(device))
+
+            self.__scanned = True
+
+        if self.lost_callback:
+            for device in lost:
+                self.lost_callback(device)
+
+    def get_devices(self):
+        """
+        Return devices currently connected on bus. Bus is scanned if it has never been scanned
+
+        Returns:
+            list: list of devices::
+
+                [
+                    {
+                        device (string): device name
+                        path (string): device slave file path
+                        firstseen (int): first time device was seen
+                        lastseen (int): last time device was seen
+                    },
+                    ...
+                ]
+
+        """
+        if not self.__scanned:
+            self.scan()
+
+        with self.__lock:
+            devices = [dict(device) for device in self.__devices.values() if device[u'present']]
+        for device in devices:
+            del device[u'present']
+
+        return sorted(devices, key=lambda device: device[u'device'])
+
+    def start_watcher(self):
+        """
+        Watch bus directory to refresh cache as soon as a device appears or disappears
+
+        Returns:
+            bool: True if watcher is started, False if pyinotify is not available
+        """
+        if pyinotify is None or self.__notifier is not None or not os.path.exists(self.path):
+            return False
+
+        try:
+            manager = pyinotify.WatchManager()
+            self.__notifier = pyinotify.ThreadedNotifier(manager, lambda event: self.scan())
+            self.__notifier.daemon = True
+            self.__notifier.start()
+            manager.add_watch(self.path, pyinotify.IN_CREATE | pyinotify.IN_DELETE)
+            return True
+
+        except:
+            self.logger.exception(u'Unable to watch onewire devices directory, polling only:')
+            self.stop_watcher()
+            return False
+
+    def stop_watcher(self):
+        """
+        Stop bus directory watcher
+        """
+        if self.__notifier is not None:
+            try:
+                self.__notifier.stop()
+            except:
+                self.logger.exception(u'Unable to stop onewire devices watcher:')
+            self.__notifier = None
@@ -24,8 +24,33 @@ class OnewireDriver(Driver):
         """
         Driver.__init__(self, cleep_filesystem, Driver.DRIVER_GPIO, u'onewire')
 
-        self.configtxt = ConfigTxt(self.cleep_filesystem)
-        self.etcmodules = EtcModules(self.cleep_filesystem)
+        #system config files are loaded on first use
+        self.__configtxt = None
+        self.__etcmodules = None
+
+    @property
+    def configtxt(self):
+        """
+        Return config.txt instance
+
+        Returns:
+            ConfigTxt: config.txt instance
+        """
+        if self.__configtxt is None:
+            self.__configtxt = ConfigTxt(self.cleep_filesystem)
+        return self.__configtxt
+
+    @property
+    def etcmodules(self):
+        """
+        Return /etc/modules instance
+
+        Returns:
+            EtcModules: /etc/modules instance
+        """
+        if self.__etcmodules is None:
+            self.__etcmodules = EtcModules(self.cleep_filesystem)
+        return self.__etcmodules
 
     def _install(self, params=None):
         """
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from raspiot.utils import InvalidParameter, MissingParameter
+from .sensorsutils import SensorsUtils
+import time
+
 class Sensor():
     """
     Sensor base class
@@ -9,6 +13,16 @@ class Sensor():
      - TYPES (list): list of supported sensors types (temperature, motion, humidity, pressure...)
      - SUBTYPE (string): name of subtype. Usually name of sensor type (dht, onewire...)
     """
+
+    DEFAULT_DEADBAND = 0.0
+    DEFAULT_HEARTBEAT = 900
+
+    #adaptive polling: smoothing factor of readings activity, activity threshold (used when sensor has
+    #no deadband) and number of stable readings before interval is stretched
+    ADAPTIVE_ALPHA = 0.3
+    ADAPTIVE_THRESHOLD = 0.2
+    ADAPTIVE_STABLE_READINGS = 5
+
     def __init__(self, sensors):
         """
         Constructor
@@ -19,7 +33,10 @@ class Sensor():
         self.raspi_gpios = {}
         self.drivers = {}
         self.cleep_filesystem = sensors.cleep_filesystem
-        self.__task = None
+        self._last_published = {}
+        self._adaptive_states = {}
+        self._oversampling_windows = {}
+        self._drivers_installed = {}
 
     def _register_driver(self, driver):
         """
@@ -37,6 +54,33 @@ class Sensor():
         """
         return len(self.drivers)>0
 
+    def _is_driver_installed(self, driver_name):
+        """
+        Return driver installation state. State is cached until driver install/uninstall event is received
+
+        Args:
+            driver_name (string): driver name
+
+        Returns:
+            bool: True if driver is installed
+        """
+        if driver_name not in self._drivers_installed:
+            self._drivers_installed[driver_name] = self.drivers[driver_name].is_installed()
+
+        return self._drivers_installed[driver_name]
+
+    def _invalidate_driver_installed(self, driver_name=None):
+        """
+        Invalidate cached driver installation state
+
+        Args:
+            driver_name (string): driver name. If None all drivers states are invalidated
+        """
+        if driver_name is None:
+            self._drivers_installed = {}
+        else:
+            self._drivers_installed.pop(driver_name, None)
+
     def _get_event(self, event_name):
         """
         Returns event name
@@ -55,12 +99,352 @@ class Sensor():
     def update_value(self, sensor):
         """
         Update sensor values (timestamp, temperature, motion status...)
+        Values are buffered and saved periodically by sensors module
         
         Args:
             sensor (dict): sensor data
+
+        Returns:
+            bool: True if sensor exists
         """
-        return self.sensors._update_device(sensor[u'uuid'], sensor)
+        return self.sensors._update_sensor_value(sensor)
         
+    def _get_update_param(self, value, sensor, key, default):
+        """
+        Return updated parameter value. Parameter not specified (None) keeps current sensor value, so
+        updating sensor with partial parameters (like from sensors config panel) doesn't reset others
+
+        Args:
+            value (any): parameter value
+            sensor (dict): sensor data (can be None)
+            key (string): sensor field storing parameter
+            default (any): value used if sensor has no value for this field
+
+        Returns:
+            any: parameter value
+        """
+        if value is not None:
+            return value
+
+        return (sensor or {}).get(key, default)
+
+    def _check_filter_params(self, deadband, heartbeat):
+        """
+        Check deadband and heartbeat parameters
+
+        Args:
+            deadband (float): minimum value delta to publish new value
+            heartbeat (int): maximum duration without publishing value (seconds)
+
+        Raises:
+            InvalidParameter if parameter is invalid
+        """
+        if not isinstance(deadband, (int, float)) or deadband<0:
+            raise InvalidParameter(u'Deadband must be a positive number')
+        elif not isinstance(heartbeat, int) or heartbeat<0:
+            raise InvalidParameter(u'Heartbeat must be a positive integer')
+
+    def _check_adaptive_params(self, adaptive, interval, min_interval, max_interval, minimum):
+        """
+        Check adaptive polling parameters
+
+        Args:
+            adaptive (bool): True if adaptive polling is enabled
+            interval (int): initial polling interval
+            min_interval (int): min polling interval
+            max_interval (int): max polling interval
+            minimum (int): min allowed interval
+
+        Raises:
+            MissingParameter, InvalidParameter if parameter is invalid
+        """
+        if not isinstance(adaptive, bool):
+            raise InvalidParameter(u'Parameter "adaptive" must be a boolean')
+        elif not adaptive:
+            return
+        elif min_interval is None:
+            raise MissingParameter(u'Parameter "min_interval" is missing')
+        elif max_interval is None:
+            raise MissingParameter(u'Parameter "max_interval" is missing')
+        elif min_interval<minimum:
+            raise InvalidParameter(u'Min interval must be greater or equal than %s' % minimum)
+        elif max_interval<min_interval:
+            raise InvalidParameter(u'Max interval must be greater or equal than min interval')
+        elif interval<min_interval or interval>max_interval:
+            raise InvalidParameter(u'Interval must be between min and max intervals')
+
+    def _check_oversampling_params(self, oversampling, aggregation, interval, adaptive, minimum):
+        """
+        Check oversampling parameters
+
+        Args:
+            oversampling (int): sampling period (seconds). 0 or None to disable oversampling
+            aggregation (string): samples aggregation method
+            interval (int): reporting interval
+            adaptive (bool): True if adaptive polling is enabled
+            minimum (int): min allowed sampling period
+
+        Raises:
+            InvalidParameter if parameter is invalid
+        """
+        if not oversampling:
+            return
+        elif not isinstance(oversampling, int) or oversampling<minimum:
+            raise InvalidParameter(u'Oversampling period must be greater or equal than %s' % minimum)
+        elif oversampling>=interval:
+            raise InvalidParameter(u'Oversampling period must be lower than interval')
+        elif aggregation not in SensorsUtils.AGGREGATIONS:
+            raise InvalidParameter(u'Aggregation must be one of %s' % u', '.join(SensorsUtils.AGGREGATIONS))
+        elif adaptive:
+            raise InvalidParameter(u'Oversampling can\'t be used with adaptive polling')
+
+    def _get_task_interval(self, sensor):
+        """
+        Return sensor task interval: sampling period if oversampling is enabled, reporting interval otherwise
+
+        Args:
+            sensor (dict): sensor data
+
+        Returns:
+            float: task interval (seconds)
+        """
+        return float(sensor.get(u'oversampling') or sensor[u'interval'])
+
+    def _oversample(self, sensor, values, now):
+        """
+        Accumulate sensor readings during sensor interval and aggregate them when interval is elapsed.
+        Next window starts at reporting time so values keep being reported every interval
+
+        Args:
+            sensor (dict): sensor data
+            values (tuple): values read (None for failed reading)
+            now (int): reading timestamp
+
+        Returns:
+            tuple: (bool, tuple): True and aggregated values (same order than values) when reporting interval
+                   is elapsed, False and None otherwise
+        """
+        window = self._oversampling_windows.setdefault(sensor[u'uuid'], {
+            u'start': now,
+            u'samples': [],
+        })
+        window[u'samples'].append(values)
+        if now - window[u'start']<sensor[u'interval']:
+            return (False, None)
+
+        samples = window[u'samples']
+        self._oversampling_windows[sensor[u'uuid']] = {
+            u'start': now,
+            u'samples': [],
+        }
+        aggregation = sensor.get(u'aggregation', SensorsUtils.AGGREGATION_MEAN)
+        return (True, tuple([SensorsUtils.aggregate(column, aggregation) for column in zip(*samples)]))
+
+    def _adapt_interval(self, values):
+        """
+        Adapt polling interval of task of specified sensors according to readings activity (smoothed
+        absolute delta between consecutive readings): interval is halved as soon as readings move and is
+        doubled after some stable readings, bounded by sensor min and max intervals.
+        When a task handles several sensors, the shortest interval is applied.
+
+        Args:
+            values (list): list of (sensor, value) read by the same task
+
+        Returns:
+            float: applied interval or None if adaptive polling is disabled
+        """
+        intervals = []
+        for (sensor, value) in values:
+            if not sensor.get(u'adaptive', False) or value is None:
+                continue
+
+            state = self._adaptive_states.get(sensor[u'uuid'])
+            if state is None:
+                state = {
+                    u'last': value,
+                    u'activity': 0.0,
+                    u'stable': 0,
+                    u'interval': float(sensor[u'interval']),
+                }
+                self._adaptive_states[sensor[u'uuid']] = state
+                intervals.append(state[u'interval'])
+                continue
+
+            state[u'activity'] = self.ADAPTIVE_ALPHA * abs(value - state[u'last']) + (1.0 - self.ADAPTIVE_ALPHA) * state[u'activity']
+            state[u'last'] = value
+            threshold = sensor.get(u'deadband') or self.ADAPTIVE_THRESHOLD
+            if state[u'activity']>=threshold:
+                #readings are moving, tighten interval
+                state[u'stable'] = 0
+                state[u'interval'] = max(float(sensor[u'mininterval']), state[u'interval'] / 2.0)
+            elif state[u'activity']<threshold / 2.0:
+                #readings are stable, stretch interval
+                state[u'stable'] += 1
+                if state[u'stable']>=self.ADAPTIVE_STABLE_READINGS:
+                    state[u'stable'] = 0
+                    state[u'interval'] = min(float(sensor[u'maxinterval']), state[u'interval'] * 2.0)
+            intervals.append(state[u'interval'])
+
+        if len(intervals)==0:
+            return None
+
+        interval = min(intervals)
+        task = self.sensors._tasks_by_device_uuid.get(values[0][0][u'uuid'])
+        if task and task.interval!=interval:
+            self.logger.debug(u'Sensor "%s" polling interval set to %ss' % (values[0][0][u'name'], interval))
+            task.set_interval(interval)
+
+        return interval
+
+    def _is_significant(self, sensor, value, now):
+        """
+        Check if sensor value must be published (event and persistence) according to sensor deadband
+        and heartbeat. Value is considered as published if it is significant
+
+        Args:
+            sensor (dict): sensor data
+            value (float): new sensor value (can be None if read failed)
+            now (int): reading timestamp
+
+        Returns:
+            bool: True if value must be published
+        """
+        deadband = sensor.get(u'deadband', self.DEFAULT_DEADBAND)
+        heartbeat = sensor.get(u'heartbeat', self.DEFAULT_HEARTBEAT)
+        last = self._last_published.get(sensor[u'uuid'])
+
+        significant = False
+        if last is None or now-last[1]>=heartbeat:
+            #first value or heartbeat expired
+            significant = True
+        elif value is None or last[0] is None:
+            significant = value is not last[0]
+        else:
+            delta = abs(value - last[0])
+            significant = delta>0 and delta>=deadband
+
+        if significant:
+            self._last_published[sensor[u'uuid']] = (value, now)
+
+        return significant
+
+    def _forget_sensor(self, uuid):
+        """
+        Drop sensor readings states (deadband, adaptive interval and oversampling) after sensor deletion
+
+        Args:
+            uuid (string): sensor uuid
+        """
+        self._last_published.pop(uuid, None)
+        self._adaptive_states.pop(uuid, None)
+        self._oversampling_windows.pop(uuid, None)
+
+    def _add_read_metrics(self, sensor, duration, error=False):
+        """
+        Report sensor read latency and error to sensors metrics
+
+        Args:
+            sensor (dict): sensor data
+            duration (float): read duration (seconds)
+            error (bool): True if read failed
+        """
+        addon = self.__class__.__name__
+        self.sensors._metrics.add_latency(addon, sensor[u'uuid'], duration)
+        if error:
+            self.sensors._metrics.add_error(addon, sensor[u'uuid'])
+
+    def _add_read_retry(self, sensor):
+        """
+        Report sensor read retry to sensors metrics
+
+        Args:
+            sensor (dict): sensor data
+        """
+        self.sensors._metrics.add_retry(self.__class__.__name__, sensor[u'uuid'])
+
+    def _add_read_crc_error(self, sensor):
+        """
+        Report sensor read CRC error to sensors metrics
+
+        Args:
+            sensor (dict): sensor data
+        """
+        self.sensors._metrics.add_crc_error(self.__class__.__name__, sensor[u'uuid'])
+
+    def _can_read(self, sensor):
+        """
+        Check if sensor can be read according to its circuit breaker (failing sensors are read less often)
+
+        Args:
+            sensor (dict): sensor data
+
+        Returns:
+            bool: True if sensor can be read
+        """
+        return self.sensors._breaker.allow(sensor[u'uuid'])
+
+    def _report_read(self, sensor, succeed):
+        """
+        Report sensor read result to its circuit breaker
+
+        Args:
+            sensor (dict): sensor data
+            succeed (bool): True if read succeed
+        """
+        if succeed:
+            if self.sensors._breaker.success(sensor[u'uuid']):
+                self.logger.info(u'Sensor "%s" is readable again' % sensor[u'name'])
+            return
+
+        circuit = self.sensors._breaker.failure(sensor[u'uuid'], float(sensor.get(u'interval', 60)))
+        if circuit[u'state']==self.sensors._breaker.STATE_OPEN:
+            self.logger.warning(u'Sensor "%s" failed %d times in a row, next read attempt at %s' % (sensor[u'name'], circuit[u'failures'], time.strftime(u'%H:%M:%S', time.localtime(circuit[u'retryat']))))
+
+    def _log_read_error(self, sensor, message):
+        """
+        Log sensor read error. Full exception is logged only for first failure to avoid flooding logs
+        with dead hardware errors
+
+        Args:
+            sensor (dict): sensor data
+            message (string): error message
+        """
+        failures = self.sensors._breaker.get_state(sensor[u'uuid'])[u'failures']
+        if failures==0:
+            self.logger.exception(message)
+        else:
+            self.logger.debug(u'%s (consecutive failures: %d)' % (message, failures))
+
+    def _send_update_event(self, event, sensor, params):
+        """
+        Send sensor update event and add reading to current scheduler tick batch update event
+
+        Args:
+            event (Event): sensor update event
+            sensor (dict): sensor data
+            params (dict): event parameters
+        """
+        event.send(params=params, device_id=sensor[u'uuid'])
+
+        reading = dict(params)
+        reading.update({
+            u'uuid': sensor[u'uuid'],
+            u'type': sensor.get(u'type'),
+        })
+        self.sensors._scheduler.add_tick_reading(reading)
+
+    def _record_value(self, sensor, value, timestamp):
+        """
+        Record sensor value in sensors history and on-disk store
+
+        Args:
+            sensor (dict): sensor data
+            value (float): sensor value (None values are not recorded)
+            timestamp (int): value timestamp
+        """
+        self.sensors._history.add(sensor[u'uuid'], timestamp, value)
+        self.sensors._store.add(sensor[u'uuid'], timestamp, value)
+
     def _search_device(self, key, value):
         """
         Search first device that matches specified criteria
@@ -91,7 +475,7 @@ class Sensor():
         Returns:
             dict: sensor data or None if nothing found
         """
-        self.sensors._search_by_gpio(gpio_uuid)
+        return self.sensors._search_by_gpio(gpio_uuid)
         
     def _get_device(self, uuid):
         """
@@ -110,7 +494,39 @@ class Sensor():
             dict: assigned gpios
         """
         return self.sensors._get_assigned_gpios()
+
+    def _is_gpio_assigned(self, gpio):
+        """
+        Return True if gpio is assigned. Assigned gpios mirror may be stale, so gpio found assigned is
+        checked again on gpios module state before being rejected
+
+        Args:
+            gpio (string): gpio name (GPIOXX)
+
+        Returns:
+            bool: True if gpio is assigned
+        """
+        if gpio not in self._get_assigned_gpios():
+            return False
+
+        self.sensors._expire_assigned_gpios()
+        return gpio in self._get_assigned_gpios()
         
+    def _create_task(self, interval, task, task_args=None, batch=None):
+        """
+        Create sensor task executed by sensors scheduler
+
+        Args:
+            interval (float): interval between task executions (seconds)
+            task (callable): function to execute
+            task_args (list): task arguments
+            batch (callable): function executed once for all tasks of the same batch due together
+
+        Returns:
+            SchedulerTask: task instance (not started)
+        """
+        return self.sensors._scheduler.create_task(interval, task, task_args, batch)
+
     def update(self, sensor):
         """
         Returns sensor data to update
@@ -162,21 +578,34 @@ class Sensor():
             u'sensors': [sensor,],
         }
                
-    def get_task(self, sensors):
+    def get_task(self, sensor):
         """
         Prepare specific sensor task
         
         Args:
-            sensors (list): list of sensors data (dict)
+            sensor (dict): sensor data
         
         Returns:
             Task: task instance that will be launched by sensors instance or None if no task needed
         """
-        #instanciate singleton
-        if self.__task is None:
-            self.__task = self._get_task(sensors)
+        #new task starts with configured interval and new oversampling window
+        for sensor_ in self.get_task_sensors(sensor):
+            self._adaptive_states.pop(sensor_[u'uuid'], None)
+            self._oversampling_windows.pop(sensor_[u'uuid'], None)
 
-        return self.__task
+        return self._get_task(sensor)
+
+    def get_task_sensors(self, sensor):
+        """
+        Return all sensors handled by sensor task (useful for multi sensors devices)
+
+        Args:
+            sensor (dict): sensor data
+
+        Returns:
+            list: list of sensors data (dict)
+        """
+        return [sensor,]
 
     def _get_task(self, sensors):
         """
@@ -190,6 +619,18 @@ class Sensor():
         """
         raise NotImplementedError(u'Function "get_task" must be implemented in "%s"' % self.__class__.__name__)
         
+    def _start(self):
+        """
+        Start addon. Called when sensors module is configured
+        """
+        pass
+
+    def _stop(self):
+        """
+        Stop addon (release resources). Called when sensors module is stopped
+        """
+        pass
+
     def process_event(self, event, sensor):
         """
         Process received event
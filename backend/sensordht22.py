@@ -6,9 +6,7 @@ import logging
 from raspiot.utils import MissingParameter, InvalidParameter, CommandError
 from .sensor import Sensor
 from .sensorsutils import SensorsUtils
-from raspiot.libs.internals.console import Console
-from raspiot.libs.internals.task import Task
-import json
+from .dht22reader import Dht22Reader
 import time
 
 class SensorDht22(Sensor):
@@ -20,8 +18,7 @@ class SensorDht22(Sensor):
     TYPE_TEMPERATURE = u'temperature'
     TYPES = [TYPE_TEMPERATURE, TYPE_HUMIDITY]
     SUBTYPE = u'dht22'
-    
-    DHT22_CMD = u'/usr/local/bin/dht22 %s'
+    DHT22_MIN_OVERSAMPLING = 10
     
     def __init__(self, sensors):
         """
@@ -35,6 +32,9 @@ class SensorDht22(Sensor):
         #events
         self.sensors_temperature_update = self._get_event(u'sensors.temperature.update')
         self.sensors_humidity_update = self._get_event(u'sensors.humidity.update')
+
+        #dht22 helper process (started on first read)
+        self.dht22_reader = Dht22Reader(self.logger)
         
     def _get_dht22_devices(self, name):
         """
@@ -58,7 +58,7 @@ class SensorDht22(Sensor):
 
         return (temperature_device, humidity_device)
     
-    def add(self, name, gpio, interval, offset, offset_unit):
+    def add(self, name, gpio, interval, offset, offset_unit, temperature_deadband=Sensor.DEFAULT_DEADBAND, humidity_deadband=Sensor.DEFAULT_DEADBAND, heartbeat=Sensor.DEFAULT_HEARTBEAT, adaptive=False, min_interval=None, max_interval=None, oversampling=0, aggregation=SensorsUtils.AGGREGATION_MEAN):
         """
         Return sensor data to add.
         Can perform specific stuff
@@ -72,9 +72,6 @@ class SensorDht22(Sensor):
                 }
                 
         """
-        #get assigned gpios
-        assigned_gpios = self._get_assigned_gpios()
-
         #check values
         if name is None or len(name)==0:
             raise MissingParameter(u'Parameter "name" is missing')
@@ -92,10 +89,14 @@ class SensorDht22(Sensor):
             raise InvalidParameter(u'Offset_unit must be equal to "celsius" or "fahrenheit"')
         elif gpio is None or len(gpio)==0:
             raise MissingParameter(u'Parameter "gpio" is missing')
-        elif gpio in assigned_gpios:
+        elif self._is_gpio_assigned(gpio):
             raise InvalidParameter(u'Gpio "%s" is already used' % gpio)
         elif gpio not in self.raspi_gpios:
             raise InvalidParameter(u'Gpio "%s" does not exist for this raspberry pi' % gpio)
+        self._check_filter_params(temperature_deadband, heartbeat)
+        self._check_filter_params(humidity_deadband, heartbeat)
+        self._check_adaptive_params(adaptive, interval, min_interval, max_interval, 60)
+        self._check_oversampling_params(oversampling, aggregation, interval, adaptive, self.DHT22_MIN_OVERSAMPLING)
 
         gpio_data = {
             u'name': name + '_dht22',
@@ -113,6 +114,13 @@ class SensorDht22(Sensor):
             u'interval': interval,
             u'offset': offset,
             u'offsetunit': offset_unit,
+            u'deadband': temperature_deadband,
+            u'heartbeat': heartbeat,
+            u'adaptive': adaptive,
+            u'mininterval': min_interval,
+            u'maxinterval': max_interval,
+            u'oversampling': oversampling,
+            u'aggregation': aggregation,
             u'lastupdate': int(time.time()),
             u'celsius': None,
             u'fahrenheit': None
@@ -124,6 +132,13 @@ class SensorDht22(Sensor):
             u'type': self.TYPE_HUMIDITY,
             u'subtype': self.SUBTYPE,
             u'interval': interval,
+            u'deadband': humidity_deadband,
+            u'heartbeat': heartbeat,
+            u'adaptive': adaptive,
+            u'mininterval': min_interval,
+            u'maxinterval': max_interval,
+            u'oversampling': oversampling,
+            u'aggregation': aggregation,
             u'lastupdate': int(time.time()),
             u'humidity': None
         }
@@ -139,7 +154,7 @@ class SensorDht22(Sensor):
             u'sensors': [temperature_data, humidity_data,],
         }
 
-    def update(self, sensor, name, interval, offset, offset_unit):
+    def update(self, sensor, name, interval, offset, offset_unit, temperature_deadband=None, humidity_deadband=None, heartbeat=None, adaptive=None, min_interval=None, max_interval=None, oversampling=None, aggregation=None):
         """
         Returns sensor data to update
         Can perform specific stuff
@@ -170,10 +185,23 @@ class SensorDht22(Sensor):
             raise MissingParameter(u'Parameter "offset_unit" is missing')
         elif offset_unit not in (SensorsUtils.TEMP_CELSIUS, SensorsUtils.TEMP_FAHRENHEIT):
             raise InvalidParameter(u'Offset_unit value must be either "celsius" or "fahrenheit"')
-            
+
         #search all sensors with same name
         old_name = sensor[u'name']
         (temperature_device, humidity_device) = self._get_dht22_devices(sensor[u'name'])
+
+        temperature_deadband = self._get_update_param(temperature_deadband, temperature_device, u'deadband', self.DEFAULT_DEADBAND)
+        humidity_deadband = self._get_update_param(humidity_deadband, humidity_device, u'deadband', self.DEFAULT_DEADBAND)
+        heartbeat = self._get_update_param(heartbeat, sensor, u'heartbeat', self.DEFAULT_HEARTBEAT)
+        adaptive = self._get_update_param(adaptive, sensor, u'adaptive', False)
+        min_interval = self._get_update_param(min_interval, sensor, u'mininterval', None)
+        max_interval = self._get_update_param(max_interval, sensor, u'maxinterval', None)
+        oversampling = self._get_update_param(oversampling, sensor, u'oversampling', 0)
+        aggregation = self._get_update_param(aggregation, sensor, u'aggregation', SensorsUtils.AGGREGATION_MEAN)
+        self._check_filter_params(temperature_deadband, heartbeat)
+        self._check_filter_params(humidity_deadband, heartbeat)
+        self._check_adaptive_params(adaptive, interval, min_interval, max_interval, 60)
+        self._check_oversampling_params(oversampling, aggregation, interval, adaptive, self.DHT22_MIN_OVERSAMPLING)
                     
         #reconfigure gpio
         gpios = []
@@ -193,12 +221,26 @@ class SensorDht22(Sensor):
             temperature_device[u'interval'] = interval
             temperature_device[u'offset'] = offset
             temperature_device[u'offsetunit'] = offset_unit
+            temperature_device[u'deadband'] = temperature_deadband
+            temperature_device[u'heartbeat'] = heartbeat
+            temperature_device[u'adaptive'] = adaptive
+            temperature_device[u'mininterval'] = min_interval
+            temperature_device[u'maxinterval'] = max_interval
+            temperature_device[u'oversampling'] = oversampling
+            temperature_device[u'aggregation'] = aggregation
             sensors.append(temperature_device)
 
         #humidity sensor
         if humidity_device:
             humidity_device[u'name'] = name
             humidity_device[u'interval'] = interval
+            humidity_device[u'deadband'] = humidity_deadband
+            humidity_device[u'heartbeat'] = heartbeat
+            humidity_device[u'adaptive'] = adaptive
+            humidity_device[u'mininterval'] = min_interval
+            humidity_device[u'maxinterval'] = max_interval
+            humidity_device[u'oversampling'] = oversampling
+            humidity_device[u'aggregation'] = aggregation
             sensors.append(humidity_device)
 
         return {
@@ -244,18 +286,20 @@ class SensorDht22(Sensor):
 
     def _execute_command(self, sensor): # pragma: no cover
         """
-        Execute dht22 binary command
+        Request sensor values to dht22 helper process
         Useful for unit testing
         """
-        console = Console()
-        cmd = self.DHT22_CMD % sensor[u'gpios'][0][u'pin']
-        self.logger.debug(u'Read DHT22 sensor values from command "%s"' % cmd)
-        resp = console.command(cmd, timeout=11)
-        self.logger.debug(u'Read DHT command response: %s' % resp)
-        if resp[u'error'] or resp[u'killed']:
-            self.logger.error(u'DHT22 command failed: %s' % resp)
+        self.logger.debug(u'Read DHT22 sensor values on pin %s' % sensor[u'gpios'][0][u'pin'])
+        data = self.dht22_reader.read(sensor[u'gpios'][0][u'pin'])
+        self.logger.debug(u'Read DHT22 response: %s' % data)
 
-        return json.loads(resp[u'stdout'][0])
+        return data
+
+    def _stop(self):
+        """
+        Stop addon
+        """
+        self.dht22_reader.stop()
 
     def _read_dht22(self, sensor):
         """
@@ -270,9 +314,11 @@ class SensorDht22(Sensor):
         tempC = None
         tempF = None
         humP = None
+        error = False
+        start = time.time()
         
         try:
-            #get values from external binary (binary hardcoded timeout set to 10 seconds)
+            #get values from dht22 helper (binary hardcoded timeout set to 10 seconds)
             data = self._execute_command(sensor)
             
             #check read errors
@@ -286,7 +332,10 @@ class SensorDht22(Sensor):
             self.logger.info(u'Read values from DHT22: %s°C, %s°F, %s%%' % (tempC, tempF, humP))
 
         except Exception as e:
-            self.logger.exception('Error executing DHT22 command:')
+            self._log_read_error(sensor, u'Error executing DHT22 command:')
+            error = True
+
+        self._add_read_metrics(sensor, time.time() - start, error)
             
         return (tempC, tempF, humP)
             
@@ -298,11 +347,31 @@ class SensorDht22(Sensor):
             temperature_device (dict): temperature sensor
             humidity_device (dict): humidity sensor
         """
+        #skip read of failing sensor (read blocks until helper timeout)
+        device = temperature_device or humidity_device
+        if not self._can_read(device):
+            self.logger.debug(u'DHT22 "%s" read skipped (failing sensor)' % device[u'name'])
+            return
+
         #read values
-        (tempC, tempF, humP) = self._read_dht22((temperature_device or humidity_device))
+        (tempC, tempF, humP) = self._read_dht22(device)
+        self._report_read(device, tempC is not None or humP is not None)
         
         now = int(time.time())
-        if temperature_device and tempC is not None and tempF is not None:
+        if device.get(u'oversampling'):
+            #report aggregated values once per interval
+            (elapsed, values) = self._oversample(device, (tempC, tempF, humP), now)
+            if not elapsed:
+                return
+            (tempC, tempF, humP) = values
+
+        if temperature_device:
+            self._record_value(temperature_device, tempC, now)
+        if humidity_device:
+            self._record_value(humidity_device, humP, now)
+        self._adapt_interval([(device_, value) for (device_, value) in ((temperature_device, tempC), (humidity_device, humP)) if device_])
+
+        if temperature_device and tempC is not None and tempF is not None and self._is_significant(temperature_device, tempC, now):
             #temperature values are valid, update sensor values
             temperature_device[u'celsius'] = tempC
             temperature_device[u'fahrenheit'] = tempF
@@ -316,9 +385,9 @@ class SensorDht22(Sensor):
                     u'fahrenheit': tempF,
                     u'lastupdate': now
                 }
-                self.sensors_temperature_update.send(params=params, device_id=temperature_device[u'uuid'])
+                self._send_update_event(self.sensors_temperature_update, temperature_device, params)
 
-        if humidity_device and humP is not None:
+        if humidity_device and humP is not None and self._is_significant(humidity_device, humP, now):
             #humidity value is valid, update sensor value
             humidity_device[u'humidity'] = humP
             humidity_device[u'lastupdate'] = now
@@ -330,11 +399,25 @@ class SensorDht22(Sensor):
                     u'humidity': humP,
                     u'lastupdate': now
                 }
-                self.sensors_humidity_update.send(params=params, device_id=humidity_device[u'uuid'])
+                self._send_update_event(self.sensors_humidity_update, humidity_device, params)
 
         if tempC is None and tempF is None and humP is None:
             self.logger.warning(u'No value returned by DHT22 sensor!')
         
+    def get_task_sensors(self, sensor):
+        """
+        Return DHT22 sensors handled by task (temperature and humidity devices)
+
+        Args:
+            sensor (dict): one of DHT22 sensor (temperature or humidity)
+
+        Returns:
+            list: list of sensors data (dict)
+        """
+        (temperature_device, humidity_device) = self._get_dht22_devices(sensor[u'name'])
+
+        return [device for device in (temperature_device, humidity_device) if device is not None]
+
     def _get_task(self, sensor):
         """
         Prepare task for DHT sensor only. It should have 2 devices with the same name.
@@ -343,10 +426,10 @@ class SensorDht22(Sensor):
             sensor (dict): one of DHT22 sensor (temperature or humidity)
 
         Returns:
-            Task: sensor task
+            SchedulerTask: sensor task
         """
         #search all sensors with same name
         (temperature_device, humidity_device) = self._get_dht22_devices(sensor[u'name'])
         
-        return Task(float(sensor[u'interval']), self._task, self.logger, [temperature_device, humidity_device])
+        return self._create_task(self._get_task_interval(sensor), self._task, [temperature_device, humidity_device])
 
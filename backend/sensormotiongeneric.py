@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import logging
+import threading
 from raspiot.utils import MissingParameter, InvalidParameter, CommandError
 from .sensor import Sensor
 import time
@@ -26,8 +27,12 @@ class SensorMotionGeneric(Sensor):
         #events
         self.sensors_motion_on = self._get_event(u'sensors.motion.on')
         self.sensors_motion_off = self._get_event(u'sensors.motion.off')
+
+        #motion sessions of sensors with hold time
+        self.__sessions = {}
+        self.__sessions_lock = threading.Lock()
     
-    def add(self, name, gpio, inverted):
+    def add(self, name, gpio, inverted, hold_time=0):
         """
         Return sensor data to add.
         Can perform specific stuff
@@ -41,9 +46,6 @@ class SensorMotionGeneric(Sensor):
                 }
                 
         """
-        #get assigned gpios
-        assigned_gpios = self._get_assigned_gpios()
-
         #check values
         if name is None or len(name)==0:
             raise MissingParameter(u'Parameter "name" is missing')
@@ -53,10 +55,12 @@ class SensorMotionGeneric(Sensor):
             raise MissingParameter(u'Parameter "gpio" is missing')
         elif inverted is None:
             raise MissingParameter(u'Parameter "inverted" is missing')
-        elif gpio in assigned_gpios:
+        elif self._is_gpio_assigned(gpio):
             raise InvalidParameter(u'Gpio "%s" is already used' % gpio)
         elif gpio not in self.raspi_gpios:
             raise InvalidParameter(u'Gpio "%s" does not exist for this raspberry pi' % gpio)
+        elif not isinstance(hold_time, int) or hold_time<0:
+            raise InvalidParameter(u'Hold time must be a positive integer')
 
         #configure gpio
         gpio = {
@@ -76,6 +80,7 @@ class SensorMotionGeneric(Sensor):
             u'inverted': inverted,
             u'lastupdate': 0,
             u'lastduration': 0,
+            u'holdtime': hold_time,
         }
         
         #read current gpio value
@@ -89,7 +94,7 @@ class SensorMotionGeneric(Sensor):
             u'sensors': [sensor,]
         }
 
-    def update(self, sensor, name, inverted):
+    def update(self, sensor, name, inverted, hold_time=None):
         """
         Returns sensor data to update
         Can perform specific stuff
@@ -113,6 +118,9 @@ class SensorMotionGeneric(Sensor):
             raise MissingParameter(u'Parameter "inverted" is missing')
         elif self._search_device(u'uuid', sensor[u'uuid']) is None:
             raise InvalidParameter(u'Sensor "%s" does not exist' % sensor[u'uuid'])
+        hold_time = self._get_update_param(hold_time, sensor, u'holdtime', 0)
+        if not isinstance(hold_time, int) or hold_time<0:
+            raise InvalidParameter(u'Hold time must be a positive integer')
            
         gpio = {
             u'uuid': sensor[u'gpios'][0][u'uuid'],
@@ -124,6 +132,7 @@ class SensorMotionGeneric(Sensor):
         #update sensor
         sensor[u'name'] = name
         sensor[u'inverted'] = inverted
+        sensor[u'holdtime'] = hold_time
         
         return {
             u'gpios': [gpio,],
@@ -133,6 +142,9 @@ class SensorMotionGeneric(Sensor):
     def process_event(self, event, sensor):
         """
         Process received event
+
+        If sensor has a hold time, gpio on/off sequences are coalesced in a single motion session:
+        session ends when no motion is detected during hold time after last gpio off.
         
         Args:
             event (MessageRequest): gpio event
@@ -140,38 +152,133 @@ class SensorMotionGeneric(Sensor):
         """
         #get current time
         now = int(time.time())
+        hold_time = sensor.get(u'holdtime', 0)
 
-        if event[u'event']==u'gpios.gpio.on' and not sensor['on']:
-            #sensor not yet triggered, trigger it
-            self.logger.debug(u'Motion sensor "%s" turned on' % sensor[u'name'])
+        if event[u'event']==u'gpios.gpio.on':
+            with self.__sessions_lock:
+                session = self.__sessions.get(sensor[u'uuid'])
+                if session and session[u'timer']:
+                    #motion detected during hold time, session continues
+                    self.logger.debug(u'Motion sensor "%s" session continues' % sensor[u'name'])
+                    session[u'timer'].cancel()
+                    session[u'timer'] = None
+                    session[u'end'] = None
+                    return
 
-            #motion sensor triggered
-            sensor[u'lastupdate'] = now
-            sensor[u'on'] = True
-            self.update_value(sensor)
+                if not sensor[u'on'] and hold_time>0:
+                    self.__sessions[sensor[u'uuid']] = {
+                        u'duration': 0,
+                        u'end': None,
+                        u'timer': None,
+                    }
 
-            #new motion event
-            self.sensors_motion_on.send(params={
-                u'sensor': sensor[u'name'],
-                u'lastupdate':now
-            }, device_id=sensor[u'uuid'])
+            if not sensor[u'on']:
+                self._motion_on(sensor, now)
 
         elif event[u'event']==u'gpios.gpio.off' and sensor[u'on']:
-            #sensor is triggered, need to stop it
-            self.logger.debug(u'Motion sensor "%s" turned off' % sensor[u'name'])
-
-            #motion sensor triggered
-            sensor[u'lastupdate'] = now
-            sensor[u'on'] = False
-            sensor[u'lastduration'] = event[u'params'][u'duration']
-            self.update_value(sensor)
-
-            #new motion event
-            self.sensors_motion_off.send(params={
-                u'sensor': sensor[u'name'],
-                u'duration': sensor[u'lastduration'],
-                u'lastupdate':now
-            }, device_id=sensor[u'uuid'])
+            if hold_time>0:
+                #wait for hold time before ending session
+                with self.__sessions_lock:
+                    session = self.__sessions.setdefault(sensor[u'uuid'], {
+                        u'duration': 0,
+                        u'end': None,
+                        u'timer': None,
+                    })
+                    session[u'duration'] += event[u'params'][u'duration']
+                    session[u'end'] = now
+                    if session[u'timer']:
+                        session[u'timer'].cancel()
+                    session[u'timer'] = threading.Timer(hold_time, self._end_session, [sensor[u'uuid']])
+                    session[u'timer'].daemon = True
+                    session[u'timer'].start()
+                return
+
+            self._motion_off(sensor, event[u'params'][u'duration'], now)
+
+    def _end_session(self, uuid):
+        """
+        End motion session (hold time elapsed)
+        Session end is performed under sessions lock so motion detected meanwhile starts a new session
+        once sensor is turned off
+
+        Args:
+            uuid (string): sensor uuid
+        """
+        with self.__sessions_lock:
+            session = self.__sessions.get(uuid)
+            if session is None or session[u'end'] is None:
+                #no session or motion detected again (timer fired while being cancelled)
+                return
+            del self.__sessions[uuid]
+
+            #sensor may have been deleted during hold time
+            sensor = self._get_device(uuid)
+            if sensor is None or not sensor[u'on']:
+                return
+
+            self._motion_off(sensor, session[u'duration'], session[u'end'])
+
+    def _motion_on(self, sensor, now):
+        """
+        Turn on motion sensor
+
+        Args:
+            sensor (dict): sensor data
+            now (int): motion timestamp
+        """
+        #sensor not yet triggered, trigger it
+        self.logger.debug(u'Motion sensor "%s" turned on' % sensor[u'name'])
+
+        #motion sensor triggered
+        sensor[u'lastupdate'] = now
+        sensor[u'on'] = True
+        self.update_value(sensor)
+        self._record_value(sensor, 1.0, now)
+
+        #new motion event
+        self.sensors_motion_on.send(params={
+            u'sensor': sensor[u'name'],
+            u'lastupdate':now
+        }, device_id=sensor[u'uuid'])
+
+    def _motion_off(self, sensor, duration, now):
+        """
+        Turn off motion sensor
+
+        Args:
+            sensor (dict): sensor data
+            duration (int): motion duration
+            now (int): motion end timestamp
+        """
+        #sensor is triggered, need to stop it
+        self.logger.debug(u'Motion sensor "%s" turned off' % sensor[u'name'])
+
+        #motion sensor triggered
+        sensor[u'lastupdate'] = now
+        sensor[u'on'] = False
+        sensor[u'lastduration'] = duration
+        self.update_value(sensor)
+        self._record_value(sensor, 0.0, now)
+
+        #new motion event
+        self.sensors_motion_off.send(params={
+            u'sensor': sensor[u'name'],
+            u'duration': sensor[u'lastduration'],
+            u'lastupdate':now
+        }, device_id=sensor[u'uuid'])
+
+    def _stop(self):
+        """
+        Stop addon: end pending motion sessions
+        """
+        with self.__sessions_lock:
+            uuids = list(self.__sessions.keys())
+            for session in self.__sessions.values():
+                if session[u'timer']:
+                    session[u'timer'].cancel()
+
+        for uuid in uuids:
+            self._end_session(uuid)
 
     def _get_task(self, sensor):
         """
@@ -5,9 +5,9 @@ import logging
 from raspiot.utils import MissingParameter, InvalidParameter, CommandError
 from .sensor import Sensor
 from .sensorsutils import SensorsUtils
-from raspiot.libs.internals.task import Task
 from .onewiredriver import OnewireDriver
-import glob
+from .onewirediscovery import OnewireDiscovery
+from multiprocessing.pool import ThreadPool
 import time
 
 class SensorOnewire(Sensor):
@@ -24,6 +24,22 @@ class SensorOnewire(Sensor):
     
     ONEWIRE_PATH = u'/sys/bus/w1/devices/'
     ONEWIRE_SLAVE = u'w1_slave'
+    ONEWIRE_READ_WORKERS = 4
+    ONEWIRE_READ_RETRIES = 2
+    ONEWIRE_INVALID_TEMPERATURES = (u'85000', u'-62')
+    ONEWIRE_BULK_READ = u'w1_bus_master1/therm_bulk_read'
+    ONEWIRE_BULK_READ_TIMEOUT_FACTOR = 2.0
+    ONEWIRE_RESOLUTION = u'resolution'
+    #DS18B20 conversion time (seconds) by resolution (bits)
+    ONEWIRE_CONVERSION_TIMES = {
+        9: 0.094,
+        10: 0.188,
+        11: 0.375,
+        12: 0.75,
+    }
+    ONEWIRE_DEFAULT_RESOLUTION = 12
+    ONEWIRE_MIN_OVERSAMPLING = 5
+    ONEWIRE_DISCOVERY_INTERVAL = 60
     
     def __init__(self, sensors):
         """
@@ -36,12 +52,23 @@ class SensorOnewire(Sensor):
         
         #events
         self.sensors_temperature_update = self._get_event(u'sensors.temperature.update')
+        self.sensors_onewire_lost = self._get_event(u'sensors.onewire.lost')
         
         #drivers
         self.onewire_driver = OnewireDriver(self.cleep_filesystem)
         self._register_driver(self.onewire_driver)
+
+        #bus reads pool (created on first bus read)
+        self.__read_pool = None
+
+        #devices discovery (started when onewire sensor exists or devices are requested)
+        self.__discovery = None
+        self.__discovery_task = None
+
+        #resolution set on each device (resolution is set before first read, not while sensor is validated)
+        self.__resolutions = {}
         
-    def add(self, name, device, path, interval, offset, offset_unit):
+    def add(self, name, device, path, interval, offset, offset_unit, deadband=Sensor.DEFAULT_DEADBAND, heartbeat=Sensor.DEFAULT_HEARTBEAT, adaptive=False, min_interval=None, max_interval=None, oversampling=0, aggregation=SensorsUtils.AGGREGATION_MEAN, resolution=ONEWIRE_DEFAULT_RESOLUTION):
         """
         Return sensor data to add.
         Can perform specific stuff
@@ -74,6 +101,10 @@ class SensorOnewire(Sensor):
             raise MissingParameter(u'Parameter "offset_unit" is missing')
         elif not isinstance(offset_unit, str) or offset_unit not in (SensorsUtils.TEMP_CELSIUS, SensorsUtils.TEMP_FAHRENHEIT):
             raise InvalidParameter(u'Offset_unit must be equal to "celsius" or "fahrenheit"')
+        self._check_filter_params(deadband, heartbeat)
+        self._check_adaptive_params(adaptive, interval, min_interval, max_interval, 60)
+        self._check_oversampling_params(oversampling, aggregation, interval, adaptive, self.ONEWIRE_MIN_OVERSAMPLING)
+        self._check_resolution_param(resolution)
             
         #get 1wire gpio
         gpio_device = self.sensors.send_command(u'get_reserved_gpio', u'gpios', {u'usage': self.USAGE_ONEWIRE})
@@ -90,12 +121,20 @@ class SensorOnewire(Sensor):
             u'interval': interval,
             u'offset': offset,
             u'offsetunit': offset_unit,
+            u'deadband': deadband,
+            u'heartbeat': heartbeat,
+            u'adaptive': adaptive,
+            u'mininterval': min_interval,
+            u'maxinterval': max_interval,
+            u'oversampling': oversampling,
+            u'aggregation': aggregation,
+            u'resolution': resolution,
             u'lastupdate': int(time.time()),
             u'celsius': None,
             u'fahrenheit': None
         }
 
-        #read temperature
+        #read temperature (resolution is set on device by sensor task)
         (tempC, tempF) = self._read_onewire_temperature(sensor)
         sensor[u'celsius'] = tempC
         sensor[u'fahrenheit'] = tempF
@@ -105,7 +144,7 @@ class SensorOnewire(Sensor):
             u'sensors': [sensor,]
         }
 
-    def update(self, sensor, name, interval, offset, offset_unit):
+    def update(self, sensor, name, interval, offset, offset_unit, deadband=None, heartbeat=None, adaptive=None, min_interval=None, max_interval=None, oversampling=None, aggregation=None, resolution=None):
         """
         Returns sensor data to update
         Can perform specific stuff
@@ -137,18 +176,109 @@ class SensorOnewire(Sensor):
             raise MissingParameter(u'Parameter "offset_unit" is missing')
         elif offset_unit not in (SensorsUtils.TEMP_CELSIUS, SensorsUtils.TEMP_FAHRENHEIT):
             raise InvalidParameter(u'Offset_unit value must be either "celsius" or "fahrenheit"')
+        deadband = self._get_update_param(deadband, sensor, u'deadband', self.DEFAULT_DEADBAND)
+        heartbeat = self._get_update_param(heartbeat, sensor, u'heartbeat', self.DEFAULT_HEARTBEAT)
+        adaptive = self._get_update_param(adaptive, sensor, u'adaptive', False)
+        min_interval = self._get_update_param(min_interval, sensor, u'mininterval', None)
+        max_interval = self._get_update_param(max_interval, sensor, u'maxinterval', None)
+        oversampling = self._get_update_param(oversampling, sensor, u'oversampling', 0)
+        aggregation = self._get_update_param(aggregation, sensor, u'aggregation', SensorsUtils.AGGREGATION_MEAN)
+        resolution = self._get_update_param(resolution, sensor, u'resolution', self.ONEWIRE_DEFAULT_RESOLUTION)
+        self._check_filter_params(deadband, heartbeat)
+        self._check_adaptive_params(adaptive, interval, min_interval, max_interval, 60)
+        self._check_oversampling_params(oversampling, aggregation, interval, adaptive, self.ONEWIRE_MIN_OVERSAMPLING)
+        self._check_resolution_param(resolution)
 
         #update sensor
         sensor[u'name'] = name
         sensor[u'interval'] = interval
         sensor[u'offset'] = offset
         sensor[u'offsetunit'] = offset_unit
+        sensor[u'deadband'] = deadband
+        sensor[u'heartbeat'] = heartbeat
+        sensor[u'adaptive'] = adaptive
+        sensor[u'mininterval'] = min_interval
+        sensor[u'maxinterval'] = max_interval
+        sensor[u'oversampling'] = oversampling
+        sensor[u'aggregation'] = aggregation
+        sensor[u'resolution'] = resolution
         
         return {
             u'gpios': [],
             u'sensors': [sensor,]
         }
     
+    def _check_resolution_param(self, resolution):
+        """
+        Check resolution parameter
+
+        Args:
+            resolution (int): conversion resolution (bits)
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        if resolution not in self.ONEWIRE_CONVERSION_TIMES:
+            raise InvalidParameter(u'Resolution must be 9, 10, 11 or 12')
+
+    def _get_conversion_time(self, sensor):
+        """
+        Return sensor temperature conversion time according to its resolution
+
+        Args:
+            sensor (dict): sensor data
+
+        Returns:
+            float: conversion time (seconds)
+        """
+        resolution = sensor.get(u'resolution', self.ONEWIRE_DEFAULT_RESOLUTION)
+        return self.ONEWIRE_CONVERSION_TIMES.get(resolution, self.ONEWIRE_CONVERSION_TIMES[self.ONEWIRE_DEFAULT_RESOLUTION])
+
+    def _apply_onewire_resolution(self, sensor):
+        """
+        Set sensor resolution on device if not already done. Resolution is lost when device is powered off
+        so it is set again after restart or when device is lost
+
+        Args:
+            sensor (dict): sensor data
+        """
+        resolution = sensor.get(u'resolution')
+        if resolution is None or self.__resolutions.get(sensor[u'device'])==resolution:
+            return
+
+        self._set_onewire_resolution(sensor)
+        self.__resolutions[sensor[u'device']] = resolution
+
+    def _set_onewire_resolution(self, sensor):
+        """
+        Set device conversion resolution using w1_therm resolution attribute (available on recent kernels)
+
+        Args:
+            sensor (dict): sensor data
+
+        Returns:
+            bool: True if resolution is set, False if resolution attribute is not available or failed
+        """
+        if u'resolution' not in sensor:
+            return False
+        path = os.path.join(os.path.dirname(sensor[u'path']), self.ONEWIRE_RESOLUTION)
+        if not os.path.exists(path):
+            self.logger.debug(u'Onewire device "%s" resolution is not configurable' % sensor[u'device'])
+            return False
+
+        try:
+            with open(path, u'r') as f:
+                if f.read().strip()==u'%d' % sensor[u'resolution']:
+                    return True
+            with open(path, u'w') as f:
+                f.write(u'%d\n' % sensor[u'resolution'])
+            return True
+
+        except:
+            self.logger.exception(u'Unable to set onewire device "%s" resolution:' % sensor[u'device'])
+
+        return False
+
     def get_onewire_devices(self):
         """
         Scan for devices connected on 1wire bus
@@ -162,20 +292,60 @@ class SensorOnewire(Sensor):
                 }
                 
         """
-        onewires = []
-
-        if not self.onewire_driver.is_installed():
+        if not self._is_driver_installed(self.onewire_driver.name):
             raise CommandError(u'Onewire driver is not installed')
 
-        devices = glob.glob(os.path.join(self.ONEWIRE_PATH, u'28*'))
-        self.logger.debug('Onewire devices: %s' % devices)
-        for device in devices:
-            onewires.append({
-                u'device': os.path.basename(device),
-                u'path': os.path.join(device, self.ONEWIRE_SLAVE)
-            })
+        self._start_discovery()
+        onewires = self._get_discovery().get_devices()
+        self.logger.debug('Onewire devices: %s' % onewires)
 
         return onewires
+
+    def _get_discovery(self):
+        """
+        Return onewire devices discovery instance
+
+        Returns:
+            OnewireDiscovery: discovery instance
+        """
+        if self.__discovery is None:
+            self.__discovery = OnewireDiscovery(self.logger, self.ONEWIRE_PATH, self._on_device_lost)
+        return self.__discovery
+
+    def _start_discovery(self):
+        """
+        Keep discovery cache up to date: watch devices directory if possible and poll it periodically
+        """
+        if self.__discovery_task is not None:
+            return
+
+        discovery = self._get_discovery()
+        discovery.scan()
+        discovery.start_watcher()
+        self.__discovery_task = self._create_task(self.ONEWIRE_DISCOVERY_INTERVAL, discovery.scan)
+        self.__discovery_task.start()
+
+    def _on_device_lost(self, device):
+        """
+        Called when onewire device disappears from bus
+
+        Args:
+            device (dict): device data (see OnewireDiscovery.get_devices)
+        """
+        self.__resolutions.pop(device[u'device'], None)
+        sensor = self._search_device(u'device', device[u'device'])
+        self.sensors_onewire_lost.send(params={
+            u'device': device[u'device'],
+            u'lastseen': device[u'lastseen'],
+        }, device_id=sensor[u'uuid'] if sensor else None)
+
+    def _start(self):
+        """
+        Start addon
+        """
+        sensors = self._search_devices(u'subtype', self.SUBTYPE)
+        if len(sensors)>0:
+            self._start_discovery()
      
     def process_event(self, event, sensor):
         """
@@ -209,6 +379,8 @@ class SensorOnewire(Sensor):
     def _read_onewire_temperature(self, sensor):
         """
         Read temperature from 1wire device
+        Device is read again immediately (ONEWIRE_READ_RETRIES times max) if CRC is invalid or if power-on
+        value is returned: these errors are usually transient on long cable runs
         
         Params:
             sensor (dict): sensor data
@@ -221,39 +393,149 @@ class SensorOnewire(Sensor):
         """
         tempC = None
         tempF = None
+        error = False
+        start = time.time()
 
         try:
-            if os.path.exists(sensor[u'path']):
+            for attempt in range(self.ONEWIRE_READ_RETRIES + 1):
+                if attempt>0:
+                    self._add_read_retry(sensor)
+
+                if not os.path.exists(sensor[u'path']):
+                    #onewire device doesn't exist
+                    raise Exception(u'Onewire device "%s" doesn\'t exist' % sensor[u'path'])
+
                 f = open(sensor[u'path'], u'r')
                 raw = f.readlines()
                 f.close()
-                equals_pos = raw[1].find(u't=')
-
-                if equals_pos!=-1:
-                    tempString = raw[1][equals_pos+2:].strip()
 
-                    #check value
-                    if tempString==u'85000' or tempString==u'-62':
-                        #invalid value
-                        raise Exception(u'Invalid temperature "%s"' % tempString)
+                #check crc
+                if len(raw)<2 or not raw[0].strip().endswith(u'YES'):
+                    self._add_read_crc_error(sensor)
+                    error_message = u'Invalid CRC for onewire "%s"' % sensor[u'path']
+                    continue
 
-                    #convert temperatures
-                    tempC = float(tempString) / 1000.0
-                    (tempC, tempF) = SensorsUtils.convert_temperatures_from_celsius(tempC, sensor[u'offset'], sensor[u'offsetunit'])
-
-                else:
+                equals_pos = raw[1].find(u't=')
+                if equals_pos==-1:
                     #no temperature found in file
                     raise Exception(u'No temperature found for onewire "%s"' % sensor[u'path'])
 
+                #check value
+                tempString = raw[1][equals_pos+2:].strip()
+                if tempString in self.ONEWIRE_INVALID_TEMPERATURES:
+                    #invalid value
+                    error_message = u'Invalid temperature "%s"' % tempString
+                    continue
+
+                #convert temperatures
+                tempC = float(tempString) / 1000.0
+                (tempC, tempF) = SensorsUtils.convert_temperatures_from_celsius(tempC, sensor[u'offset'], sensor[u'offsetunit'])
+                break
+
             else:
-                #onewire device doesn't exist
-                raise Exception(u'Onewire device "%s" doesn\'t exist' % sensor[u'path'])
+                raise Exception(error_message)
 
         except:
-            self.logger.exception(u'Unable to read 1wire device file "%s":' % sensor[u'path'])
+            self._log_read_error(sensor, u'Unable to read 1wire device file "%s":' % sensor[u'path'])
+            error = True
+
+        self._add_read_metrics(sensor, time.time() - start, error)
 
         return (tempC, tempF)
         
+    def _trigger_bulk_conversion(self, conversion_time=None):
+        """
+        Start temperature conversion on all 1wire devices at once using w1 master bulk read attribute
+        (available on recent kernels) and wait for conversion end.
+
+        Args:
+            conversion_time (float): longest conversion time of devices (default 12 bits conversion time)
+
+        Returns:
+            bool: True if conversion succeed, False if bulk read is not available or failed
+        """
+        path = os.path.join(self.ONEWIRE_PATH, self.ONEWIRE_BULK_READ)
+        if not os.path.exists(path):
+            return False
+
+        try:
+            with open(path, u'w') as f:
+                f.write(u'trigger\n')
+
+            #-1 means conversion still in progress
+            if conversion_time is None:
+                conversion_time = self.ONEWIRE_CONVERSION_TIMES[self.ONEWIRE_DEFAULT_RESOLUTION]
+            end = time.time() + conversion_time * self.ONEWIRE_BULK_READ_TIMEOUT_FACTOR
+            while time.time()<end:
+                with open(path, u'r') as f:
+                    if f.read().strip()!=u'-1':
+                        return True
+                time.sleep(0.05)
+            self.logger.warning(u'Onewire bulk conversion timed out')
+
+        except:
+            self.logger.exception(u'Unable to trigger onewire bulk conversion:')
+
+        return False
+
+    def _read_onewire_temperatures(self, sensors):
+        """
+        Read temperatures of several 1wire devices.
+        If bulk conversion is available, conversion is triggered once for all devices and values are read
+        without waiting. Otherwise devices are read concurrently: each conversion takes up to 750ms (according
+        to device resolution) so reading all devices at the same time takes about one conversion time
+
+        Args:
+            sensors (list): list of sensors data
+
+        Returns:
+            list: list of temperature infos (same order than sensors)::
+
+                [(<celsius>, <fahrenheit>), ...]
+
+        """
+        if len(sensors)==1:
+            return [self._read_onewire_temperature(sensors[0])]
+
+        if self._trigger_bulk_conversion(max([self._get_conversion_time(sensor) for sensor in sensors])):
+            return [self._read_onewire_temperature(sensor) for sensor in sensors]
+
+        if self.__read_pool is None:
+            self.__read_pool = ThreadPool(self.ONEWIRE_READ_WORKERS)
+
+        return self.__read_pool.map(self._read_onewire_temperature, sensors)
+
+    def _stop(self):
+        """
+        Stop addon
+        """
+        if self.__read_pool is not None:
+            self.__read_pool.terminate()
+            self.__read_pool = None
+
+        if self.__discovery_task is not None:
+            self.__discovery_task.stop()
+            self.__discovery_task = None
+        if self.__discovery is not None:
+            self.__discovery.stop_watcher()
+
+    def _bus_task(self, tasks_args):
+        """
+        Onewire bus task: read all due sensors at once
+
+        Args:
+            tasks_args (list): list of sensors tasks arguments
+        """
+        sensors = [args[0] for args in tasks_args if self._can_read(args[0])]
+        if len(sensors)==0:
+            return
+        for sensor in sensors:
+            self._apply_onewire_resolution(sensor)
+        temperatures = self._read_onewire_temperatures(sensors)
+        for (sensor, (tempC, tempF)) in zip(sensors, temperatures):
+            self._report_read(sensor, tempC is not None)
+            self._update_temperature(sensor, tempC, tempF)
+
     def _task(self, sensor):
         """
         Onewire sensor task
@@ -261,13 +543,43 @@ class SensorOnewire(Sensor):
         Args:
             sensor (dict): sensor data
         """
+        if not self._can_read(sensor):
+            self.logger.debug(u'Onewire device %s read skipped (failing sensor)' % sensor[u'uuid'])
+            return
+
         #read values
+        self._apply_onewire_resolution(sensor)
         (tempC, tempF) = self._read_onewire_temperature(sensor)
-        
+        self._report_read(sensor, tempC is not None)
+        self._update_temperature(sensor, tempC, tempF)
+
+    def _update_temperature(self, sensor, tempC, tempF):
+        """
+        Update sensor temperature and send update event if value is significant
+
+        Args:
+            sensor (dict): sensor data
+            tempC (float): celsius temperature
+            tempF (float): fahrenheit temperature
+        """
+        now = int(time.time())
+        if sensor.get(u'oversampling'):
+            #report aggregated value once per interval
+            (elapsed, values) = self._oversample(sensor, (tempC, tempF), now)
+            if not elapsed:
+                return
+            (tempC, tempF) = values
+
+        self._record_value(sensor, tempC, now)
+        self._adapt_interval([(sensor, tempC)])
+        if not self._is_significant(sensor, tempC, now):
+            self.logger.debug(u'Onewire device %s value is not significant' % sensor[u'uuid'])
+            return
+
         #update sensor
         sensor[u'celsius'] = tempC
         sensor[u'fahrenheit'] = tempF
-        sensor[u'lastupdate'] = int(time.time())
+        sensor[u'lastupdate'] = now
         if not self.update_value(sensor):
             self.logger.error(u'Unable to update onewire device %s' % sensor['uuid'])
 
@@ -276,16 +588,20 @@ class SensorOnewire(Sensor):
             u'sensor': sensor[u'name'],
             u'celsius': tempC,
             u'fahrenheit': tempF,
-            u'lastupdate': int(time.time())
+            u'lastupdate': now
         }
-        self.sensors_temperature_update.send(params=params, device_id=sensor[u'uuid'])
+        self._send_update_event(self.sensors_temperature_update, sensor, params)
                 
     def _get_task(self, sensor):
         """
-        Return sensor task
+        Return sensor task. Task is started conversion time before its due time so temperature
+        is available at due time
         
         Args:
             sensor (dict): sensor data
         """
-        return Task(float(sensor[u'interval']), self._task, self.logger, [sensor])
+        task = self._create_task(self._get_task_interval(sensor), self._task, [sensor], self._bus_task)
+        task.set_duration(self._get_conversion_time(sensor))
+
+        return task
 
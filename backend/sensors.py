@@ -2,12 +2,20 @@
 # -*- coding: utf-8 -*-
     
 import logging
+import threading
+import time
+import copy
 from raspiot.utils import MissingParameter, InvalidParameter, CommandError
 from raspiot.raspiot import RaspIotModule
-from raspiot.libs.internals.task import Task
+from .sensorsscheduler import SensorsScheduler, SchedulerTask
+from .sensorshistory import SensorsHistory
+from .sensorsstore import SensorsStore
+from .sensorsmetrics import SensorsMetrics
+from .sensorsbreaker import CircuitBreaker
 from .sensormotiongeneric import SensorMotionGeneric
 from .sensordht22 import SensorDht22
 from .sensoronewire import SensorOnewire
+from .sensorsutils import SensorsUtils
 
 __all__ = [u'Sensors']
 
@@ -34,7 +42,14 @@ class Sensors(RaspIotModule):
     MODULE_URLSITE = None
 
     MODULE_CONFIG_FILE = u'sensors.conf'
-    DEFAULT_CONFIG = {}
+    DEFAULT_CONFIG = {
+        u'flushinterval': 300
+    }
+
+    SCHEDULER_WORKERS = 2
+    GPIOS_MIRROR_TTL = 300
+    HISTORY_SIZE = 1440
+    STORE_PATH = u'/var/opt/raspiot/sensors'
 
     def __init__(self, bootstrap, debug_enabled):
         """
@@ -49,10 +64,30 @@ class Sensors(RaspIotModule):
 
         #members
         self._tasks_by_device_uuid = {}
+        self._tasks_references = {}
+        self._sensors_by_gpio_uuid = {}
+        self.__local = threading.local()
+        #local mirror of gpios module state (assigned gpios names and reserved status by gpio uuid)
+        self.__assigned_gpios = None
+        self.__assigned_gpios_timestamp = 0
+        self.__reserved_gpios = {}
+        self.__gpios_lock = threading.Lock()
         self.raspi_gpios = {}
         self.addons_by_name = {}
         self.addons_by_type = {}
         self.sensors_types = {}
+        self._metrics = SensorsMetrics()
+        self._breaker = CircuitBreaker()
+        self._scheduler = SensorsScheduler(self.logger, self.SCHEDULER_WORKERS, self._metrics, self._send_batch_update)
+        self._history = SensorsHistory(self.HISTORY_SIZE)
+        self._store = SensorsStore(self.logger, self.cleep_filesystem, self.STORE_PATH)
+        self._dirty_devices = {}
+        self.__dirty_lock = threading.Lock()
+        self.__devices_lock = threading.Lock()
+        self.__flush_task = None
+
+        #events
+        self.sensors_batch_update = self._get_event(u'sensors.batch.update')
       
         #addons
         self._register_addon(SensorMotionGeneric(self))
@@ -94,6 +129,7 @@ class Sensors(RaspIotModule):
             u'add',
             u'delete',
             u'get_task',
+            u'get_task_sensors',
             u'process_event',
             u'has_drivers',
             u'send_command',
@@ -117,21 +153,50 @@ class Sensors(RaspIotModule):
         for _, addon in self.addons_by_name.items():
             addon.raspi_gpios = self.raspi_gpios
         
-        #launch tasks
+        #index sensors by gpio
         sensors = self.get_module_devices()
+        self._sensors_by_gpio_uuid = {}
         for _, sensor in sensors.items():
+            self._index_sensor_gpios(sensor)
+
+        #launch tasks
+        for _, sensor in sensors.items():
+            if sensor[u'uuid'] in self._tasks_by_device_uuid:
+                #task already started by another sensor (multi sensors device)
+                continue
             addon = self._get_addon(sensor[u'type'], sensor[u'subtype'])
             if addon is None:
                 continue
-            self._start_sensor_task(addon.get_task(sensor), [sensor])
+            self._start_sensor_task(addon.get_task(sensor), addon.get_task_sensors(sensor))
+
+        #start addons
+        for _, addon in self.addons_by_name.items():
+            addon._start()
+
+        #flush sensors values periodically
+        self.__flush_task = self._scheduler.create_task(self._get_config_field(u'flushinterval'), self._flush_sensors_values)
+        self.__flush_task.start()
+
+        #run tasks
+        self._scheduler.start()
 
     def _stop(self):
         """
         Stop module
         """
         #stop tasks
-        for _, task in self._tasks_by_device_uuid.items():
+        for task in self._tasks_references.keys():
             task.stop()
+        if self.__flush_task:
+            self.__flush_task.stop()
+        self._scheduler.stop()
+
+        #stop addons
+        for _, addon in self.addons_by_name.items():
+            addon._stop()
+
+        #save pending sensors values
+        self._flush_sensors_values()
 
     def event_received(self, event):
         """
@@ -149,8 +214,12 @@ class Sensors(RaspIotModule):
         if event[u'event'] in (u'system.driver.install', u'system.driver.uninstall'):
             for _, addon in self.addons_by_name.items():
                 if addon.has_drivers():
+                    addon._invalidate_driver_installed(event.get(u'params', {}).get(u'drivername'))
                     addon.process_event(event, None)
 
+            #drivers may reserve or free gpios
+            self._invalidate_gpios()
+
         #gpio event
         if event[u'event'] in (u'gpios.gpio.on', u'gpios.gpio.off'):
             #drop gpio init
@@ -171,7 +240,9 @@ class Sensors(RaspIotModule):
             addon = self._get_addon(sensor[u'type'], sensor[u'subtype'])
             self.logger.debug(u'Found addon: %s' % addon)
             if addon:
+                start = time.time()
                 addon.process_event(event, sensor)
+                self._metrics.add_latency(addon.__class__.__name__, sensor[u'uuid'], time.time() - start)
 
     def _search_by_gpio(self, gpio_uuid):
         """
@@ -183,15 +254,295 @@ class Sensors(RaspIotModule):
         Returns:
             dict: sensor data or None if nothing found
         """
-        devices = self.get_module_devices()
-        for uuid in devices:
-            for gpio in devices[uuid][u'gpios']:
-                if gpio[u'uuid']==gpio_uuid:
-                    #sensor found
-                    return devices[uuid]
+        sensors_uuids = self._sensors_by_gpio_uuid.get(gpio_uuid)
+        if not sensors_uuids:
+            return None
 
-        #nothing found
-        return None
+        return self._get_device(sensors_uuids[0])
+
+    def _index_sensor_gpios(self, sensor):
+        """
+        Add sensor to gpio uuid index
+
+        Args:
+            sensor (dict): sensor data
+        """
+        for gpio in sensor.get(u'gpios', []):
+            sensors_uuids = self._sensors_by_gpio_uuid.setdefault(gpio[u'uuid'], [])
+            if sensor[u'uuid'] not in sensors_uuids:
+                sensors_uuids.append(sensor[u'uuid'])
+
+    def _unindex_sensor_gpios(self, sensor):
+        """
+        Remove sensor from gpio uuid index
+
+        Args:
+            sensor (dict): sensor data
+        """
+        for gpio in sensor.get(u'gpios', []):
+            sensors_uuids = self._sensors_by_gpio_uuid.get(gpio[u'uuid'])
+            if sensors_uuids is None:
+                continue
+            if sensor[u'uuid'] in sensors_uuids:
+                sensors_uuids.remove(sensor[u'uuid'])
+            if len(sensors_uuids)==0:
+                del self._sensors_by_gpio_uuid[gpio[u'uuid']]
+
+    def _update_sensor_value(self, sensor):
+        """
+        Buffer sensor values update. Values are saved later by _flush_sensors_values to avoid
+        rewriting config file at each sensor reading
+
+        Args:
+            sensor (dict): sensor data
+
+        Returns:
+            bool: True if sensor exists and its values will be saved
+        """
+        if RaspIotModule._get_device(self, sensor[u'uuid']) is None:
+            return False
+
+        with self.__dirty_lock:
+            self._dirty_devices[sensor[u'uuid']] = sensor
+
+        return True
+
+    def _send_batch_update(self, readings):
+        """
+        Send all readings published during a scheduler tick in a single event
+
+        Args:
+            readings (list): list of readings (see Sensor._send_update_event)
+        """
+        self.sensors_batch_update.send(params={u'readings': readings})
+
+    def _drop_sensor_value(self, sensor):
+        """
+        Drop buffered sensor values (sensor updated or deleted)
+
+        Args:
+            sensor (dict): sensor data
+        """
+        with self.__dirty_lock:
+            self._dirty_devices.pop(sensor[u'uuid'], None)
+
+    def _flush_sensors_values(self):
+        """
+        Save all buffered sensors values at once
+        """
+        #append samples to sensors time series
+        self._store.flush()
+
+        with self.__dirty_lock:
+            dirty_devices = self._dirty_devices
+            self._dirty_devices = {}
+
+        if len(dirty_devices)==0:
+            return
+        self.logger.debug(u'Flush %d sensors values' % len(dirty_devices))
+        with self.__devices_lock:
+            devices = self._get_devices()
+            for uuid, sensor in dirty_devices.items():
+                if uuid not in devices:
+                    self.logger.debug(u'Unable to save values of sensor "%s" (maybe deleted)' % uuid)
+                    continue
+                devices[uuid] = sensor
+
+            #single config write for all sensors
+            if not self._update_config({u'devices': devices}):
+                self.logger.error(u'Unable to save sensors values')
+
+    def _add_device(self, data):
+        """
+        Add device (serialized with values flush)
+
+        Args:
+            data (dict): device data
+
+        Returns:
+            dict: added device or None if error occured
+        """
+        with self.__devices_lock:
+            return RaspIotModule._add_device(self, data)
+
+    def _update_device(self, uuid, data):
+        """
+        Update device (serialized with values flush)
+
+        Args:
+            uuid (string): device uuid
+            data (dict): device data
+
+        Returns:
+            bool: True if device updated
+        """
+        with self.__devices_lock:
+            return RaspIotModule._update_device(self, uuid, data)
+
+    def _delete_device(self, uuid):
+        """
+        Delete device (serialized with values flush)
+
+        Args:
+            uuid (string): device uuid
+
+        Returns:
+            bool: True if device deleted
+        """
+        with self.__devices_lock:
+            return RaspIotModule._delete_device(self, uuid)
+
+    def get_module_devices(self):
+        """
+        Return module devices including values not yet saved
+
+        Returns:
+            dict: module devices
+        """
+        devices = RaspIotModule.get_module_devices(self)
+
+        with self.__dirty_lock:
+            for uuid, sensor in self._dirty_devices.items():
+                if uuid in devices:
+                    devices[uuid] = sensor
+
+        return devices
+
+    def _get_device(self, uuid):
+        """
+        Return device including values not yet saved
+
+        Args:
+            uuid (string): device uuid
+
+        Returns:
+            dict: device data or None if device doesn't exist
+        """
+        with self.__dirty_lock:
+            sensor = self._dirty_devices.get(uuid)
+        if sensor is not None:
+            return sensor
+
+        return RaspIotModule._get_device(self, uuid)
+
+    def _search_devices(self, key, value):
+        """
+        Search devices including values not yet saved
+
+        Args:
+            key (string): device field to search on
+            value (any): searched field value
+
+        Returns:
+            list: list of copies of matching devices
+        """
+        return [copy.deepcopy(device) for device in self.get_module_devices().values() if key in device and device[key]==value]
+
+    def _search_device(self, key, value):
+        """
+        Search device including values not yet saved
+
+        Args:
+            key (string): device field to search on
+            value (any): searched field value
+
+        Returns:
+            dict: copy of first matching device or None if not found
+        """
+        devices = self._search_devices(key, value)
+        return devices[0] if len(devices)>0 else None
+
+    def set_flush_interval(self, interval):
+        """
+        Set interval sensors values are saved at
+
+        Args:
+            interval (int): interval in seconds
+        """
+        if interval is None:
+            raise MissingParameter(u'Parameter "interval" is missing')
+        elif not isinstance(interval, int) or interval<10:
+            raise InvalidParameter(u'Parameter "interval" must be greater or equal than 10')
+
+        if not self._update_config({u'flushinterval': interval}):
+            raise CommandError(u'Unable to save configuration')
+
+        #restart flush task
+        if self.__flush_task:
+            self.__flush_task.stop()
+        self.__flush_task = self._scheduler.create_task(interval, self._flush_sensors_values)
+        self.__flush_task.start()
+
+    def get_sensor_history(self, uuid, start=None, end=None, points=None):
+        """
+        Return sensor values history kept in memory
+
+        Args:
+            uuid (string): sensor uuid
+            start (int): history start timestamp (optional)
+            end (int): history end timestamp (optional)
+            points (int): max number of returned points. History is downsampled (min/max/avg) if necessary (optional)
+
+        Returns:
+            list: list of points::
+
+                [
+                    {
+                        timestamp (float): point timestamp
+                        min (float): min value
+                        max (float): max value
+                        avg (float): average value
+                    },
+                    ...
+                ]
+
+        """
+        if not uuid:
+            raise MissingParameter(u'Uuid parameter is missing')
+        elif self._get_device(uuid) is None:
+            raise InvalidParameter(u'Sensor with uuid "%s" doesn\'t exist' % uuid)
+        elif points is not None and (not isinstance(points, int) or points<=0):
+            raise InvalidParameter(u'Parameter "points" must be a positive integer')
+
+        return self._history.get(uuid, start, end, points)
+
+    def get_sensor_archive(self, uuid, start=None, end=None, points=None):
+        """
+        Return sensor values stored on disk
+
+        Args:
+            uuid (string): sensor uuid
+            start (int): range start timestamp (optional)
+            end (int): range end timestamp (optional)
+            points (int): max number of returned points. Values are downsampled (min/max/avg) if necessary (optional)
+
+        Returns:
+            list: list of points (see get_sensor_history)
+        """
+        if not uuid:
+            raise MissingParameter(u'Uuid parameter is missing')
+        elif self._get_device(uuid) is None:
+            raise InvalidParameter(u'Sensor with uuid "%s" doesn\'t exist' % uuid)
+        elif points is not None and (not isinstance(points, int) or points<=0):
+            raise InvalidParameter(u'Parameter "points" must be a positive integer')
+
+        samples = self._store.get(uuid, start, end)
+
+        return SensorsUtils.downsample(samples, points)
+
+    def get_sensors_metrics(self):
+        """
+        Return sensors metrics (reads latency, errors, retries and scheduling lag) and state of failing
+        sensors
+
+        Returns:
+            dict: metrics (see SensorsMetrics.get) with additional breakers field containing failing
+                  sensors circuit state by sensor uuid (see CircuitBreaker.get_state)
+        """
+        metrics = self._metrics.get()
+        metrics[u'breakers'] = self._breaker.get_states()
+
+        return metrics
 
     def get_module_config(self):
         """
@@ -202,13 +553,14 @@ class Sensors(RaspIotModule):
         """
         config = {
             u'drivers': {},
-            u'sensorstypes': self.sensors_types
+            u'sensorstypes': self.sensors_types,
+            u'flushinterval': self._get_config_field(u'flushinterval'),
         }
 
         #add drivers
         for _, addon in self.addons_by_name.items():
-            for driver_name, driver in addon.drivers.items():
-                config[u'drivers'][driver_name] = driver.is_installed()
+            for driver_name in addon.drivers.keys():
+                config[u'drivers'][driver_name] = addon._is_driver_installed(driver_name)
                 
         return config
 
@@ -247,16 +599,107 @@ class Sensors(RaspIotModule):
     def _get_assigned_gpios(self):
         """
         Return assigned gpios
+        Assigned gpios are retrieved from gpios module, then local mirror is updated by sensors
+        gpios operations
+
+        Note:
+            Mirror only follows gpios operations performed by sensors module and driver events: gpios
+            assigned or released by other modules are not seen until mirror expires (GPIOS_MIRROR_TTL
+            seconds). So a gpio found assigned in mirror must be checked again on gpios module before
+            rejecting it (see _expire_assigned_gpios), and a gpio assigned by another module may be
+            accepted until gpios module refuses it when sensor is created.
 
         Returns:
             list: assigned gpios
         """
+        #gpios snapshot used while validating several sensors at once (see add_sensors)
+        snapshot = getattr(self.__local, u'assigned_gpios', None)
+        if snapshot is not None:
+            return snapshot
+
+        with self.__gpios_lock:
+            if self.__assigned_gpios is not None and time.time()<self.__assigned_gpios_timestamp+self.GPIOS_MIRROR_TTL:
+                return list(self.__assigned_gpios)
+
         resp = self.send_command(u'get_assigned_gpios', 'gpios')
         if resp[u'error']:
             self.logger.error(resp[u'message'])
             return []
-        else:
-            return resp[u'data']
+
+        with self.__gpios_lock:
+            self.__assigned_gpios = list(resp[u'data'])
+            self.__assigned_gpios_timestamp = time.time()
+        return resp[u'data']
+
+    def _is_reserved_gpio(self, gpio_uuid):
+        """
+        Return True if specified gpio is reserved. Gpio reserved status never changes so it is
+        requested once to gpios module
+
+        Args:
+            gpio_uuid (string): gpio device uuid
+
+        Returns:
+            bool: True if gpio is reserved
+
+        Raises:
+            CommandError: if gpios module returns error
+        """
+        with self.__gpios_lock:
+            if gpio_uuid in self.__reserved_gpios:
+                return self.__reserved_gpios[gpio_uuid]
+
+        self.logger.debug('is_reserved_gpio for gpio "%s"' % gpio_uuid)
+        resp = self.send_command(u'is_reserved_gpio', u'gpios', {u'gpio': gpio_uuid})
+        self.logger.debug(u'is_reserved_gpio: %s' % resp)
+        if resp[u'error']:
+            raise CommandError(resp[u'message'])
+
+        with self.__gpios_lock:
+            self.__reserved_gpios[gpio_uuid] = resp[u'data']
+        return resp[u'data']
+
+    def _assign_gpio(self, gpio):
+        """
+        Update gpios mirror after gpio was added to gpios module
+
+        Args:
+            gpio (dict): gpio device returned by gpios module
+        """
+        with self.__gpios_lock:
+            if self.__assigned_gpios is not None and gpio[u'gpio'] not in self.__assigned_gpios:
+                self.__assigned_gpios.append(gpio[u'gpio'])
+
+    def _release_gpio(self, gpio):
+        """
+        Update gpios mirror after gpio was deleted from gpios module
+
+        Args:
+            gpio (dict): deleted gpio device
+        """
+        with self.__gpios_lock:
+            if self.__assigned_gpios is not None and gpio.get(u'gpio') in self.__assigned_gpios:
+                self.__assigned_gpios.remove(gpio[u'gpio'])
+            self.__reserved_gpios.pop(gpio[u'uuid'], None)
+
+    def _expire_assigned_gpios(self):
+        """
+        Expire assigned gpios mirror. Next _get_assigned_gpios call will retrieve gpios module state.
+        Gpios snapshot used by add_sensors is kept because it is built from gpios module state
+        """
+        if getattr(self.__local, u'assigned_gpios', None) is not None:
+            return
+
+        with self.__gpios_lock:
+            self.__assigned_gpios = None
+
+    def _invalidate_gpios(self):
+        """
+        Invalidate gpios mirror. It will be retrieved again from gpios module on next use
+        """
+        with self.__gpios_lock:
+            self.__assigned_gpios = None
+            self.__reserved_gpios = {}
             
     def _get_addon(self, type, subtype):
         """
@@ -312,51 +755,172 @@ class Sensors(RaspIotModule):
         sensor_devices = []
         gpio_devices = []
         try:
-            self.logger.debug(u'Addon add with data: %s' % data)
-            (gpios, sensors) = addon.add(**data).values()
-            if not isinstance(gpios, list):
-                raise Exception(u'Invalid gpios type. Must be a list')
-            if not isinstance(sensors, list):
-                raise Exception(u'Invalid sensors type. Must be a list')
+            (gpios, sensors) = self._prepare_sensor(addon, data)
+            self._create_sensor(addon, gpios, sensors, gpio_devices, sensor_devices)
 
-            #add gpios
-            self.logger.debug('gpios=%s' % gpios)
-            for gpio in gpios:
-                self.logger.debug(u'add_gpio with: %s' % gpio)
-                resp_gpio = self.send_command(u'add_gpio', u'gpios', gpio)
-                if resp_gpio[u'error']:
-                    raise CommandError(resp_gpio[u'message'])
-                gpio_devices.append(resp_gpio[u'data'])
-                
-            #fill sensors gpios
-            for sensor_device in sensors:
-                self._fill_sensor_gpios(sensor_device, gpio_devices)
+            return sensor_devices
 
-            #add sensors
+        except:
+            self.logger.exception(u'Error occured adding sensor "%s-%s": %s' % (type, subtype, data))
+            self._undo_add_sensor(gpio_devices, sensor_devices)
+
+            raise CommandError(u'Error occured adding sensor')
+
+    def add_sensors(self, sensors):
+        """
+        Add several sensors at once.
+        All sensors are validated against the same assigned gpios snapshot before anything is created.
+        If one sensor fails to be created, all sensors already created are removed
+
+        Args:
+            sensors (list): list of sensors to add::
+
+                [
+                    {
+                        type (string): sensor type
+                        subtype (string): sensor subtype
+                        data (dict): sensor data (see add_sensor)
+                    },
+                    ...
+                ]
+
+        Returns:
+            list: list of created sensors
+        """
+        if sensors is None:
+            raise MissingParameter(u'Parameter "sensors" is missing')
+        elif not isinstance(sensors, list) or len(sensors)==0:
+            raise InvalidParameter(u'Parameter "sensors" must be a non empty list')
+
+        #validate all sensors
+        prepared = []
+        names = []
+        self._expire_assigned_gpios()
+        self.__local.assigned_gpios = list(self._get_assigned_gpios())
+        try:
             for sensor in sensors:
-                self.logger.debug(u'add_device with: %s' % sensor)
-                sensor_device = self._add_device(sensor)
-                if sensor_device is None:
-                    raise CommandError(u'Unable to save new sensor')
-                sensor_devices.append(sensor_device)
-                
-            #start task
-            self._start_sensor_task(addon.get_task(sensor_devices[0]), sensor_devices)
+                if not isinstance(sensor, dict):
+                    raise InvalidParameter(u'Parameter "sensors" must be a list of dict')
+                addon = self._get_addon(sensor.get(u'type'), sensor.get(u'subtype'))
+                if addon is None:
+                    raise InvalidParameter(u'Sensor subtype "%s" doesn\'t exist' % sensor.get(u'subtype'))
+                data = sensor.get(u'data') or {}
+                if data.get(u'name') in names:
+                    raise InvalidParameter(u'Name "%s" is already used' % data.get(u'name'))
+                (gpios, sensor_devices) = self._prepare_sensor(addon, data)
+
+                #reserve gpios for next sensors validation
+                names.append(data.get(u'name'))
+                self.__local.assigned_gpios.extend([gpio[u'gpio'] for gpio in gpios])
+                prepared.append((addon, gpios, sensor_devices))
+
+        finally:
+            self.__local.assigned_gpios = None
+
+        #create all sensors
+        sensor_devices = []
+        gpio_devices = []
+        try:
+            for (addon, gpios, sensors_) in prepared:
+                self._create_sensor(addon, gpios, sensors_, gpio_devices, sensor_devices)
 
             return sensor_devices
 
         except:
-            self.logger.exception(u'Error occured adding sensor "%s-%s": %s' % (type, subtype, data))
+            self.logger.exception(u'Error occured adding sensors: %s' % sensors)
+            self._undo_add_sensor(gpio_devices, sensor_devices)
+
+            raise CommandError(u'Error occured adding sensors')
+
+    def _prepare_sensor(self, addon, data):
+        """
+        Validate sensor data using addon and return gpios and sensors to create
+
+        Args:
+            addon (Sensor): sensor addon
+            data (dict): sensor data
+
+        Returns:
+            tuple: gpios and sensors data to create::
+
+                (<gpios list>, <sensors list>)
+
+        """
+        self.logger.debug(u'Addon add with data: %s' % data)
+        (gpios, sensors) = addon.add(**data).values()
+        if not isinstance(gpios, list):
+            raise Exception(u'Invalid gpios type. Must be a list')
+        if not isinstance(sensors, list):
+            raise Exception(u'Invalid sensors type. Must be a list')
+
+        return (gpios, sensors)
+
+    def _create_sensor(self, addon, gpios, sensors, gpio_devices, sensor_devices):
+        """
+        Create sensor gpios and devices, then start sensor task.
+        Created gpios and devices are appended to specified lists to undo creation if needed
+
+        Args:
+            addon (Sensor): sensor addon
+            gpios (list): list of gpios data to add
+            sensors (list): list of sensors data to add
+            gpio_devices (list): list created gpios are appended to
+            sensor_devices (list): list created sensors are appended to
+        """
+        #add gpios
+        self.logger.debug('gpios=%s' % gpios)
+        new_gpio_devices = []
+        for gpio in gpios:
+            self.logger.debug(u'add_gpio with: %s' % gpio)
+            resp_gpio = self.send_command(u'add_gpio', u'gpios', gpio)
+            if resp_gpio[u'error']:
+                #gpio may have been assigned by another module
+                self._invalidate_gpios()
+                raise CommandError(resp_gpio[u'message'])
+            gpio_devices.append(resp_gpio[u'data'])
+            new_gpio_devices.append(resp_gpio[u'data'])
+            self._assign_gpio(resp_gpio[u'data'])
             
-            #undo saved gpios
-            for gpio in gpio_devices:
-                self.send_command(u'delete_gpio', u'gpios', {u'uuid': gpio[u'uuid']})
-                
-            #undo saved sensors
-            for sensor in sensor_devices:
-               self._delete_device(sensor[u'uuid']) 
+        #fill sensors gpios
+        for sensor_device in sensors:
+            self._fill_sensor_gpios(sensor_device, new_gpio_devices)
 
-            raise CommandError(u'Error occured adding sensor')
+        #add sensors
+        new_sensor_devices = []
+        for sensor in sensors:
+            self.logger.debug(u'add_device with: %s' % sensor)
+            sensor_device = self._add_device(sensor)
+            if sensor_device is None:
+                raise CommandError(u'Unable to save new sensor')
+            sensor_devices.append(sensor_device)
+            new_sensor_devices.append(sensor_device)
+            self._index_sensor_gpios(sensor_device)
+            
+        #start task
+        self._start_sensor_task(addon.get_task(new_sensor_devices[0]), new_sensor_devices)
+
+    def _undo_add_sensor(self, gpio_devices, sensor_devices):
+        """
+        Undo sensors creation
+
+        Args:
+            gpio_devices (list): list of created gpios to delete
+            sensor_devices (list): list of created sensors to delete
+        """
+        #undo saved gpios
+        for gpio in gpio_devices:
+            resp = self.send_command(u'delete_gpio', u'gpios', {u'uuid': gpio[u'uuid']})
+            if resp[u'error']:
+                self._invalidate_gpios()
+            else:
+                self._release_gpio(gpio)
+            
+        #undo saved sensors
+        for sensor in sensor_devices:
+            if sensor[u'uuid'] in self._tasks_by_device_uuid:
+                self._stop_sensor_task(sensor)
+            self._unindex_sensor_gpios(sensor)
+            self._delete_device(sensor[u'uuid'])
         
     def delete_sensor(self, uuid):
         """
@@ -380,25 +944,21 @@ class Sensors(RaspIotModule):
             raise CommandError(u'Unhandled sensor type "%s-%s"' % (sensor[u'type'], sensor[u'subtype']))
             
         try:
-            #stop task
-            self._stop_sensor_task(sensor)
-            
             (gpios, sensors) = addon.delete(sensor).values()
             if not isinstance(gpios, list):
                 raise Exception(u'Invalid gpios type. Must be a list')
             if not isinstance(sensors, list):
                 raise Exception(u'Invalid sensors type. Must be a list')
+
+            #stop tasks
+            for sensor_ in sensors:
+                self._stop_sensor_task(sensor_)
                                    
             #unconfigure gpios
             self.logger.debug('Gpios=%s' % gpios)
             for gpio in gpios:
                 #is a reserved gpio
-                self.logger.debug('is_reserved_gpio for gpio "%s"' % gpio)
-                resp = self.send_command(u'is_reserved_gpio', u'gpios', {u'gpio': gpio[u'uuid']})
-                self.logger.debug(u'is_reserved_gpio: %s' % resp)
-                if resp[u'error']:
-                    raise CommandError(resp[u'message'])
-                reserved_gpio = resp[u'data']
+                reserved_gpio = self._is_reserved_gpio(gpio[u'uuid'])
                
                 #check if we can delete gpio
                 delete_gpio = True
@@ -415,13 +975,22 @@ class Sensors(RaspIotModule):
                     self.logger.debug(u'Delete gpio "%s" from gpios module' % gpio[u'uuid'])
                     resp = self.send_command(u'delete_gpio', u'gpios', {u'uuid':gpio[u'uuid']})
                     if resp[u'error']:
+                        self._invalidate_gpios()
                         raise CommandError(resp[u'message'])
+                    self._release_gpio(gpio)
                 else:
                     self.logger.debug(u'Gpio device not deleted because other sensor is using it')
 
             #delete sensors
             for sensor in sensors:
+                self._drop_sensor_value(sensor)
+                self._history.delete(sensor[u'uuid'])
+                self._store.delete(sensor[u'uuid'])
+                self._metrics.delete(sensor[u'uuid'])
+                self._breaker.delete(sensor[u'uuid'])
+                addon._forget_sensor(sensor[u'uuid'])
                 self._delete_device(sensor[u'uuid'])
+                self._unindex_sensor_gpios(sensor)
                 self.logger.debug(u'Sensor "%s" deleted successfully' % sensor[u'uuid'])
             
             return True
@@ -460,6 +1029,9 @@ class Sensors(RaspIotModule):
             #sensors = self._search_device(u'name', sensor[u'name'])
             #for sensor in sensors:
             #    data.update(sensor)
+            #keep devices as before update (addon updates them in place) to unindex their previous gpios
+            previous_devices = dict([(device[u'uuid'], copy.deepcopy(device)) for device in self._search_devices(u'name', sensor[u'name'])])
+            previous_devices[sensor[u'uuid']] = copy.deepcopy(sensor)
             data[u'sensor'] = sensor
             (gpios, sensors) = addon.update(**data).values()
             if not isinstance(gpios, list):
@@ -476,15 +1048,19 @@ class Sensors(RaspIotModule):
                 
             #update sensors
             for sensor in sensors:
+                self._drop_sensor_value(sensor)
                 if not self._update_device(sensor[u'uuid'], sensor):
                     raise CommandError(u'Unable to save sensor update')
                 sensor_devices.append(sensor)
+                self._unindex_sensor_gpios(previous_devices.get(sensor[u'uuid'], sensor))
+                self._index_sensor_gpios(sensor)
                 
             #restart sensor task
             task = addon.get_task(sensor)
             if task:
-                self._stop_sensor_task(sensor)
-                self._start_sensor_task(task, [sensor])
+                for sensor in sensors:
+                    self._stop_sensor_task(sensor)
+                self._start_sensor_task(task, addon.get_task_sensors(sensor))
                 
             return sensor_devices
         
@@ -495,45 +1071,55 @@ class Sensors(RaspIotModule):
     def _start_sensor_task(self, task, sensors):
         """
         Start specified sensor task
-        
+        Task is referenced by each sensor it handles and is stopped only when all of them are stopped
+
         Args:
             task (Task): task to start. If None nothing will be done
-            sensor (dict): sensor data
+            sensors (list): list of sensors data handled by task
         """
         #for some sensors there is no task because sensor value is updated by another way (gpio event...)
         if not task:
             self.logger.debug('No task for sensors %s' % sensors)
             return
 
+        #release previous sensors task
+        for sensor in sensors:
+            if self._tasks_by_device_uuid.get(sensor[u'uuid']) not in (None, task):
+                self._stop_sensor_task(sensor)
+
         #save and start task
+        references = self._tasks_references.setdefault(task, set())
         for sensor in sensors:
             self._tasks_by_device_uuid[sensor[u'uuid']] = task
-        self.logger.debug(u'Start task for sensor "%s" [%s]' % (sensor[u'name'], id(task)))
-        task.start()
+            references.add(sensor[u'uuid'])
+        if not task.is_running():
+            self.logger.debug(u'Start task for sensor "%s" [%s]' % (sensors[0][u'name'], id(task)))
+            if isinstance(task, SchedulerTask):
+                #spread sensors tasks over their interval
+                task.set_key(sensors[0][u'uuid'])
+            task.start()
 
     def _stop_sensor_task(self, sensor):
         """
         Stop sensor task
-        sensor name is specified in specific parameter because sensor can contain different name after sensor update
+        Task is really stopped when no other sensor references it
 
         Args:
             sensor (dict): sensor data
         """
-        #search for task
-        task = None
-        for uuid, _task in self._tasks_by_device_uuid.items():
-            if uuid==sensor[u'uuid']:
-                task = _task
+        task = self._tasks_by_device_uuid.pop(sensor[u'uuid'], None)
         if task is None:
             self.logger.warning(u'Sensor "%s" has no task running' % sensor[u'name'])
             return
 
+        #release task reference
+        references = self._tasks_references.get(task, set())
+        references.discard(sensor[u'uuid'])
+        if len(references)>0:
+            self.logger.debug(u'Task for sensor "%s" still used by %d sensor(s) [%s]' % (sensor[u'name'], len(references), id(task)))
+            return
+
         #stop task
         self.logger.debug(u'Stop task for sensor "%s" [%s]' % (sensor[u'name'], id(task)))
+        self._tasks_references.pop(task, None)
         task.stop()
-        
-        #purge not running task
-        for uuid, _task in self._tasks_by_device_uuid.items():
-            if not task.is_running():
-                del self._tasks_by_device_uuid[uuid]
-
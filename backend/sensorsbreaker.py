@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+class CircuitBreaker():
+    """
+    Per sensor circuit breaker
+
+    After FAILURES_THRESHOLD consecutive read failures the sensor circuit is opened: reads are skipped
+    during a backoff period that doubles at each new failure (bounded by MAX_BACKOFF). When backoff
+    expires a single probe read is allowed (half-open state): its success closes the circuit, its failure
+    opens it again for a longer period.
+    """
+
+    STATE_CLOSED = u'closed'
+    STATE_OPEN = u'open'
+    STATE_HALF_OPEN = u'halfopen'
+
+    FAILURES_THRESHOLD = 3
+    MAX_BACKOFF = 3600
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__circuits = {}
+        self.__lock = threading.Lock()
+
+    def allow(self, uuid, now=None):
+        """
+        Check if sensor can be read
+
+        Args:
+            uuid (string): sensor uuid
+            now (float): current timestamp (default time.time())
+
+        Returns:
+            bool: True if sensor can be read
+        """
+        with self.__lock:
+            circuit = self.__circuits.get(uuid)
+            if circuit is None or circuit[u'state']==self.STATE_CLOSED:
+                return True
+
+            if circuit[u'state']==self.STATE_OPEN and (now or time.time())>=circuit[u'retryat']:
+                #backoff expired, allow probe read
+                circuit[u'state'] = self.STATE_HALF_OPEN
+                return True
+
+            return False
+
+    def success(self, uuid):
+        """
+        Report sensor read success
+
+        Args:
+            uuid (string): sensor uuid
+
+        Returns:
+            bool: True if sensor was failing
+        """
+        with self.__lock:
+            circuit = self.__circuits.pop(uuid, None)
+
+        return circuit is not None
+
+    def failure(self, uuid, interval, now=None):
+        """
+        Report sensor read failure
+
+        Args:
+            uuid (string): sensor uuid
+            interval (float): sensor polling interval used as backoff unit (seconds)
+            now (float): current timestamp (default time.time())
+
+        Returns:
+            dict: circuit state (see get_state)
+        """
+        with self.__lock:
+            circuit = self.__circuits.setdefault(uuid, {
+                u'state': self.STATE_CLOSED,
+                u'failures': 0,
+                u'retryat': None,
+            })
+            circuit[u'failures'] += 1
+            if circuit[u'failures']>=self.FAILURES_THRESHOLD:
+                backoff = min(interval * 2**(circuit[u'failures'] - self.FAILURES_THRESHOLD + 1), self.MAX_BACKOFF)
+                circuit[u'state'] = self.STATE_OPEN
+                circuit[u'retryat'] = (now or time.time()) + backoff
+
+            return dict(circuit)
+
+    def get_state(self, uuid):
+        """
+        Return sensor circuit state
+
+        Args:
+            uuid (string): sensor uuid
+
+        Returns:
+            dict: circuit state::
+
+                {
+                    state (string): closed, open or halfopen
+                    failures (int): number of consecutive failures
+                    retryat (float): timestamp of next probe read (None if circuit is closed)
+                }
+
+        """
+        with self.__lock:
+            circuit = self.__circuits.get(uuid)
+            if circuit is None:
+                return {
+                    u'state': self.STATE_CLOSED,
+                    u'failures': 0,
+                    u'retryat': None,
+                }
+
+            return dict(circuit)
+
+    def get_states(self):
+        """
+        Return state of all failing sensors
+
+        Returns:
+            dict: circuits states by sensor uuid (see get_state)
+        """
+        with self.__lock:
+            return dict([(uuid, dict(circuit)) for uuid, circuit in self.__circuits.items()])
+
+    def delete(self, uuid):
+        """
+        Delete sensor circuit
+
+        Args:
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__circuits.pop(uuid, None)
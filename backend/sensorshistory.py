@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from array import array
+from .sensorsutils import SensorsUtils
+
+class RingBuffer():
+    """
+    Fixed size ring buffer of (timestamp, value) samples backed by arrays
+    When buffer is full, oldest samples are overwritten
+    """
+
+    def __init__(self, size):
+        """
+        Constructor
+
+        Args:
+            size (int): max number of samples
+        """
+        self.size = size
+        self.timestamps = array('d', [0.0] * size)
+        self.values = array('d', [0.0] * size)
+        #index of next sample to write
+        self.index = 0
+        self.count = 0
+
+    def append(self, timestamp, value):
+        """
+        Append sample
+
+        Args:
+            timestamp (float): sample timestamp
+            value (float): sample value
+        """
+        self.timestamps[self.index] = timestamp
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        if self.count<self.size:
+            self.count += 1
+
+    def get_samples(self, start=None, end=None):
+        """
+        Return samples in chronological order
+
+        Args:
+            start (float): oldest sample timestamp (included). If None returns from oldest sample
+            end (float): newest sample timestamp (included). If None returns until newest sample
+
+        Returns:
+            list: list of samples (timestamp, value)
+        """
+        samples = []
+        first = (self.index - self.count) % self.size
+        for offset in range(self.count):
+            position = (first + offset) % self.size
+            timestamp = self.timestamps[position]
+            if start is not None and timestamp<start:
+                continue
+            if end is not None and timestamp>end:
+                break
+            samples.append((timestamp, self.values[position]))
+
+        return samples
+
+    def __len__(self):
+        return self.count
+
+class SensorsHistory():
+    """
+    In-memory sensors values history. Each sensor has its own ring buffer so memory is bounded
+    """
+
+    def __init__(self, size):
+        """
+        Constructor
+
+        Args:
+            size (int): max number of samples stored per sensor
+        """
+        self.size = size
+        self.__buffers = {}
+        self.__lock = threading.Lock()
+
+    def add(self, uuid, timestamp, value):
+        """
+        Add sensor value to history
+
+        Args:
+            uuid (string): sensor uuid
+            timestamp (float): value timestamp
+            value (float): sensor value. None values are ignored
+        """
+        if value is None:
+            return
+
+        with self.__lock:
+            if uuid not in self.__buffers:
+                self.__buffers[uuid] = RingBuffer(self.size)
+            self.__buffers[uuid].append(timestamp, float(value))
+
+    def delete(self, uuid):
+        """
+        Delete sensor history
+
+        Args:
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__buffers.pop(uuid, None)
+
+    def get(self, uuid, start=None, end=None, points=None):
+        """
+        Return sensor history, downsampled to specified number of points
+
+        Args:
+            uuid (string): sensor uuid
+            start (float): history start timestamp. If None history starts from oldest sample
+            end (float): history end timestamp. If None history ends at newest sample
+            points (int): max number of returned points. If None all samples are returned
+
+        Returns:
+            list: list of points (chronological order)::
+
+                [
+                    {
+                        timestamp (float): timestamp of first sample of the point
+                        min (float): min value
+                        max (float): max value
+                        avg (float): average value
+                    },
+                    ...
+                ]
+
+        """
+        with self.__lock:
+            if uuid not in self.__buffers:
+                return []
+            samples = self.__buffers[uuid].get_samples(start, end)
+
+        return SensorsUtils.downsample(samples, points)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import bisect
+
+class LatencyHistogram():
+    """
+    Latency histogram with logarithmic buckets (powers of 2 milliseconds)
+    Recording a value only increments a counter so it can be left enabled in production
+    """
+
+    #buckets upper bounds (milliseconds). Last bucket counts values greater than last bound
+    BOUNDS = [2**exponent for exponent in range(16)]
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, duration):
+        """
+        Add latency
+
+        Args:
+            duration (float): duration in seconds
+        """
+        duration = duration * 1000.0
+        self.counts[bisect.bisect_left(self.BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration<self.min:
+            self.min = duration
+        if self.max is None or duration>self.max:
+            self.max = duration
+
+    def to_dict(self):
+        """
+        Return histogram content
+
+        Returns:
+            dict: histogram::
+
+                {
+                    count (int): number of values
+                    min (float): min latency (ms)
+                    max (float): max latency (ms)
+                    avg (float): average latency (ms)
+                    bounds (list): buckets upper bounds (ms)
+                    buckets (list): number of values per bucket (last one for values greater than last bound)
+                }
+
+        """
+        return {
+            u'count': self.count,
+            u'min': self.min,
+            u'max': self.max,
+            u'avg': round(self.total / self.count, 3) if self.count>0 else None,
+            u'bounds': self.BOUNDS,
+            u'buckets': list(self.counts),
+        }
+
+class SensorsMetrics():
+    """
+    Sensors metrics: read latency histograms, errors, retries and CRC errors counts per addon and per sensor,
+    and scheduling lag (delay between task due time and its execution)
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__addons = {}
+        self.__sensors = {}
+        self.__lag = LatencyHistogram()
+        self.__lock = threading.Lock()
+
+    def __get_counters(self, container, key):
+        """
+        Return counters of specified key, creating them if necessary. Lock must be acquired
+        """
+        if key not in container:
+            container[key] = {
+                u'latency': LatencyHistogram(),
+                u'errors': 0,
+                u'retries': 0,
+                u'crcerrors': 0,
+            }
+        return container[key]
+
+    def add_latency(self, addon, uuid, duration):
+        """
+        Add read latency
+
+        Args:
+            addon (string): addon name
+            uuid (string): sensor uuid
+            duration (float): read duration (seconds)
+        """
+        with self.__lock:
+            self.__get_counters(self.__addons, addon)[u'latency'].add(duration)
+            self.__get_counters(self.__sensors, uuid)[u'latency'].add(duration)
+
+    def add_error(self, addon, uuid):
+        """
+        Count read error
+
+        Args:
+            addon (string): addon name
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__get_counters(self.__addons, addon)[u'errors'] += 1
+            self.__get_counters(self.__sensors, uuid)[u'errors'] += 1
+
+    def add_retry(self, addon, uuid):
+        """
+        Count read retry
+
+        Args:
+            addon (string): addon name
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__get_counters(self.__addons, addon)[u'retries'] += 1
+            self.__get_counters(self.__sensors, uuid)[u'retries'] += 1
+
+    def add_crc_error(self, addon, uuid):
+        """
+        Count read CRC error
+
+        Args:
+            addon (string): addon name
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__get_counters(self.__addons, addon)[u'crcerrors'] += 1
+            self.__get_counters(self.__sensors, uuid)[u'crcerrors'] += 1
+
+    def add_lag(self, lag):
+        """
+        Add scheduling lag
+
+        Args:
+            lag (float): delay between task due time and its execution (seconds)
+        """
+        with self.__lock:
+            self.__lag.add(max(lag, 0.0))
+
+    def delete(self, uuid):
+        """
+        Delete sensor metrics
+
+        Args:
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__sensors.pop(uuid, None)
+
+    def get(self):
+        """
+        Return all metrics
+
+        Returns:
+            dict: metrics::
+
+                {
+                    addons (dict): metrics by addon name
+                    sensors (dict): metrics by sensor uuid
+                    lag (dict): scheduling lag histogram
+                }
+
+            with addon and sensor metrics::
+
+                {
+                    latency (dict): latency histogram (see LatencyHistogram.to_dict)
+                    errors (int): number of read errors
+                    retries (int): number of read retries
+                    crcerrors (int): number of read CRC errors
+                }
+
+        """
+        with self.__lock:
+            return {
+                u'addons': dict([(name, self.__to_dict(counters)) for name, counters in self.__addons.items()]),
+                u'sensors': dict([(uuid, self.__to_dict(counters)) for uuid, counters in self.__sensors.items()]),
+                u'lag': self.__lag.to_dict(),
+            }
+
+    def __to_dict(self, counters):
+        """
+        Convert counters to dict
+        """
+        return {
+            u'latency': counters[u'latency'].to_dict(),
+            u'errors': counters[u'errors'],
+            u'retries': counters[u'retries'],
+            u'crcerrors': counters[u'crcerrors'],
+        }
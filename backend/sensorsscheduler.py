@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import heapq
+import itertools
+import time
+import math
+import zlib
+try:
+    from Queue import Queue
+except ImportError: # pragma: no cover
+    from queue import Queue
+
+class SchedulerTask():
+    """
+    Scheduler task
+
+    It exposes the same interface than raspiot Task (start, stop, is_running) so it can be used
+    transparently by sensors module, but instead of running its own thread it is executed by
+    SensorsScheduler workers.
+
+    Tasks with a key are started with a deterministic offset computed from their key, so tasks sharing
+    the same interval are spread over it instead of being executed at the same time. Batched tasks use
+    their batch function name as key so tasks of the same batch keep being due together.
+
+    Tasks with a duration (time needed to acquire a value, like a sensor conversion time) are executed
+    this duration before their due timestamp so value is available at due timestamp.
+    """
+
+    #batched tasks offset is bounded by this period so batches with different intervals stay aligned
+    BATCH_OFFSET_PERIOD = 60.0
+
+    def __init__(self, scheduler, interval, task, task_args=None, batch=None):
+        """
+        Constructor
+
+        Args:
+            scheduler (SensorsScheduler): scheduler instance
+            interval (float): interval between task executions (seconds)
+            task (callable): function to execute
+            task_args (list): task arguments
+            batch (callable): function executed instead of task when several tasks with the same
+                              batch function are due together. It receives list of tasks arguments
+        """
+        self.scheduler = scheduler
+        self.interval = float(interval)
+        self.task = task
+        self.task_args = task_args or []
+        self.batch = batch
+        self.key = None
+        self.duration = 0.0
+        self._running = False
+        #incremented each time task is (re)scheduled to invalidate old heap entries
+        self._generation = 0
+
+    def start(self):
+        """
+        Start task. First execution occurs after task interval, or at task offset within interval if
+        task has a key. Batched tasks are aligned on their interval so tasks of the same batch are due together
+        """
+        self._running = True
+        now = time.time()
+        if self.batch is None and self.key is None:
+            due = now + self.interval
+        else:
+            due = self.__get_aligned_due(now)
+        self.scheduler._schedule(self, due)
+
+    def stop(self):
+        """
+        Stop task
+        """
+        self._running = False
+        self.scheduler._unschedule(self)
+
+    def set_interval(self, interval):
+        """
+        Change task interval. It is applied when task is rescheduled after its next execution
+
+        Args:
+            interval (float): interval between task executions (seconds)
+        """
+        self.interval = float(interval)
+
+    def set_key(self, key):
+        """
+        Set key used to compute task start offset. Must be called before task is started
+
+        Args:
+            key (string): task key (sensor uuid for example)
+        """
+        self.key = key
+
+    def set_duration(self, duration):
+        """
+        Set expected task execution duration. Task is executed this duration before its due timestamp.
+        Duration is bounded by task interval
+
+        Args:
+            duration (float): expected execution duration (seconds)
+        """
+        self.duration = float(duration)
+
+    def _get_start(self, due):
+        """
+        Return task execution timestamp according to its due timestamp and duration
+
+        Args:
+            due (float): due timestamp
+
+        Returns:
+            float: execution timestamp
+        """
+        return due - max(0.0, min(self.duration, self.interval))
+
+    def _get_offset(self):
+        """
+        Return task offset within its interval. Offset only depends on task key (or batch function name)
+        and interval so it is the same after each restart
+
+        Returns:
+            float: offset (seconds)
+        """
+        if self.batch is not None:
+            key = u'%s.%s' % (getattr(self.batch, u'__self__', self.batch).__class__.__name__, getattr(self.batch, u'__name__', u'batch'))
+            period = min(self.interval, self.BATCH_OFFSET_PERIOD)
+        elif self.key is not None:
+            key = self.key
+            period = self.interval
+        else:
+            return 0.0
+
+        ratio = (zlib.crc32(key.encode(u'utf-8')) & 0xffffffff) / float(2**32)
+        return ratio * period
+
+    def __get_aligned_due(self, now):
+        """
+        Return next timestamp aligned on task interval and offset
+
+        Args:
+            now (float): current timestamp
+
+        Returns:
+            float: next execution timestamp
+        """
+        offset = self._get_offset()
+        return (math.floor((now - offset) / self.interval) + 1) * self.interval + offset
+
+    def _get_next_due(self, due, now):
+        """
+        Return next execution timestamp after task execution
+
+        Args:
+            due (float): last execution due timestamp
+            now (float): current timestamp
+
+        Returns:
+            float: next execution timestamp
+        """
+        if self.batch is None:
+            return max(due + self.interval, now)
+
+        #keep batched tasks aligned on their interval (task may be executed before its due time)
+        return self.__get_aligned_due(max(due, now))
+
+    def is_running(self):
+        """
+        Return task status
+
+        Returns:
+            bool: True if task is running
+        """
+        return self._running
+
+class SensorsScheduler():
+    """
+    Sensors tasks scheduler
+
+    All sensors tasks are stored in a min-heap sorted by next execution time. A single dispatcher
+    thread waits for next due task and pushes it to a bounded pool of workers that executes it.
+    Task is rescheduled once its execution is terminated so the same task never runs concurrently.
+
+    Tasks sharing the same batch function and due together are executed in a single batch call
+    (for example to read all sensors of a bus at once). Batched tasks are started together with the
+    longest duration of the batch.
+
+    All tasks due together form a tick: readings reported by tasks during their execution (see
+    add_tick_reading) are collected and passed to tick callback once all tasks of the tick are executed.
+    """
+
+    def __init__(self, logger, workers=2, metrics=None, tick_callback=None):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            workers (int): number of workers executing tasks
+            metrics (SensorsMetrics): metrics instance scheduling lag is reported to (optional)
+            tick_callback (callable): function called with list of readings of a tick (optional)
+        """
+        self.logger = logger
+        self.workers = workers
+        self.metrics = metrics
+        self.tick_callback = tick_callback
+        self.__local = threading.local()
+        self.__ticks_lock = threading.Lock()
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__queue = Queue()
+        self.__threads = []
+        self.__running = False
+
+    def create_task(self, interval, task, task_args=None, batch=None):
+        """
+        Create new task handled by scheduler. Task is not started
+
+        Args:
+            interval (float): interval between task executions (seconds)
+            task (callable): function to execute
+            task_args (list): task arguments
+            batch (callable): batch function (see SchedulerTask)
+
+        Returns:
+            SchedulerTask: scheduler task instance
+        """
+        return SchedulerTask(self, interval, task, task_args, batch)
+
+    def start(self):
+        """
+        Start scheduler dispatcher and workers
+        """
+        if self.__running:
+            return
+
+        self.__running = True
+        dispatcher = threading.Thread(target=self._dispatch, name=u'sensors-scheduler')
+        dispatcher.daemon = True
+        self.__threads.append(dispatcher)
+        for index in range(self.workers):
+            worker = threading.Thread(target=self._work, name=u'sensors-worker-%d' % index)
+            worker.daemon = True
+            self.__threads.append(worker)
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stop scheduler. Currently running tasks are not interrupted
+        """
+        if not self.__running:
+            return
+
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+        for _ in range(self.workers):
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join(1.0)
+        self.__threads = []
+
+    def is_running(self):
+        """
+        Return scheduler status
+
+        Returns:
+            bool: True if scheduler is running
+        """
+        return self.__running
+
+    def get_scheduled_count(self):
+        """
+        Return number of scheduled entries (including invalidated ones not yet purged)
+
+        Returns:
+            int: number of heap entries
+        """
+        return len(self.__heap)
+
+    def add_tick_reading(self, reading):
+        """
+        Add reading to tick of task currently executed by calling thread
+
+        Args:
+            reading (dict): reading data
+
+        Returns:
+            bool: True if reading was added, False if not called from a scheduler task
+        """
+        tick = getattr(self.__local, u'tick', None)
+        if tick is None:
+            return False
+
+        with self.__ticks_lock:
+            tick[u'readings'].append(reading)
+
+        return True
+
+    def _schedule(self, task, due):
+        """
+        Schedule task execution
+
+        Args:
+            task (SchedulerTask): task to schedule
+            due (float): execution timestamp
+        """
+        with self.__condition:
+            self.__push(task, due)
+
+    def __push(self, task, due):
+        """
+        Push task in heap. Condition must be acquired
+
+        Args:
+            task (SchedulerTask): task to schedule
+            due (float): execution timestamp
+        """
+        task._generation += 1
+        heapq.heappush(self.__heap, (task._get_start(due), next(self.__sequence), task, task._generation, due))
+        self.__condition.notify()
+
+    def _unschedule(self, task):
+        """
+        Unschedule task. Heap entry is invalidated and will be dropped by dispatcher
+
+        Args:
+            task (SchedulerTask): task to unschedule
+        """
+        with self.__condition:
+            task._generation += 1
+            #purge heap head to avoid dispatcher waking up for nothing
+            while self.__heap and self.__heap[0][3]!=self.__heap[0][2]._generation:
+                heapq.heappop(self.__heap)
+            self.__condition.notify()
+
+    def _dispatch(self):
+        """
+        Dispatcher loop: wait for next due tasks and push them to workers queue
+        """
+        while True:
+            with self.__condition:
+                if not self.__running:
+                    break
+
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+
+                (start, _, task, generation, _) = self.__heap[0]
+                if generation!=task._generation:
+                    #task stopped or rescheduled
+                    heapq.heappop(self.__heap)
+                    continue
+
+                now = time.time()
+                delay = start - now
+                if delay>0:
+                    self.__condition.wait(delay)
+                    continue
+
+                #pop all started tasks, grouping batched ones
+                items = []
+                batches = {}
+                batches_due = {}
+                while self.__heap and self.__heap[0][0]<=now:
+                    (_, _, task, generation, due) = heapq.heappop(self.__heap)
+                    if generation!=task._generation:
+                        continue
+                    if task.batch is None:
+                        items.append([(due, task, generation)])
+                    elif task.batch in batches:
+                        batches[task.batch].append((due, task, generation))
+                        batches_due[task.batch] = max(batches_due[task.batch], due)
+                    else:
+                        batches[task.batch] = [(due, task, generation)]
+                        batches_due[task.batch] = due
+                        items.append(batches[task.batch])
+
+                #batched tasks due together but with shorter duration are not started yet, run them now
+                if batches:
+                    remaining = []
+                    for entry in self.__heap:
+                        (_, _, task, generation, due) = entry
+                        if generation==task._generation and task.batch in batches and due<=batches_due[task.batch]:
+                            batches[task.batch].append((due, task, generation))
+                        else:
+                            remaining.append(entry)
+                    if len(remaining)!=len(self.__heap):
+                        heapq.heapify(remaining)
+                        self.__heap = remaining
+
+            tick = {
+                u'pending': len(items),
+                u'readings': [],
+            }
+            for item in items:
+                self.__queue.put((item, tick))
+
+    def _work(self):
+        """
+        Worker loop: execute tasks pushed by dispatcher
+        """
+        while True:
+            queued = self.__queue.get()
+            if queued is None:
+                break
+
+            (item, tick) = queued
+            self.__local.tick = tick
+            try:
+                self.__execute(item)
+            finally:
+                self.__local.tick = None
+                self.__end_tick_item(tick)
+
+    def __end_tick_item(self, tick):
+        """
+        Mark one item of tick as executed and call tick callback when all items are executed
+
+        Args:
+            tick (dict): tick data
+        """
+        with self.__ticks_lock:
+            tick[u'pending'] -= 1
+            if tick[u'pending']>0 or len(tick[u'readings'])==0:
+                return
+            readings = tick[u'readings']
+
+        if self.tick_callback:
+            try:
+                self.tick_callback(readings)
+            except:
+                self.logger.exception(u'Exception occured during tick callback execution:')
+
+    def __execute(self, item):
+        """
+        Execute tasks item and reschedule its tasks
+
+        Args:
+            item (list): list of (due, task, generation) to execute
+        """
+        entries = [(due, task, generation) for (due, task, generation) in item if generation==task._generation and task.is_running()]
+        if len(entries)==0:
+            return
+
+        if self.metrics:
+            self.metrics.add_lag(time.time() - min([task._get_start(due) for (due, task, _) in entries]))
+
+        try:
+            if len(entries)==1:
+                entries[0][1].task(*entries[0][1].task_args)
+            else:
+                entries[0][1].batch([task.task_args for (_, task, _) in entries])
+        except:
+            self.logger.exception(u'Exception occured during sensor task execution:')
+
+        #reschedule tasks if they were not stopped or restarted during execution
+        with self.__condition:
+            now = time.time()
+            for (due, task, generation) in entries:
+                if generation==task._generation and task.is_running():
+                    self.__push(task, task._get_next_due(due, now))
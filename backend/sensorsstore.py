@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import threading
+import struct
+import mmap
+import time
+import calendar
+
+class TimeSeriesFile():
+    """
+    Append-only columnar time series file
+
+    Samples are stored in 2 column files with fixed-width records: timestamps (uint32) in
+    <name>.ts and values (float32) in <name>.val. Samples are only appended (sequential writes),
+    timestamps are increasing so ranges are found by binary search on memory-mapped timestamps column.
+    Files are written through cleep filesystem so they can be stored on read-only root filesystem.
+    """
+
+    TIMESTAMP_FORMAT = '<I'
+    VALUE_FORMAT = '<f'
+    TIMESTAMP_SIZE = struct.calcsize(TIMESTAMP_FORMAT)
+    VALUE_SIZE = struct.calcsize(VALUE_FORMAT)
+
+    def __init__(self, cleep_filesystem, path):
+        """
+        Constructor
+
+        Args:
+            cleep_filesystem (CleepFilesystem): cleep filesystem instance
+            path (string): files path without extension
+        """
+        self.cleep_filesystem = cleep_filesystem
+        self.timestamps_path = path + u'.ts'
+        self.values_path = path + u'.val'
+        self.last_timestamp = None
+        self.__repair()
+
+    def __repair(self):
+        """
+        Align columns length (interrupted append) and load last timestamp
+        """
+        timestamps_count = self.__get_count(self.timestamps_path, self.TIMESTAMP_SIZE)
+        values_count = self.__get_count(self.values_path, self.VALUE_SIZE)
+        count = min(timestamps_count, values_count)
+        for (path, size) in ((self.timestamps_path, self.TIMESTAMP_SIZE), (self.values_path, self.VALUE_SIZE)):
+            if os.path.exists(path) and os.path.getsize(path)!=count * size:
+                fd = self.cleep_filesystem.open(path, u'r+b')
+                try:
+                    fd.truncate(count * size)
+                finally:
+                    self.cleep_filesystem.close(fd)
+
+        if count>0:
+            with open(self.timestamps_path, 'rb') as f:
+                f.seek((count - 1) * self.TIMESTAMP_SIZE)
+                self.last_timestamp = struct.unpack(self.TIMESTAMP_FORMAT, f.read(self.TIMESTAMP_SIZE))[0]
+
+    def __get_count(self, path, size):
+        """
+        Return number of complete records in column file
+        """
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // size
+
+    def __write(self, path, data):
+        """
+        Append data to column file
+        """
+        fd = self.cleep_filesystem.open(path, u'ab')
+        try:
+            fd.write(data)
+        finally:
+            self.cleep_filesystem.close(fd)
+
+    def append(self, samples):
+        """
+        Append samples at end of file. Samples older than last stored sample are dropped
+
+        Args:
+            samples (list): list of samples (timestamp, value) in chronological order
+
+        Returns:
+            int: number of appended samples
+        """
+        timestamps = []
+        values = []
+        for (timestamp, value) in samples:
+            timestamp = int(timestamp)
+            if self.last_timestamp is not None and timestamp<self.last_timestamp:
+                continue
+            timestamps.append(struct.pack(self.TIMESTAMP_FORMAT, timestamp))
+            values.append(struct.pack(self.VALUE_FORMAT, value))
+            self.last_timestamp = timestamp
+
+        if len(timestamps)==0:
+            return 0
+
+        #values first: a missing value is truncated at next open
+        self.__write(self.values_path, b''.join(values))
+        self.__write(self.timestamps_path, b''.join(timestamps))
+
+        return len(timestamps)
+
+    def __bisect(self, timestamps, count, timestamp):
+        """
+        Return index of first sample with timestamp greater or equal than specified one
+        """
+        low = 0
+        high = count
+        while low<high:
+            middle = (low + high) // 2
+            if struct.unpack_from(self.TIMESTAMP_FORMAT, timestamps, middle * self.TIMESTAMP_SIZE)[0]<timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_samples(self, start=None, end=None):
+        """
+        Return samples within specified range
+
+        Args:
+            start (int): range start timestamp (included). If None from first sample
+            end (int): range end timestamp (included). If None until last sample
+
+        Returns:
+            list: list of samples (timestamp, value)
+        """
+        count = min(self.__get_count(self.timestamps_path, self.TIMESTAMP_SIZE), self.__get_count(self.values_path, self.VALUE_SIZE))
+        if count==0:
+            return []
+
+        with open(self.timestamps_path, 'rb') as timestamps_file, open(self.values_path, 'rb') as values_file:
+            timestamps = mmap.mmap(timestamps_file.fileno(), 0, access=mmap.ACCESS_READ)
+            values = mmap.mmap(values_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                first = 0 if start is None else self.__bisect(timestamps, count, int(start))
+                last = count if end is None else self.__bisect(timestamps, count, int(end) + 1)
+                samples = []
+                for index in range(first, last):
+                    samples.append((
+                        struct.unpack_from(self.TIMESTAMP_FORMAT, timestamps, index * self.TIMESTAMP_SIZE)[0],
+                        struct.unpack_from(self.VALUE_FORMAT, values, index * self.VALUE_SIZE)[0],
+                    ))
+            finally:
+                timestamps.close()
+                values.close()
+
+        return samples
+
+    def delete(self):
+        """
+        Delete files
+        """
+        for path in (self.timestamps_path, self.values_path):
+            if os.path.exists(path):
+                self.cleep_filesystem.rm(path)
+
+class SensorTimeSeries():
+    """
+    Time series of a single sensor split in monthly segments (one TimeSeriesFile per UTC month) stored
+    in sensor directory. Retention deletes oldest segments so stored samples are never rewritten
+    """
+
+    SEGMENT_FORMAT = u'%Y%m'
+
+    def __init__(self, cleep_filesystem, path, max_segments=None):
+        """
+        Constructor
+
+        Args:
+            cleep_filesystem (CleepFilesystem): cleep filesystem instance
+            path (string): sensor directory
+            max_segments (int): max number of segments (months) kept. Unlimited if None
+        """
+        self.cleep_filesystem = cleep_filesystem
+        self.path = path
+        self.max_segments = max_segments
+        self.__segments = {}
+        self.__names = self.__get_segments_names()
+        self.last_timestamp = self.__get_segment(self.__names[-1]).last_timestamp if self.__names else None
+
+    def __get_segments_names(self):
+        """
+        Return sorted names of existing segments
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(set([os.path.splitext(filename)[0] for filename in os.listdir(self.path)]))
+
+    def __get_segment(self, name):
+        """
+        Return segment time series file
+        """
+        if name not in self.__segments:
+            self.__segments[name] = TimeSeriesFile(self.cleep_filesystem, os.path.join(self.path, name))
+        return self.__segments[name]
+
+    def __get_segment_range(self, name):
+        """
+        Return segment time range
+
+        Returns:
+            tuple: segment start timestamp (included) and segment end timestamp (excluded)
+        """
+        (year, month) = (int(name[:4]), int(name[4:]))
+        (next_year, next_month) = (year + 1, 1) if month==12 else (year, month + 1)
+        return (calendar.timegm((year, month, 1, 0, 0, 0)), calendar.timegm((next_year, next_month, 1, 0, 0, 0)))
+
+    def append(self, samples):
+        """
+        Append samples to their month segment. Samples older than last stored sample are dropped
+
+        Args:
+            samples (list): list of samples (timestamp, value) in chronological order
+
+        Returns:
+            int: number of appended samples
+        """
+        groups = []
+        for (timestamp, value) in samples:
+            timestamp = int(timestamp)
+            if self.last_timestamp is not None and timestamp<self.last_timestamp:
+                continue
+            self.last_timestamp = timestamp
+            name = time.strftime(self.SEGMENT_FORMAT, time.gmtime(timestamp))
+            if len(groups)==0 or groups[-1][0]!=name:
+                groups.append((name, []))
+            groups[-1][1].append((timestamp, value))
+
+        appended = 0
+        for (name, segment_samples) in groups:
+            if name not in self.__names:
+                if not os.path.exists(self.path):
+                    self.cleep_filesystem.mkdirs(self.path)
+                self.__names.append(name)
+            appended += self.__get_segment(name).append(segment_samples)
+
+        #retention
+        while self.max_segments is not None and len(self.__names)>self.max_segments:
+            name = self.__names.pop(0)
+            self.__get_segment(name).delete()
+            del self.__segments[name]
+
+        return appended
+
+    def get_samples(self, start=None, end=None):
+        """
+        Return samples within specified range
+
+        Args:
+            start (int): range start timestamp (included). If None from first sample
+            end (int): range end timestamp (included). If None until last sample
+
+        Returns:
+            list: list of samples (timestamp, value)
+        """
+        samples = []
+        for name in self.__names:
+            (segment_start, segment_end) = self.__get_segment_range(name)
+            if (start is not None and segment_end<=start) or (end is not None and segment_start>end):
+                continue
+            samples.extend(self.__get_segment(name).get_samples(start, end))
+
+        return samples
+
+    def delete(self):
+        """
+        Delete sensor directory
+        """
+        if os.path.exists(self.path):
+            self.cleep_filesystem.rmdir(self.path)
+        self.__segments = {}
+        self.__names = []
+        self.last_timestamp = None
+
+class SensorsStore():
+    """
+    On-disk sensors values store (one SensorTimeSeries per sensor)
+    Samples are kept in memory until flush to write them in a single append per sensor.
+    Sensor directory is only created when samples are written
+    """
+
+    #one year of samples (current month and 12 previous months, ~350KB per month at one sample per minute)
+    MAX_SEGMENTS = 13
+
+    def __init__(self, logger, cleep_filesystem, path, max_segments=MAX_SEGMENTS):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            cleep_filesystem (CleepFilesystem): cleep filesystem instance
+            path (string): directory where files are stored
+            max_segments (int): max number of monthly segments kept per sensor
+        """
+        self.logger = logger
+        self.cleep_filesystem = cleep_filesystem
+        self.path = path
+        self.max_segments = max_segments
+        self.__files = {}
+        self.__pending = {}
+        self.__lock = threading.Lock()
+
+    def __get_file(self, uuid):
+        """
+        Return sensor time series. Lock must be acquired
+        """
+        if uuid not in self.__files:
+            self.__files[uuid] = SensorTimeSeries(self.cleep_filesystem, os.path.join(self.path, uuid), self.max_segments)
+        return self.__files[uuid]
+
+    def add(self, uuid, timestamp, value):
+        """
+        Add sensor sample. Sample is written at next flush
+
+        Args:
+            uuid (string): sensor uuid
+            timestamp (int): sample timestamp
+            value (float): sample value. None values are ignored
+        """
+        if value is None:
+            return
+
+        with self.__lock:
+            self.__pending.setdefault(uuid, []).append((int(timestamp), float(value)))
+
+    def flush(self):
+        """
+        Write pending samples
+        """
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = {}
+
+            for uuid, samples in pending.items():
+                try:
+                    self.__get_file(uuid).append(samples)
+                except:
+                    self.logger.exception(u'Unable to store values of sensor "%s":' % uuid)
+
+    def get(self, uuid, start=None, end=None):
+        """
+        Return sensor samples within specified range (including pending samples)
+
+        Args:
+            uuid (string): sensor uuid
+            start (int): range start timestamp (included)
+            end (int): range end timestamp (included)
+
+        Returns:
+            list: list of samples (timestamp, value)
+        """
+        with self.__lock:
+            samples = self.__get_file(uuid).get_samples(start, end)
+            for (timestamp, value) in self.__pending.get(uuid, []):
+                if (start is None or timestamp>=start) and (end is None or timestamp<=end):
+                    samples.append((timestamp, value))
+
+        return samples
+
+    def delete(self, uuid):
+        """
+        Delete sensor samples
+
+        Args:
+            uuid (string): sensor uuid
+        """
+        with self.__lock:
+            self.__pending.pop(uuid, None)
+            try:
+                ts_file = self.__files.pop(uuid, None) or SensorTimeSeries(self.cleep_filesystem, os.path.join(self.path, uuid))
+                ts_file.delete()
+            except:
+                self.logger.exception(u'Unable to delete values of sensor "%s":' % uuid)
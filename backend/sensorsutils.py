@@ -9,6 +9,12 @@ class SensorsUtils():
     TEMP_CELSIUS = 'celsius'
     TEMP_FAHRENHEIT = 'fahrenheit'
 
+    AGGREGATION_MEAN = 'mean'
+    AGGREGATION_MEDIAN = 'median'
+    AGGREGATION_MIN = 'min'
+    AGGREGATION_MAX = 'max'
+    AGGREGATIONS = [AGGREGATION_MEAN, AGGREGATION_MEDIAN, AGGREGATION_MIN, AGGREGATION_MAX]
+
     @staticmethod
     def convert_temperatures_from_celsius(celsius, offset, offset_unit):
         """
@@ -43,6 +49,77 @@ class SensorsUtils():
 
         return (round(tempC,2), round(tempF,2))
 
+    @staticmethod
+    def downsample(samples, points):
+        """
+        Downsample samples to specified number of points. Samples time range is split in buckets of
+        same duration and each bucket is reduced to min/max/avg values
+
+        Args:
+            samples (list): list of samples (timestamp, value) in chronological order
+            points (int): max number of points. If None all samples are returned
+
+        Returns:
+            list: list of points::
+
+                [
+                    {
+                        timestamp (float): timestamp of first sample of the point
+                        min (float): min value
+                        max (float): max value
+                        avg (float): average value
+                    },
+                    ...
+                ]
+
+        """
+        if points is None or len(samples)<=points:
+            return [{u'timestamp': timestamp, u'min': value, u'max': value, u'avg': value} for (timestamp, value) in samples]
+
+        first = samples[0][0]
+        duration = (samples[-1][0] - first) or 1.0
+        buckets = []
+        current = None
+        for (timestamp, value) in samples:
+            bucket = min(int((timestamp - first) * points / duration), points - 1)
+            if current is None or current[0]!=bucket:
+                current = [bucket, timestamp, value, value, 0.0, 0]
+                buckets.append(current)
+            current[2] = min(current[2], value)
+            current[3] = max(current[3], value)
+            current[4] += value
+            current[5] += 1
+
+        return [{u'timestamp': ts, u'min': min_, u'max': max_, u'avg': round(total / count, 2)} for (_, ts, min_, max_, total, count) in buckets]
+
+    @staticmethod
+    def aggregate(values, aggregation):
+        """
+        Reduce values to a single value
+
+        Args:
+            values (list): list of values (None values are ignored)
+            aggregation (string): aggregation method (mean, median, min or max)
+
+        Returns:
+            float: aggregated value or None if there is no value
+        """
+        values = sorted([value for value in values if value is not None])
+        if len(values)==0:
+            return None
+
+        if aggregation==SensorsUtils.AGGREGATION_MEDIAN:
+            middle = len(values) // 2
+            value = values[middle] if len(values)%2==1 else (values[middle - 1] + values[middle]) / 2.0
+        elif aggregation==SensorsUtils.AGGREGATION_MIN:
+            value = values[0]
+        elif aggregation==SensorsUtils.AGGREGATION_MAX:
+            value = values[-1]
+        else:
+            value = sum(values) / float(len(values))
+
+        return round(value, 2)
+
     @staticmethod
     def convert_temperatures_from_fahrenheit(fahrenheit, offset, offset_unit):
         """
@@ -31,6 +31,13 @@ var sensorsService = function($q, $rootScope, rpcService, raspiotService) {
         return rpcService.sendCommand('add_sensor', 'sensors', {'type': type, 'subtype': subtype, 'data': data});
     };
 
+    /**
+     * Add several sensors at once
+     */
+    self.addSensors = function(sensors) {
+        return rpcService.sendCommand('add_sensors', 'sensors', {'sensors': sensors});
+    };
+
     /**
      * Delete sensor
      */
@@ -52,6 +59,34 @@ var sensorsService = function($q, $rootScope, rpcService, raspiotService) {
         return rpcService.sendCommand('get_onewire_devices', 'sensors');
     };
 
+    /**
+     * Get sensor values history
+     */
+    self.getSensorHistory = function(uuid, start, end, points) {
+        return rpcService.sendCommand('get_sensor_history', 'sensors', {'uuid': uuid, 'start': start, 'end': end, 'points': points});
+    };
+
+    /**
+     * Get sensor values stored on device
+     */
+    self.getSensorArchive = function(uuid, start, end, points) {
+        return rpcService.sendCommand('get_sensor_archive', 'sensors', {'uuid': uuid, 'start': start, 'end': end, 'points': points});
+    };
+
+    /**
+     * Set interval sensors values are saved at
+     */
+    self.setFlushInterval = function(interval) {
+        return rpcService.sendCommand('set_flush_interval', 'sensors', {'interval': interval});
+    };
+
+    /**
+     * Get sensors metrics (reads latency, errors, scheduling lag)
+     */
+    self.getSensorsMetrics = function() {
+        return rpcService.sendCommand('get_sensors_metrics', 'sensors');
+    };
+
     /**
      * Catch motion on event
      */
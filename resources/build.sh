@@ -1,4 +1,5 @@
 #!/bin/bash
 
 gcc -o ../scripts/dht22 dht22.c -lwiringPi
+/bin/cp -f dht22.c ../scripts/
 
@@ -106,41 +106,31 @@ short readData(unsigned short signal)
 
 void toJson(float celsius, float humidity, const char* error) {
     printf("{\"celsius\": %0.2f, \"humidity\": %0.2f, \"error\": \"%s\"}\n", celsius, humidity, error);
+    fflush(stdout);
 }
 
 void usage() {
-    printf("Usage: ./dht22 <pin>\n");
-    printf(" - pin  : raspberry pi physical pin number where sensor is connected to.\n");
+    printf("Usage: ./dht22 <pin>|--daemon\n");
+    printf(" - pin      : raspberry pi physical pin number where sensor is connected to.\n");
+    printf(" - --daemon : read pin numbers from stdin (one per line) and write one json result per line.\n");
 }
 
-int main(int argc, char* argv[])
+void readSensor(unsigned short signal)
 {
     float humidity;
     float celsius;
     // float fahrenheit;
     short checksum;
-    unsigned short signal;
     unsigned char valid = 0;
 
-    // parameters
-    if ( argc!=2 ) { 
-        usage();
-        return 1;
-    }
-
-    // get pin number
-    sscanf(argv[1], "%d", &signal);
-
-    // GPIO Initialization
-    if (wiringPiSetupPhys() == -1)
-    {
-        // printf("[x_x] GPIO Initialization FAILED.\n");
-        toJson(0.0, 0.0, GPIO_INIT_FAILED);
-        return -126;
-    }
-
     for (unsigned char i = 0; i < MAX_RETRIES; i++)
     {
+        // Initialize data array (may contain previous read values)
+        for (unsigned char j = 0; j < 5; j++)
+        {
+            data[j] = 0;
+        }
+
         pinMode(signal, OUTPUT);
 
         // Send out start signal
@@ -183,18 +173,55 @@ int main(int argc, char* argv[])
             // printf("[x_x] Invalid Data. Try again.\n\n");
         }
 
-        // Initialize data array for next loop
-        for (unsigned char i = 0; i < 5; i++)
-        {
-            data[i] = 0;
-        }
-
         delay(2000);    // DHT22 average sensing period is 2 seconds
     }
             
     if (!valid) {
         toJson(0.0, 0.0, NO_DATA);
     }
+}
+
+int main(int argc, char* argv[])
+{
+    unsigned short signal;
+    char line[32];
+
+    // parameters
+    if ( argc!=2 ) { 
+        usage();
+        return 1;
+    }
+
+    // GPIO Initialization (done once, even in daemon mode)
+    if (wiringPiSetupPhys() == -1)
+    {
+        // printf("[x_x] GPIO Initialization FAILED.\n");
+        toJson(0.0, 0.0, GPIO_INIT_FAILED);
+        return -126;
+    }
+
+    if (strcmp(argv[1], "--daemon") == 0)
+    {
+        // daemon mode: one request per line until stdin is closed
+        while (fgets(line, sizeof(line), stdin) != NULL)
+        {
+            if (sscanf(line, "%hu", &signal) != 1)
+            {
+                toJson(0.0, 0.0, INVALID_GPIO);
+                continue;
+            }
+            readSensor(signal);
+        }
+        return 0;
+    }
+
+    // get pin number
+    if (sscanf(argv[1], "%hu", &signal) != 1)
+    {
+        toJson(0.0, 0.0, INVALID_GPIO);
+        return 1;
+    }
+    readSensor(signal);
 
     return 0;
 }
@@ -10,6 +10,12 @@ trap 'echo "\"${last_command}\" command failed with exit code $?."' ERR
 # main
 apt update
 apt install wiringpi
+# build dht22 binary from sources, prebuilt binary is kept if build fails
+if gcc -o dht22.build dht22.c -lwiringPi; then
+    /bin/mv -f dht22.build dht22
+else
+    echo "Unable to build dht22 binary, prebuilt one is installed"
+fi
 chmod +x dht22
 /bin/cp -f dht22 /usr/local/bin/
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sensors module micro-benchmarks
+
+Usage:
+    python bench_sensors.py [output.json]
+
+Results are printed and written as json (default bench_sensors.json) to compare runs::
+
+    {
+        <benchmark name>: {
+            iterations (int): number of calls
+            total (float): total duration (seconds)
+            percall (float): mean duration of a call (microseconds)
+            persecond (float): calls per second
+        },
+        ...
+    }
+
+"""
+
+import logging
+import sys, os
+import shutil
+import json
+import timeit
+import itertools
+sys.path.append('../')
+from backend.sensors import Sensors
+from backend.sensorsutils import SensorsUtils
+from raspiot.libs.tests import session
+
+DEVICES_COUNTS = [10, 100, 1000]
+ONEWIRE_PATH = '/tmp/bench_onewire'
+
+class SensorsBenchmark():
+
+    def __init__(self):
+        self.results = {}
+        self.uuids = itertools.count()
+        self.session = session.TestSession(logging.CRITICAL)
+        self.session.mock_command('get_raspi_gpios', lambda: {'error': False, 'data': {'GPIO18': 12}})
+        self.session.mock_command('get_assigned_gpios', lambda: {'error': False, 'data': []})
+        self.session.mock_command('is_gpio_on', lambda: {'error': False, 'data': False})
+        self.session.mock_command('is_reserved_gpio', lambda: {'error': False, 'data': False})
+        self.session.mock_command('delete_gpio', lambda: {'error': False, 'data': True})
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module = self.session.setup(Sensors)
+
+    def __add_gpio(self):
+        return {
+            'error': False,
+            'data': {
+                'uuid': 'gpio-%d' % next(self.uuids),
+                'pin': 12,
+                'gpio': 'GPIO18',
+            }
+        }
+
+    def clean(self):
+        self.session.clean()
+        if os.path.exists(ONEWIRE_PATH):
+            shutil.rmtree(ONEWIRE_PATH)
+
+    def measure(self, name, func, iterations):
+        """
+        Measure func duration and store result
+        """
+        start = timeit.default_timer()
+        for _ in range(iterations):
+            func()
+        total = timeit.default_timer() - start
+
+        self.results[name] = {
+            'iterations': iterations,
+            'total': total,
+            'percall': total / iterations * 1000000.0,
+            'persecond': iterations / total if total>0 else None,
+        }
+        print('%-45s %10d calls %12.2f us/call' % (name, iterations, self.results[name]['percall']))
+
+    def populate(self, count):
+        """
+        Replace module devices by count motion sensors
+
+        Returns:
+            list: list of created sensors
+        """
+        for uuid in list(self.module._get_devices().keys()):
+            self.module._delete_device(uuid)
+        self.module._sensors_by_gpio_uuid = {}
+
+        sensors = []
+        for index in range(count):
+            gpio_uuid = 'gpio-%d' % next(self.uuids)
+            sensor = self.module._add_device({
+                'name': 'motion%d' % index,
+                'type': 'motion',
+                'subtype': 'generic',
+                'gpios': [{'uuid': gpio_uuid, 'pin': 12, 'gpio': 'GPIO%d' % index}],
+                'on': False,
+                'inverted': False,
+                'lastupdate': 0,
+                'lastduration': 0,
+            })
+            self.module._index_sensor_gpios(sensor)
+            sensors.append(sensor)
+
+        return sensors
+
+    def bench_lookups(self):
+        for count in DEVICES_COUNTS:
+            sensors = self.populate(count)
+            last = sensors[-1]
+            self.measure('search_by_gpio[%d]' % count, lambda: self.module._search_by_gpio(last['gpios'][0]['uuid']), 1000)
+            self.measure('search_by_gpio_unknown[%d]' % count, lambda: self.module._search_by_gpio('unknown'), 1000)
+            self.measure('get_gpio_uses[%d]' % count, lambda: self.module._get_gpio_uses(last['gpios'][0]['gpio']), 100)
+
+    def bench_event_received(self):
+        for count in DEVICES_COUNTS:
+            sensors = self.populate(count)
+            gpio_uuid = sensors[-1]['gpios'][0]['uuid']
+            events = itertools.cycle([
+                {'event': 'gpios.gpio.on', 'startup': False, 'device_id': gpio_uuid, 'params': {'init': False}},
+                {'event': 'gpios.gpio.off', 'startup': False, 'device_id': gpio_uuid, 'params': {'init': False, 'duration': 1}},
+            ])
+            unrelated = {'event': 'gpios.gpio.on', 'startup': False, 'device_id': 'unknown', 'params': {'init': False}}
+            self.measure('event_received_motion[%d]' % count, lambda: self.module.event_received(next(events)), 1000)
+            self.measure('event_received_unrelated[%d]' % count, lambda: self.module.event_received(unrelated), 1000)
+
+    def bench_add_delete_sensor(self):
+        self.populate(0)
+        names = itertools.count()
+        created = []
+        def add():
+            created.extend(self.module.add_sensor('motion', 'generic', {'name': 'bench%d' % next(names), 'gpio': 'GPIO18', 'inverted': False}))
+        def delete():
+            self.module.delete_sensor(created.pop()['uuid'])
+        self.measure('add_sensor', add, 100)
+        self.measure('delete_sensor', delete, 100)
+
+    def bench_convert_temperatures(self):
+        self.measure('convert_temperatures_from_celsius', lambda: SensorsUtils.convert_temperatures_from_celsius(21.5, 0.5, SensorsUtils.TEMP_CELSIUS), 100000)
+
+    def bench_read_onewire_temperature(self):
+        addon = self.module.addons_by_name['SensorOnewire']
+        addon.ONEWIRE_PATH = ONEWIRE_PATH
+        path = os.path.join(ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('7c 01 4b 46 7f ff 04 10 09 : crc=09 YES\n7c 01 4b 46 7f ff 04 10 09 t=23750')
+        sensor = {
+            'uuid': '123-456-789',
+            'path': path,
+            'offset': 0,
+            'offsetunit': SensorsUtils.TEMP_CELSIUS,
+        }
+        self.measure('read_onewire_temperature', lambda: addon._read_onewire_temperature(sensor), 10000)
+
+    def run(self):
+        self.bench_convert_temperatures()
+        self.bench_read_onewire_temperature()
+        self.bench_lookups()
+        self.bench_event_received()
+        self.bench_add_delete_sensor()
+
+        return self.results
+
+if __name__ == '__main__':
+    output = sys.argv[1] if len(sys.argv)>1 else 'bench_sensors.json'
+    benchmark = SensorsBenchmark()
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.clean()
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    print('Results written to "%s"' % output)
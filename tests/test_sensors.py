@@ -8,9 +8,17 @@ from backend.sensors import Sensors
 from backend.sensor import Sensor
 from backend.onewiredriver import OnewireDriver
 from backend.sensorsutils import SensorsUtils
+from backend.sensorsscheduler import SensorsScheduler, SchedulerTask
+from backend.dht22reader import Dht22Reader
+from backend.sensorshistory import RingBuffer, SensorsHistory
+from backend.sensorsstore import TimeSeriesFile, SensorTimeSeries, SensorsStore
+from backend.sensorsmetrics import LatencyHistogram, SensorsMetrics
+from backend.sensorsbreaker import CircuitBreaker
+from backend.onewirediscovery import OnewireDiscovery
 from raspiot.utils import InvalidParameter, MissingParameter, CommandError
 from raspiot.libs.tests import session
 from raspiot.libs.internals.task import Task
+from raspiot.libs.internals.cleepfilesystem import CleepFilesystem
 from mock import Mock
 
 class FakeSensor(Sensor):
@@ -80,9 +88,12 @@ class CoreSensorsTests(unittest.TestCase):
         self.module._tasks_by_device_uuid = {}
         self.addon = FakeSensor(self.module)
         self.module._register_addon(self.addon)
+        self.module._store = SensorsStore(logging.getLogger('CoreSensorsTests'), self.module.cleep_filesystem, SensorsStoreTests.STORE_PATH)
 
     def tearDown(self):
         self.session.clean()
+        if os.path.exists(SensorsStoreTests.STORE_PATH):
+            shutil.rmtree(SensorsStoreTests.STORE_PATH)
 
     """
     SensorsUtils
@@ -144,6 +155,17 @@ class CoreSensorsTests(unittest.TestCase):
 
         driver.is_installed = lambda: False
         config = self.module.get_module_config()
+        self.assertEqual(config['drivers'][driver.name], True, 'Driver state should be cached')
+
+        self.module.event_received({
+            'event': 'system.driver.uninstall',
+            'startup': False,
+            'params': {
+                'drivername': driver.name,
+                'uninstalling': False,
+            }
+        })
+        config = self.module.get_module_config()
         self.assertEqual(config['drivers'][driver.name], False, 'Driver should be returned as not installed')
 
     def test_get_module_devices(self):
@@ -172,6 +194,60 @@ class CoreSensorsTests(unittest.TestCase):
         self.assertTrue(type(res) is list, 'Invalid type of _get_assigned_gpios. Must be list')
         self.assertNotEqual(len(res), 0, '_get_assigned_gpios must return non empty dict')
 
+    def test_get_assigned_gpios_cached(self):
+        self.session.mock_command('get_assigned_gpios', self.__get_assigned_gpios_filled)
+
+        self.module._get_assigned_gpios()
+        res = self.module._get_assigned_gpios()
+        self.assertEqual(res, ['GPIO18'], 'Assigned gpios are invalid')
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 1, 'Assigned gpios should be retrieved once')
+
+        self.module.event_received({'event': 'system.driver.install', 'startup': False, 'device_id': None, 'params': {}})
+        self.module._get_assigned_gpios()
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 2, 'Assigned gpios should be retrieved again after driver event')
+
+    def test_get_assigned_gpios_mirror_expired(self):
+        self.session.mock_command('get_assigned_gpios', self.__get_assigned_gpios_filled)
+        self.module.GPIOS_MIRROR_TTL = 0
+
+        self.module._get_assigned_gpios()
+        self.module._get_assigned_gpios()
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 2, 'Assigned gpios should be retrieved again when mirror expired')
+
+    def test_is_gpio_assigned_checked_again(self):
+        self.session.mock_command('get_assigned_gpios', self.__get_assigned_gpios_filled)
+
+        self.assertTrue(self.addon._is_gpio_assigned('GPIO18'), 'Gpio should be assigned')
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 2, 'Assigned gpios should be retrieved again before rejecting gpio')
+        self.assertFalse(self.addon._is_gpio_assigned('GPIO19'), 'Gpio should not be assigned')
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 2, 'Assigned gpios should not be retrieved for unassigned gpio')
+
+        #gpio released by another module
+        self.session.mock_command('get_assigned_gpios', self.__get_assigned_gpios_empty)
+        self.assertFalse(self.addon._is_gpio_assigned('GPIO18'), 'Gpio released outside sensors should not be assigned')
+
+    def test_assigned_gpios_mirror_updated(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.session.mock_command('delete_gpio', self.__delete_gpio)
+        self.session.mock_command('is_reserved_gpio', self.__is_reserved_gpio_false)
+        self.module._start_sensor_task = Mock()
+        self.module._stop_sensor_task = Mock()
+        self.assertEqual(self.module._get_assigned_gpios(), [], 'Assigned gpios should be empty')
+
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        self.assertEqual(self.module._get_assigned_gpios(), ['GPIO18'], 'Added gpio should be assigned')
+
+        self.module.delete_sensor(sensors[0]['uuid'])
+        self.assertEqual(self.module._get_assigned_gpios(), [], 'Deleted gpio should not be assigned')
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 1, 'Assigned gpios should be retrieved once')
+
+    def test_is_reserved_gpio_cached(self):
+        self.session.mock_command('is_reserved_gpio', self.__is_reserved_gpio_true)
+
+        self.assertTrue(self.module._is_reserved_gpio('123-456-789'), 'Gpio should be reserved')
+        self.assertTrue(self.module._is_reserved_gpio('123-456-789'), 'Gpio should be reserved')
+        self.assertEqual(self.session.get_command_calls('is_reserved_gpio'), 1, 'Reserved status should be retrieved once')
+
     def test_get_assigned_gpios_with_error(self):
         self.session.fail_command('get_assigned_gpios')
 
@@ -273,6 +349,79 @@ class CoreSensorsTests(unittest.TestCase):
         self.assertEqual(mock_start.call_count, 0, '_start_sensor_task not should be called')
         self.assertEqual(mock_stop.call_count, 0, '_stop_sensor_task not should be called')
 
+    def test_add_sensors(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        mock_start = Mock()
+        self.module._start_sensor_task = mock_start
+
+        sensors = self.module.add_sensors([
+            {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname1', 'gpio': 'GPIO18'}},
+            {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname2', 'gpio': 'GPIO19'}},
+        ])
+        self.assertEqual(len(sensors), 2, 'add_sensors should returns all sensors')
+        self.assertEqual(len(self.module.get_module_devices()), 2, 'All sensors should be saved')
+        self.assertEqual(self.session.get_command_calls('add_gpio'), 2, 'add_gpio should be called for each sensor')
+        self.assertEqual(mock_start.call_count, 2, '_start_sensor_task should be called for each sensor')
+
+    def test_add_sensors_validated_with_gpios_snapshot(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        default_add = self.addon.add
+        def add(name, gpio):
+            if gpio in self.addon._get_assigned_gpios():
+                raise InvalidParameter('Gpio "%s" is already used' % gpio)
+            return default_add(name, gpio)
+        self.addon.add = add
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_sensors([
+                {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname1', 'gpio': 'GPIO18'}},
+                {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname2', 'gpio': 'GPIO18'}},
+            ])
+        self.assertEqual(cm.exception.message, 'Gpio "GPIO18" is already used')
+        self.assertEqual(self.session.get_command_calls('get_assigned_gpios'), 1, 'Assigned gpios should be retrieved once')
+        self.assertEqual(self.session.get_command_calls('add_gpio'), 0, 'No gpio should be added')
+        self.assertEqual(len(self.module.get_module_devices()), 0, 'No sensor should be saved')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_sensors([
+                {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname1', 'gpio': 'GPIO18'}},
+                {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname1', 'gpio': 'GPIO19'}},
+            ])
+        self.assertEqual(cm.exception.message, 'Name "aname1" is already used')
+
+    def test_add_sensors_with_add_device_failed(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.session.mock_command('delete_gpio', self.__delete_gpio)
+        self.module._start_sensor_task = Mock()
+        default_add_device = self.module._add_device
+        added = []
+        def add_device(sensor):
+            #second sensor creation fails
+            added.append(sensor)
+            return default_add_device(sensor) if len(added)==1 else None
+        self.module._add_device = add_device
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.add_sensors([
+                {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname1', 'gpio': 'GPIO18'}},
+                {'type': 'test', 'subtype': 'fake', 'data': {'name': 'aname2', 'gpio': 'GPIO19'}},
+            ])
+        self.assertEqual(cm.exception.message, 'Error occured adding sensors')
+        self.assertEqual(self.session.get_command_calls('delete_gpio'), 2, 'All added gpios should be deleted')
+        self.assertEqual(len(self.module.get_module_devices()), 0, 'All sensors should be removed')
+
+    def test_add_sensors_with_invalid_params(self):
+        with self.assertRaises(MissingParameter) as cm:
+            self.module.add_sensors(None)
+        self.assertEqual(cm.exception.message, 'Parameter "sensors" is missing')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_sensors([])
+        self.assertEqual(cm.exception.message, 'Parameter "sensors" must be a non empty list')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_sensors([{'type': 'test', 'subtype': 'temp', 'data': {}}])
+        self.assertEqual(cm.exception.message, 'Sensor subtype "temp" doesn\'t exist')
+
     def test_update_sensor(self):
         mock_start = Mock()
         mock_stop = Mock()
@@ -313,6 +462,28 @@ class CoreSensorsTests(unittest.TestCase):
         self.assertEqual(mock_start.call_count, 2, '_start_sensor_task should be called twice (add + update)')
         self.assertEqual(mock_stop.call_count, 1, '_stop_sensor_task should be called')
 
+    def test_update_sensor_with_gpio_change(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        self.module._stop_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        added_sensor = sensors[0]
+        old_gpio_uuid = added_sensor['gpios'][0]['uuid']
+
+        def update(sensor, name):
+            sensor['name'] = name
+            sensor['gpios'] = [{'uuid': '666-666-666', 'gpio': 'GPIO19', 'pin': 35}]
+            return {
+                'gpios': [],
+                'sensors': [sensor,],
+            }
+        self.addon.update = update
+        self.module.update_sensor(added_sensor['uuid'], {'name': 'newname'})
+
+        self.assertFalse(old_gpio_uuid in self.module._sensors_by_gpio_uuid, 'Previous gpio should be removed from index')
+        self.assertIsNone(self.module._search_by_gpio(old_gpio_uuid), 'Previous gpio should not be routed to sensor')
+        self.assertEqual(self.module._search_by_gpio('666-666-666')['uuid'], added_sensor['uuid'], 'New gpio should be routed to sensor')
+
     def test_update_sensor_with_invalid_params(self):
         data = {
             'name': 'aname',
@@ -422,6 +593,23 @@ class CoreSensorsTests(unittest.TestCase):
         self.assertEqual(mock_start.call_count, 1, '_start_sensor_task should be called only once (during add)')
         self.assertEqual(mock_stop.call_count, 1, '_stop_sensor_task should be called once (during deletion)')
 
+    def test_delete_sensor_forget_readings_states(self):
+        self.session.mock_command('add_gpio', self.__update_gpio)
+        self.session.mock_command('delete_gpio', self.__delete_gpio)
+        self.session.mock_command('is_reserved_gpio', self.__is_reserved_gpio_false)
+        self.module._start_sensor_task = Mock()
+        self.module._stop_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        uuid = sensors[0]['uuid']
+        self.addon._last_published[uuid] = (20.0, 12345678)
+        self.addon._adaptive_states[uuid] = {'interval': 60}
+        self.addon._oversampling_windows[uuid] = {'values': []}
+
+        self.module.delete_sensor(uuid)
+        self.assertFalse(uuid in self.addon._last_published, 'Deadband state should be deleted')
+        self.assertFalse(uuid in self.addon._adaptive_states, 'Adaptive state should be deleted')
+        self.assertFalse(uuid in self.addon._oversampling_windows, 'Oversampling window should be deleted')
+
     def test_delete_sensor_with_invalid_params(self):
         with self.assertRaises(MissingParameter) as cm:
             self.module.delete_sensor(None)
@@ -549,6 +737,357 @@ class CoreSensorsTests(unittest.TestCase):
         sensor = self.module._search_by_gpio('666-666-666-666')
         self.assertIsNone(sensor)
 
+    def test_search_by_gpio_after_delete_sensor(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.session.mock_command('delete_gpio', self.__delete_gpio)
+        self.session.mock_command('is_reserved_gpio', self.__is_reserved_gpio_false)
+
+        data = {
+            'name': 'aname',
+            'gpio': 'GPIO18',
+        }
+        sensors = self.module.add_sensor('test', 'fake', data)
+        added_sensor = sensors[0]
+        self.module.delete_sensor(added_sensor['uuid'])
+
+        sensor = self.module._search_by_gpio(added_sensor['gpios'][0]['uuid'])
+        self.assertIsNone(sensor, 'Deleted sensor should not be found')
+        self.assertEqual(len(self.module._sensors_by_gpio_uuid), 0, 'Gpio index should be empty')
+
+    def test_index_sensor_gpios_with_shared_gpio(self):
+        sensor1 = {
+            'uuid': '123-456-789',
+            'gpios': [{'gpio':'GPIO18', 'uuid':'666-666-666', 'pin':18}],
+        }
+        sensor2 = {
+            'uuid': '321-654-987',
+            'gpios': [{'gpio':'GPIO18', 'uuid':'666-666-666', 'pin':18}],
+        }
+        self.module._index_sensor_gpios(sensor1)
+        self.module._index_sensor_gpios(sensor2)
+        self.assertEqual(self.module._sensors_by_gpio_uuid['666-666-666'], ['123-456-789', '321-654-987'], 'Both sensors should be indexed')
+
+        self.module._unindex_sensor_gpios(sensor1)
+        self.assertEqual(self.module._sensors_by_gpio_uuid['666-666-666'], ['321-654-987'], 'Only second sensor should remain indexed')
+
+        self.module._unindex_sensor_gpios(sensor2)
+        self.assertFalse('666-666-666' in self.module._sensors_by_gpio_uuid, 'Gpio should be removed from index')
+
+    """
+    Values filtering
+    """
+    def test_is_significant(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'deadband': 0.5,
+            'heartbeat': 600,
+        }
+        self.assertTrue(self.addon._is_significant(sensor, 20.0, 1000), 'First value should be significant')
+        self.assertFalse(self.addon._is_significant(sensor, 20.0, 1060), 'Same value should not be significant')
+        self.assertFalse(self.addon._is_significant(sensor, 20.3, 1120), 'Value within deadband should not be significant')
+        self.assertTrue(self.addon._is_significant(sensor, 20.5, 1180), 'Value out of deadband should be significant')
+        self.assertFalse(self.addon._is_significant(sensor, 20.5, 1240), 'Same value should not be significant')
+        self.assertTrue(self.addon._is_significant(sensor, 20.5, 1780), 'Value should be significant when heartbeat expires')
+
+    def test_is_significant_with_invalid_value(self):
+        sensor = {
+            'uuid': '123-456-789',
+        }
+        self.assertTrue(self.addon._is_significant(sensor, 20.0, 1000), 'First value should be significant')
+        self.assertTrue(self.addon._is_significant(sensor, None, 1060), 'Read failure should be significant')
+        self.assertFalse(self.addon._is_significant(sensor, None, 1120), 'Consecutive read failures should not be significant')
+        self.assertTrue(self.addon._is_significant(sensor, 20.0, 1180), 'Value after read failure should be significant')
+
+    def test_is_significant_default_filter(self):
+        sensor = {
+            'uuid': '123-456-789',
+        }
+        self.assertTrue(self.addon._is_significant(sensor, 20.0, 1000), 'First value should be significant')
+        self.assertTrue(self.addon._is_significant(sensor, 20.1, 1060), 'Any change should be significant without deadband')
+        self.assertFalse(self.addon._is_significant(sensor, 20.1, 1120), 'Same value should not be significant')
+        self.assertTrue(self.addon._is_significant(sensor, 20.1, 1060 + Sensor.DEFAULT_HEARTBEAT), 'Value should be significant when default heartbeat expires')
+
+    def test_check_filter_params(self):
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_filter_params(-1, 60)
+        self.assertEqual(cm.exception.message, 'Deadband must be a positive number')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_filter_params(None, 60)
+        self.assertEqual(cm.exception.message, 'Deadband must be a positive number')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_filter_params(0.5, -1)
+        self.assertEqual(cm.exception.message, 'Heartbeat must be a positive integer')
+
+    def test_send_batch_update(self):
+        readings = [
+            {'uuid': '123', 'type': 'temperature', 'celsius': 20, 'fahrenheit': 68, 'lastupdate': 1000},
+            {'uuid': '456', 'type': 'humidity', 'humidity': 48, 'lastupdate': 1000},
+        ]
+        self.module._send_batch_update(readings)
+        self.assertEqual(self.session.get_event_calls('sensors.batch.update'), 1, 'Batch update event should be sent once')
+        self.assertEqual(self.session.get_event_last_params('sensors.batch.update')['readings'], readings, 'Event should contain all readings')
+
+    """
+    Adaptive polling
+    """
+    def test_check_adaptive_params(self):
+        self.addon._check_adaptive_params(False, 60, None, None, 60)
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_adaptive_params(None, 60, None, None, 60)
+        self.assertEqual(cm.exception.message, 'Parameter "adaptive" must be a boolean')
+        with self.assertRaises(MissingParameter) as cm:
+            self.addon._check_adaptive_params(True, 60, None, 600, 60)
+        self.assertEqual(cm.exception.message, 'Parameter "min_interval" is missing')
+        with self.assertRaises(MissingParameter) as cm:
+            self.addon._check_adaptive_params(True, 60, 60, None, 60)
+        self.assertEqual(cm.exception.message, 'Parameter "max_interval" is missing')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_adaptive_params(True, 60, 30, 600, 60)
+        self.assertEqual(cm.exception.message, 'Min interval must be greater or equal than 60')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_adaptive_params(True, 60, 120, 60, 60)
+        self.assertEqual(cm.exception.message, 'Max interval must be greater or equal than min interval')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_adaptive_params(True, 900, 60, 600, 60)
+        self.assertEqual(cm.exception.message, 'Interval must be between min and max intervals')
+
+    def test_adapt_interval(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'adaptive': True,
+            'mininterval': 60,
+            'maxinterval': 480,
+        }
+        task = Mock(interval=120.0)
+        self.module._tasks_by_device_uuid[sensor['uuid']] = task
+
+        self.assertEqual(self.addon._adapt_interval([(sensor, 20.0)]), 120, 'Interval should not change at first reading')
+        for _ in range(Sensor.ADAPTIVE_STABLE_READINGS):
+            interval = self.addon._adapt_interval([(sensor, 20.0)])
+        self.assertEqual(interval, 240, 'Interval should be stretched after stable readings')
+        self.assertEqual(task.set_interval.call_args.args[0], 240, 'Task interval should be updated')
+        for _ in range(Sensor.ADAPTIVE_STABLE_READINGS * 3):
+            interval = self.addon._adapt_interval([(sensor, 20.0)])
+        self.assertEqual(interval, 480, 'Interval should be bounded by max interval')
+
+        interval = self.addon._adapt_interval([(sensor, 25.0)])
+        self.assertEqual(interval, 240, 'Interval should be tightened when readings move')
+        interval = self.addon._adapt_interval([(sensor, 30.0)])
+        interval = self.addon._adapt_interval([(sensor, 35.0)])
+        self.assertEqual(interval, 60, 'Interval should be bounded by min interval')
+
+    def test_adapt_interval_disabled(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+        }
+        self.assertIsNone(self.addon._adapt_interval([(sensor, 20.0)]), 'Adaptive polling should be disabled')
+
+    """
+    Oversampling
+    """
+    def test_aggregate(self):
+        values = [20.0, 21.0, None, 25.0, 20.5]
+        self.assertEqual(SensorsUtils.aggregate(values, SensorsUtils.AGGREGATION_MEAN), 21.62, 'Mean is invalid')
+        self.assertEqual(SensorsUtils.aggregate(values, SensorsUtils.AGGREGATION_MEDIAN), 20.75, 'Median is invalid')
+        self.assertEqual(SensorsUtils.aggregate(values, SensorsUtils.AGGREGATION_MIN), 20.0, 'Min is invalid')
+        self.assertEqual(SensorsUtils.aggregate(values, SensorsUtils.AGGREGATION_MAX), 25.0, 'Max is invalid')
+        self.assertIsNone(SensorsUtils.aggregate([None], SensorsUtils.AGGREGATION_MEAN), 'Aggregation without value should be None')
+
+    def test_check_oversampling_params(self):
+        self.addon._check_oversampling_params(0, None, 60, False, 5)
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_oversampling_params(2, 'mean', 60, False, 5)
+        self.assertEqual(cm.exception.message, 'Oversampling period must be greater or equal than 5')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_oversampling_params(60, 'mean', 60, False, 5)
+        self.assertEqual(cm.exception.message, 'Oversampling period must be lower than interval')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_oversampling_params(5, 'sum', 60, False, 5)
+        self.assertEqual(cm.exception.message, 'Aggregation must be one of mean, median, min, max')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.addon._check_oversampling_params(5, 'mean', 60, True, 5)
+        self.assertEqual(cm.exception.message, 'Oversampling can\'t be used with adaptive polling')
+
+    def test_oversample(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'interval': 60,
+            'oversampling': 20,
+            'aggregation': 'max',
+        }
+        self.assertEqual(self.addon._get_task_interval(sensor), 20, 'Task should run at sampling period')
+        self.assertEqual(self.addon._oversample(sensor, (20.0, 68.0), 1000), (False, None), 'Value should not be reported before interval')
+        self.assertEqual(self.addon._oversample(sensor, (None, None), 1020), (False, None), 'Value should not be reported before interval')
+        self.assertEqual(self.addon._oversample(sensor, (22.0, 71.6), 1040), (False, None), 'Value should not be reported before interval')
+        self.assertEqual(self.addon._oversample(sensor, (21.0, 69.8), 1060), (True, (22.0, 71.6)), 'Aggregated value should be reported')
+        self.assertEqual(self.addon._oversample(sensor, (21.0, 69.8), 1080), (False, None), 'New window should be started')
+        self.assertEqual(self.addon._oversample(sensor, (23.0, 73.4), 1100), (False, None), 'Value should not be reported before interval')
+        self.assertEqual(self.addon._oversample(sensor, (19.0, 66.2), 1120), (True, (23.0, 73.4)), 'Value should be reported every interval')
+
+    """
+    Values buffer
+    """
+    def test_update_sensor_value(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        sensor = sensors[0]
+        mock_update_config = Mock(return_value=True)
+        self.module._update_config = mock_update_config
+
+        sensor['value'] = 666
+        self.assertTrue(self.addon.update_value(sensor), 'Update_value should succeed')
+        self.assertEqual(mock_update_config.call_count, 0, 'Sensor should not be saved immediatly')
+        self.assertEqual(self.module.get_module_devices()[sensor['uuid']]['value'], 666, 'Devices should contain buffered value')
+        self.assertEqual(self.module._get_device(sensor['uuid'])['value'], 666, 'Device should contain buffered value')
+        self.assertEqual(self.module._search_device('uuid', sensor['uuid'])['value'], 666, 'Searched device should contain buffered value')
+
+        self.module._flush_sensors_values()
+        self.assertEqual(mock_update_config.call_count, 1, 'Sensor should be saved during flush')
+        self.assertEqual(len(self.module._dirty_devices), 0, 'Buffer should be empty after flush')
+
+    def test_update_sensor_value_coalesce_updates(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        sensor = sensors[0]
+        mock_update_config = Mock(return_value=True)
+        self.module._update_config = mock_update_config
+
+        for value in range(10):
+            sensor['value'] = value
+            self.addon.update_value(sensor)
+        self.module._flush_sensors_values()
+
+        self.assertEqual(mock_update_config.call_count, 1, 'Sensor should be saved once')
+        self.assertEqual(mock_update_config.call_args.args[0]['devices'][sensor['uuid']]['value'], 9, 'Last value should be saved')
+
+    def test_flush_sensors_values_single_write(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        sensor1 = self.module.add_sensor('test', 'fake', {'name': 'aname1', 'gpio': 'GPIO18'})[0]
+        sensor2 = self.module.add_sensor('test', 'fake', {'name': 'aname2', 'gpio': 'GPIO19'})[0]
+        mock_update_config = Mock(return_value=True)
+        self.module._update_config = mock_update_config
+
+        sensor1['value'] = 1
+        sensor2['value'] = 2
+        self.addon.update_value(sensor1)
+        self.addon.update_value(sensor2)
+        self.module._flush_sensors_values()
+
+        self.assertEqual(mock_update_config.call_count, 1, 'Config should be written once for all sensors')
+        devices = mock_update_config.call_args.args[0]['devices']
+        self.assertEqual(devices[sensor1['uuid']]['value'], 1, 'Sensor1 value should be saved')
+        self.assertEqual(devices[sensor2['uuid']]['value'], 2, 'Sensor2 value should be saved')
+
+    def test_update_sensor_keeps_buffered_value(self):
+        self.session.mock_command('add_gpio', self.__update_gpio)
+        self.session.mock_command('update_gpio', self.__update_gpio)
+        self.module._start_sensor_task = Mock()
+        self.module._stop_sensor_task = Mock()
+        sensor = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})[0]
+        sensor['value'] = 666
+        self.addon.update_value(sensor)
+
+        self.module.update_sensor(sensor['uuid'], {'name': 'newname'})
+
+        self.assertEqual(self.module._get_device(sensor['uuid'])['value'], 666, 'Buffered value should be kept after update')
+        self.assertEqual(self.module._get_device(sensor['uuid'])['name'], 'newname', 'Sensor should be updated')
+
+    def test_update_sensor_value_unknown_sensor(self):
+        sensor = {
+            'uuid': '666-666-666',
+            'name': 'aname',
+        }
+        self.assertFalse(self.addon.update_value(sensor), 'Update_value should fail for unknown sensor')
+        self.assertEqual(len(self.module._dirty_devices), 0, 'Unknown sensor should not be buffered')
+
+    def test_delete_sensor_drops_buffered_value(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.session.mock_command('delete_gpio', self.__delete_gpio)
+        self.session.mock_command('is_reserved_gpio', self.__is_reserved_gpio_false)
+        self.module._start_sensor_task = Mock()
+        self.module._stop_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        sensor = sensors[0]
+        self.addon.update_value(sensor)
+
+        self.module.delete_sensor(sensor['uuid'])
+        self.assertEqual(len(self.module._dirty_devices), 0, 'Buffered value should be dropped')
+
+    def test_get_sensor_history(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        sensor = sensors[0]
+        for index in range(10):
+            self.addon._record_value(sensor, 20 + index, 1000 + index * 60)
+
+        history = self.module.get_sensor_history(sensor['uuid'])
+        self.assertEqual(len(history), 10, 'All values should be returned')
+        history = self.module.get_sensor_history(sensor['uuid'], start=1300)
+        self.assertEqual(len(history), 5, 'Only values after start should be returned')
+        history = self.module.get_sensor_history(sensor['uuid'], points=5)
+        self.assertEqual(len(history), 5, 'History should be downsampled')
+
+    def test_get_sensor_archive(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+        sensor = sensors[0]
+        for index in range(10):
+            self.addon._record_value(sensor, 20 + index, 1000 + index * 60)
+            if index==5:
+                self.module._flush_sensors_values()
+
+        archive = self.module.get_sensor_archive(sensor['uuid'])
+        self.assertEqual(len(archive), 10, 'Stored and pending values should be returned')
+        archive = self.module.get_sensor_archive(sensor['uuid'], start=1300, points=2)
+        self.assertEqual(len(archive), 2, 'Values should be downsampled')
+
+    def test_get_sensor_archive_invalid_params(self):
+        self.session.mock_command('add_gpio', self.__add_gpio)
+        self.module._start_sensor_task = Mock()
+        sensors = self.module.add_sensor('test', 'fake', {'name': 'aname', 'gpio': 'GPIO18'})
+
+        with self.assertRaises(MissingParameter) as cm:
+            self.module.get_sensor_archive(None)
+        self.assertEqual(cm.exception.message, 'Uuid parameter is missing')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_sensor_archive('666-666-666')
+        self.assertEqual(cm.exception.message, 'Sensor with uuid "666-666-666" doesn\'t exist')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_sensor_archive(sensors[0]['uuid'], points=0)
+        self.assertEqual(cm.exception.message, 'Parameter "points" must be a positive integer')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_sensor_archive(sensors[0]['uuid'], points='10')
+        self.assertEqual(cm.exception.message, 'Parameter "points" must be a positive integer')
+
+    def test_get_sensor_history_invalid_params(self):
+        with self.assertRaises(MissingParameter) as cm:
+            self.module.get_sensor_history(None)
+        self.assertEqual(cm.exception.message, 'Uuid parameter is missing')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_sensor_history('666-666-666')
+        self.assertEqual(cm.exception.message, 'Sensor with uuid "666-666-666" doesn\'t exist')
+
+    def test_set_flush_interval(self):
+        self.module.set_flush_interval(60)
+        self.assertEqual(self.module.get_module_config()['flushinterval'], 60, 'Flush interval should be saved')
+
+    def test_set_flush_interval_invalid_params(self):
+        with self.assertRaises(MissingParameter) as cm:
+            self.module.set_flush_interval(None)
+        self.assertEqual(cm.exception.message, 'Parameter "interval" is missing')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.set_flush_interval(5)
+        self.assertEqual(cm.exception.message, 'Parameter "interval" must be greater or equal than 10')
+
     """
     Event
     """
@@ -683,6 +1222,21 @@ class CoreSensorsTests(unittest.TestCase):
         self.assertEqual(self.module._tasks_by_device_uuid.keys()[0], sensor['uuid'], 'Task should be saved with sensor uuid')
         self.assertTrue(task.is_running(), 'Sensor task should be started')
 
+    def test_start_sensor_task_spread(self):
+        sensor = {
+            'name': 'aname',
+            'uuid': '123-456-789'
+        }
+        task = self.module._scheduler.create_task(60, lambda: None)
+        self.module._start_sensor_task(task, [sensor,])
+
+        self.assertEqual(task.key, '123-456-789', 'Task key should be sensor uuid')
+        self.assertNotEqual(task._get_offset(), 0.0, 'Task should be spread over its interval')
+        self.assertTrue(task.is_running(), 'Sensor task should be started')
+
+        self.module._stop_sensor_task(sensor)
+        self.assertFalse(task.is_running(), 'Sensor task should be stopped')
+
     def test_start_sensor_task_with_two_sensors(self):
         sensor1 = {
             'name': 'aname',
@@ -742,6 +1296,42 @@ class CoreSensorsTests(unittest.TestCase):
         self.assertEqual(len(self.module._tasks_by_device_uuid), 0, 'Task should be deleted when stopped')
         self.assertFalse(task.is_running(), 'Task should be stopped')
 
+    def test_stop_sensor_task_shared_by_two_sensors(self):
+        sensor1 = {
+            'name': 'aname',
+            'uuid': '123-456-789'
+        }
+        sensor2 = {
+            'name': 'aname',
+            'uuid': '321-654-987'
+        }
+        task = Task(60, lambda: None, None)
+        self.module._start_sensor_task(task, [sensor1, sensor2])
+
+        self.module._stop_sensor_task(sensor1)
+        self.assertTrue(task.is_running(), 'Task should still run while another sensor uses it')
+        self.assertFalse(sensor1['uuid'] in self.module._tasks_by_device_uuid, 'First sensor should be released')
+
+        self.module._stop_sensor_task(sensor2)
+        self.assertFalse(task.is_running(), 'Task should be stopped when last sensor is released')
+        self.assertEqual(len(self.module._tasks_by_device_uuid), 0, 'All sensors should be released')
+        self.assertEqual(len(self.module._tasks_references), 0, 'Task references should be purged')
+
+    def test_start_sensor_task_replaces_previous_task(self):
+        sensor = {
+            'name': 'aname',
+            'uuid': '123-456-789'
+        }
+        task1 = Task(60, lambda: None, None)
+        task2 = Task(60, lambda: None, None)
+        self.module._start_sensor_task(task1, [sensor])
+        self.module._start_sensor_task(task2, [sensor])
+
+        self.assertFalse(task1.is_running(), 'Previous task should be stopped')
+        self.assertTrue(task2.is_running(), 'New task should be started')
+        self.assertEqual(self.module._tasks_by_device_uuid[sensor['uuid']], task2, 'New task should be referenced')
+        task2.stop()
+
     def test_stop_sensor_task_with_unknow_sensor(self):
         sensor = {
             'name': 'aname',
@@ -914,6 +1504,473 @@ class CoreSensorsTests(unittest.TestCase):
 
 
 
+class SensorsSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL, format=u'%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s')
+        self.scheduler = SensorsScheduler(logging.getLogger('SensorsSchedulerTests'), 2)
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_create_task(self):
+        task = self.scheduler.create_task(60, lambda: None)
+        self.assertTrue(isinstance(task, SchedulerTask), 'Create_task should returns a SchedulerTask instance')
+        self.assertFalse(task.is_running(), 'Task should not be launched')
+
+    def test_task_executed_periodically(self):
+        mock = Mock()
+        task = self.scheduler.create_task(0.1, mock, ['arg'])
+        task.start()
+        time.sleep(0.35)
+        task.stop()
+
+        self.assertGreaterEqual(mock.call_count, 2, 'Task should be executed periodically')
+        self.assertEqual(mock.call_args.args[0], 'arg', 'Task should be executed with its args')
+
+    def test_task_set_interval(self):
+        mock = Mock()
+        task = self.scheduler.create_task(0.1, mock)
+        task.start()
+        time.sleep(0.05)
+        task.set_interval(10)
+        time.sleep(0.3)
+        task.stop()
+
+        self.assertEqual(mock.call_count, 1, 'New interval should be applied when task is rescheduled')
+
+    def test_task_stopped(self):
+        mock = Mock()
+        task = self.scheduler.create_task(0.1, mock)
+        task.start()
+        task.stop()
+        time.sleep(0.2)
+
+        self.assertFalse(task.is_running(), 'Task should be stopped')
+        self.assertEqual(mock.call_count, 0, 'Stopped task should not be executed')
+
+    def test_tasks_executed_by_due_time(self):
+        calls = []
+        task1 = self.scheduler.create_task(0.2, lambda: calls.append(1))
+        task2 = self.scheduler.create_task(0.1, lambda: calls.append(2))
+        task1.start()
+        task2.start()
+        time.sleep(0.25)
+        task1.stop()
+        task2.stop()
+
+        self.assertEqual(calls[0], 2, 'Task with nearest due time should be executed first')
+        self.assertTrue(1 in calls, 'Second task should be executed too')
+
+    def test_batched_tasks_executed_together(self):
+        batch = Mock()
+        single = Mock()
+        task1 = self.scheduler.create_task(0.1, single, ['sensor1'], batch)
+        task2 = self.scheduler.create_task(0.1, single, ['sensor2'], batch)
+        task1.start()
+        task2.start()
+        time.sleep(0.15)
+        task1.stop()
+        task2.stop()
+
+        self.assertEqual(single.call_count, 0, 'Single task function should not be called for batched tasks')
+        self.assertGreaterEqual(batch.call_count, 1, 'Batch function should be called')
+        self.assertEqual(sorted(batch.call_args.args[0]), [['sensor1'], ['sensor2']], 'Batch function should receive all tasks args')
+
+    def test_tick_readings(self):
+        callback = Mock()
+        self.scheduler.tick_callback = callback
+        batch = lambda tasks_args: [self.scheduler.add_tick_reading({'sensor': args[0]}) for args in tasks_args]
+        task1 = self.scheduler.create_task(0.1, None, ['sensor1'], batch)
+        task2 = self.scheduler.create_task(0.1, None, ['sensor2'], batch)
+        task1.start()
+        task2.start()
+        time.sleep(0.15)
+        task1.stop()
+        task2.stop()
+
+        self.assertGreaterEqual(callback.call_count, 1, 'Tick callback should be called')
+        readings = [reading['sensor'] for reading in callback.call_args_list[0].args[0]]
+        self.assertTrue('sensor1' in readings and 'sensor2' in readings, 'All readings of tick should be sent together')
+        self.assertFalse(self.scheduler.add_tick_reading({'sensor': 'sensor4'}), 'Reading outside tick should be ignored')
+
+    def test_task_offset(self):
+        task1 = self.scheduler.create_task(60, lambda: None)
+        task2 = self.scheduler.create_task(60, lambda: None)
+        self.assertEqual(task1._get_offset(), 0.0, 'Task without key should not have offset')
+
+        task1.set_key('123-456-789')
+        task2.set_key('987-654-321')
+        offset = task1._get_offset()
+        self.assertTrue(0<=offset<60, 'Offset should be within task interval')
+        self.assertNotEqual(offset, task2._get_offset(), 'Tasks offsets should be spread')
+        task3 = self.scheduler.create_task(60, lambda: None)
+        task3.set_key('123-456-789')
+        self.assertEqual(task3._get_offset(), offset, 'Offset should be deterministic')
+
+        due = task1._SchedulerTask__get_aligned_due(1000.0)
+        self.assertTrue(1000.0<due<=1060.0, 'First execution should occur within interval')
+        self.assertAlmostEqual((due - offset) % 60, 0, 5, 'Task should be due at its offset')
+
+    def test_batched_tasks_offset(self):
+        batch = Mock()
+        task1 = self.scheduler.create_task(60, None, ['sensor1'], batch)
+        task2 = self.scheduler.create_task(120, None, ['sensor2'], batch)
+        task1.set_key('123-456-789')
+        task2.set_key('987-654-321')
+
+        self.assertEqual(task1._get_offset(), task2._get_offset(), 'Batched tasks should share the same offset')
+        self.assertEqual(task1._get_next_due(0, 1000.0) % 60, task2._get_next_due(0, 1000.0) % 60, 'Batched tasks should stay aligned')
+
+    def test_task_duration(self):
+        calls = []
+        task = self.scheduler.create_task(0.3, lambda: calls.append(time.time()))
+        task.set_duration(0.2)
+        self.assertEqual(task._get_start(10.0), 9.8, 'Task should start duration before its due time')
+        task.set_duration(1.0)
+        self.assertEqual(task._get_start(10.0), 9.7, 'Duration should be bounded by task interval')
+
+        task.set_duration(0.2)
+        start = time.time()
+        task.start()
+        time.sleep(0.2)
+        task.stop()
+
+        self.assertEqual(len(calls), 1, 'Task should be executed before its due time')
+        self.assertLess(calls[0] - start, 0.2, 'Task should be executed duration before its due time')
+
+    def test_batched_tasks_with_different_durations_executed_together(self):
+        batch = Mock()
+        task1 = self.scheduler.create_task(0.3, None, ['sensor1'], batch)
+        task2 = self.scheduler.create_task(0.3, None, ['sensor2'], batch)
+        task1.set_duration(0.2)
+        task2.set_duration(0.05)
+        task1.start()
+        task2.start()
+        time.sleep(0.2)
+        task1.stop()
+        task2.stop()
+
+        self.assertGreaterEqual(batch.call_count, 1, 'Batch function should be called')
+        for call in batch.call_args_list:
+            self.assertEqual(sorted(call[0][0]), [['sensor1'], ['sensor2']], 'Batch should be started with longest duration')
+
+    def test_task_exception_does_not_stop_scheduler(self):
+        mock = Mock(side_effect=Exception('Test exception'))
+        task = self.scheduler.create_task(0.1, mock)
+        task.start()
+        time.sleep(0.25)
+        task.stop()
+
+        self.assertGreaterEqual(mock.call_count, 2, 'Task should still be executed after exception')
+        self.assertTrue(self.scheduler.is_running(), 'Scheduler should still run')
+
+
+
+
+
+class SensorsHistoryTests(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        buf = RingBuffer(3)
+        self.assertEqual(buf.get_samples(), [], 'Buffer should be empty')
+
+        buf.append(1, 10)
+        buf.append(2, 20)
+        self.assertEqual(len(buf), 2, 'Buffer should contain 2 samples')
+        self.assertEqual(buf.get_samples(), [(1, 10), (2, 20)], 'Samples are invalid')
+
+    def test_ring_buffer_overwrite_oldest_samples(self):
+        buf = RingBuffer(3)
+        for index in range(5):
+            buf.append(index, index * 10)
+
+        self.assertEqual(len(buf), 3, 'Buffer size should be bounded')
+        self.assertEqual(buf.get_samples(), [(2, 20), (3, 30), (4, 40)], 'Oldest samples should be overwritten')
+
+    def test_ring_buffer_range(self):
+        buf = RingBuffer(10)
+        for index in range(5):
+            buf.append(index, index * 10)
+
+        self.assertEqual(buf.get_samples(1, 3), [(1, 10), (2, 20), (3, 30)], 'Range samples are invalid')
+        self.assertEqual(buf.get_samples(start=3), [(3, 30), (4, 40)], 'Samples from start are invalid')
+        self.assertEqual(buf.get_samples(end=0), [(0, 0)], 'Samples until end are invalid')
+
+    def test_history(self):
+        history = SensorsHistory(10)
+        history.add('123', 1, 20.5)
+        history.add('123', 2, None)
+        history.add('456', 1, 60)
+
+        points = history.get('123')
+        self.assertEqual(len(points), 1, 'None values should not be stored')
+        self.assertEqual(points[0], {'timestamp': 1, 'min': 20.5, 'max': 20.5, 'avg': 20.5}, 'Point is invalid')
+        self.assertEqual(history.get('789'), [], 'Unknown sensor should have empty history')
+
+        history.delete('123')
+        self.assertEqual(history.get('123'), [], 'History should be deleted')
+        self.assertEqual(len(history.get('456')), 1, 'Other sensor history should be kept')
+
+    def test_history_downsampling(self):
+        history = SensorsHistory(100)
+        for index in range(10):
+            history.add('123', index, index)
+
+        points = history.get('123', points=2)
+        self.assertEqual(len(points), 2, 'History should be downsampled')
+        self.assertEqual(points[0], {'timestamp': 0, 'min': 0, 'max': 4, 'avg': 2}, 'First point is invalid')
+        self.assertEqual(points[1], {'timestamp': 5, 'min': 5, 'max': 9, 'avg': 7}, 'Second point is invalid')
+
+
+
+
+
+class SensorsStoreTests(unittest.TestCase):
+
+    STORE_PATH = '/tmp/sensors_store'
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL, format=u'%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s')
+        self.fs = CleepFilesystem()
+        self.fs.enable_write = Mock()
+        self.fs.disable_write = Mock()
+        self.store = SensorsStore(logging.getLogger('SensorsStoreTests'), self.fs, self.STORE_PATH)
+
+    def tearDown(self):
+        if os.path.exists(self.STORE_PATH):
+            shutil.rmtree(self.STORE_PATH)
+
+    def test_time_series_file(self):
+        os.makedirs(self.STORE_PATH)
+        ts = TimeSeriesFile(self.fs, os.path.join(self.STORE_PATH, 'sensor'))
+        self.assertEqual(ts.get_samples(), [], 'New file should be empty')
+
+        self.assertEqual(ts.append([(1000, 20.5), (1060, 21.0), (1120, 21.5)]), 3, 'All samples should be appended')
+        self.assertEqual(ts.append([(1100, 30.0), (1180, 22.0)]), 1, 'Sample older than last sample should be dropped')
+        self.assertEqual(os.path.getsize(ts.timestamps_path), 4 * TimeSeriesFile.TIMESTAMP_SIZE, 'Timestamps column size is invalid')
+        self.assertEqual(os.path.getsize(ts.values_path), 4 * TimeSeriesFile.VALUE_SIZE, 'Values column size is invalid')
+
+        self.assertEqual(ts.get_samples(), [(1000, 20.5), (1060, 21.0), (1120, 21.5), (1180, 22.0)], 'Samples are invalid')
+        self.assertEqual(ts.get_samples(1060, 1120), [(1060, 21.0), (1120, 21.5)], 'Range samples are invalid')
+        self.assertEqual(ts.get_samples(1061), [(1120, 21.5), (1180, 22.0)], 'Samples from start are invalid')
+        self.assertEqual(ts.get_samples(end=999), [], 'No sample should be returned before first sample')
+        self.assertTrue(self.fs.enable_write.called, 'Files should be written through cleep filesystem')
+
+    def test_time_series_file_repair(self):
+        os.makedirs(self.STORE_PATH)
+        ts = TimeSeriesFile(self.fs, os.path.join(self.STORE_PATH, 'sensor'))
+        ts.append([(1000, 20.5), (1060, 21.0)])
+        #simulate interrupted append
+        with open(ts.values_path, 'ab') as f:
+            f.write(b'\x00\x00')
+
+        ts = TimeSeriesFile(self.fs, os.path.join(self.STORE_PATH, 'sensor'))
+        self.assertEqual(ts.last_timestamp, 1060, 'Last timestamp should be loaded')
+        self.assertEqual(os.path.getsize(ts.values_path), 2 * TimeSeriesFile.VALUE_SIZE, 'Partial value should be truncated')
+        self.assertEqual(ts.get_samples(), [(1000, 20.5), (1060, 21.0)], 'Samples are invalid')
+
+    def test_sensor_time_series_segments(self):
+        path = os.path.join(self.STORE_PATH, 'sensor')
+        ts = SensorTimeSeries(self.fs, path)
+        #2019-12-31 23:59:00, 2020-01-01 00:00:00 and 2020-01-01 00:01:00 UTC
+        self.assertEqual(ts.append([(1577836740, 20.5), (1577836800, 21.0), (1577836860, 21.5)]), 3, 'All samples should be appended')
+        self.assertEqual(sorted(os.listdir(path)), ['201912.ts', '201912.val', '202001.ts', '202001.val'], 'Samples should be stored in monthly segments')
+
+        ts = SensorTimeSeries(self.fs, path)
+        self.assertEqual(ts.last_timestamp, 1577836860, 'Last timestamp should be loaded from last segment')
+        self.assertEqual(ts.get_samples(), [(1577836740, 20.5), (1577836800, 21.0), (1577836860, 21.5)], 'Samples are invalid')
+        self.assertEqual(ts.get_samples(1577836800), [(1577836800, 21.0), (1577836860, 21.5)], 'Range samples are invalid')
+        self.assertEqual(ts.get_samples(end=1577836799), [(1577836740, 20.5)], 'Range samples are invalid')
+
+        ts.delete()
+        self.assertFalse(os.path.exists(path), 'Sensor directory should be deleted')
+
+    def test_sensor_time_series_retention(self):
+        path = os.path.join(self.STORE_PATH, 'sensor')
+        ts = SensorTimeSeries(self.fs, path, 2)
+        #2020-01-15, 2020-02-15 and 2020-03-15 UTC
+        ts.append([(1579046400, 20.0)])
+        ts.append([(1581724800, 21.0)])
+        self.assertEqual(len(os.listdir(path)), 4, 'Segments should be kept')
+        ts.append([(1584230400, 22.0)])
+
+        self.assertEqual(ts.get_samples(), [(1581724800, 21.0), (1584230400, 22.0)], 'Oldest segment samples should be dropped')
+        self.assertEqual(sorted(os.listdir(path)), ['202002.ts', '202002.val', '202003.ts', '202003.val'], 'Oldest segment should be deleted')
+
+    def test_store(self):
+        self.store.add('123', 1000, 20.5)
+        self.store.add('123', 1060, None)
+        self.assertEqual(self.store.get('123'), [(1000, 20.5)], 'Pending sample should be returned')
+        self.assertFalse(os.path.exists(os.path.join(self.STORE_PATH, '123')), 'Sample should not be written before flush')
+
+        self.store.flush()
+        self.store.add('123', 1120, 21.5)
+        self.assertTrue(os.path.exists(os.path.join(self.STORE_PATH, '123')), 'Sample should be written after flush')
+        self.assertEqual(self.store.get('123'), [(1000, 20.5), (1120, 21.5)], 'Stored and pending samples should be returned')
+
+        self.store.delete('123')
+        self.assertEqual(self.store.get('123'), [], 'Samples should be deleted')
+        self.assertFalse(os.path.exists(os.path.join(self.STORE_PATH, '123')), 'Files should be deleted')
+
+    def test_store_read_and_delete_do_not_create_files(self):
+        self.assertEqual(self.store.get('123'), [], 'Unknown sensor should have no sample')
+        self.store.delete('123')
+        self.assertFalse(os.path.exists(self.STORE_PATH), 'Store directory should not be created')
+
+
+
+
+
+class SensorsMetricsTests(unittest.TestCase):
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        histogram.add(0.0005)
+        histogram.add(0.003)
+        histogram.add(100.0)
+
+        data = histogram.to_dict()
+        self.assertEqual(data['count'], 3, 'Count is invalid')
+        self.assertEqual(data['min'], 0.5, 'Min latency is invalid')
+        self.assertEqual(data['max'], 100000.0, 'Max latency is invalid')
+        self.assertEqual(data['buckets'][0], 1, 'Latency should be counted in first bucket')
+        self.assertEqual(data['buckets'][2], 1, 'Latency should be counted in 4ms bucket')
+        self.assertEqual(data['buckets'][-1], 1, 'Latency should be counted in overflow bucket')
+        self.assertEqual(len(data['buckets']), len(data['bounds'])+1, 'Buckets count is invalid')
+
+    def test_metrics(self):
+        metrics = SensorsMetrics()
+        metrics.add_latency('SensorOnewire', '123', 0.75)
+        metrics.add_latency('SensorOnewire', '456', 0.8)
+        metrics.add_error('SensorOnewire', '456')
+        metrics.add_retry('SensorOnewire', '456')
+        metrics.add_crc_error('SensorOnewire', '456')
+        metrics.add_lag(0.01)
+
+        data = metrics.get()
+        self.assertEqual(data['addons']['SensorOnewire']['latency']['count'], 2, 'Addon latencies should be aggregated')
+        self.assertEqual(data['addons']['SensorOnewire']['errors'], 1, 'Addon errors count is invalid')
+        self.assertEqual(data['sensors']['123']['errors'], 0, 'Sensor errors count is invalid')
+        self.assertEqual(data['sensors']['456']['retries'], 1, 'Sensor retries count is invalid')
+        self.assertEqual(data['sensors']['456']['crcerrors'], 1, 'Sensor CRC errors count is invalid')
+        self.assertEqual(data['lag']['count'], 1, 'Lag should be recorded')
+
+        metrics.delete('456')
+        self.assertFalse('456' in metrics.get()['sensors'], 'Sensor metrics should be deleted')
+
+    def test_scheduler_lag(self):
+        metrics = SensorsMetrics()
+        scheduler = SensorsScheduler(logging.getLogger('SensorsMetricsTests'), 1, metrics)
+        scheduler.start()
+        task = scheduler.create_task(0.1, lambda: None)
+        task.start()
+        time.sleep(0.15)
+        task.stop()
+        scheduler.stop()
+
+        self.assertGreaterEqual(metrics.get()['lag']['count'], 1, 'Scheduling lag should be recorded')
+
+
+
+
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def test_circuit_opened_after_consecutive_failures(self):
+        breaker = CircuitBreaker()
+        for _ in range(CircuitBreaker.FAILURES_THRESHOLD - 1):
+            breaker.failure('123', 60, now=1000)
+        self.assertTrue(breaker.allow('123', now=1000), 'Sensor should still be read before threshold')
+        self.assertEqual(breaker.get_state('123')['state'], CircuitBreaker.STATE_CLOSED, 'Circuit should be closed')
+
+        circuit = breaker.failure('123', 60, now=1000)
+        self.assertEqual(circuit['state'], CircuitBreaker.STATE_OPEN, 'Circuit should be opened')
+        self.assertEqual(circuit['retryat'], 1120, 'Backoff should be twice the interval')
+        self.assertFalse(breaker.allow('123', now=1100), 'Sensor should not be read during backoff')
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker()
+        for _ in range(CircuitBreaker.FAILURES_THRESHOLD):
+            breaker.failure('123', 60, now=1000)
+
+        self.assertTrue(breaker.allow('123', now=1120), 'Probe read should be allowed after backoff')
+        self.assertEqual(breaker.get_state('123')['state'], CircuitBreaker.STATE_HALF_OPEN, 'Circuit should be half-opened')
+        self.assertFalse(breaker.allow('123', now=1120), 'Only one probe read should be allowed')
+
+        circuit = breaker.failure('123', 60, now=1120)
+        self.assertEqual(circuit['retryat'], 1360, 'Backoff should be doubled after probe failure')
+
+        self.assertTrue(breaker.success('123'), 'Success should report sensor was failing')
+        self.assertEqual(breaker.get_state('123')['state'], CircuitBreaker.STATE_CLOSED, 'Circuit should be closed after success')
+        self.assertFalse(breaker.success('123'), 'Success should report sensor was not failing')
+
+    def test_backoff_bounded(self):
+        breaker = CircuitBreaker()
+        for _ in range(20):
+            circuit = breaker.failure('123', 60, now=1000)
+        self.assertEqual(circuit['retryat'], 1000 + CircuitBreaker.MAX_BACKOFF, 'Backoff should be bounded')
+
+        breaker.delete('123')
+        self.assertEqual(breaker.get_states(), {}, 'Circuit should be deleted')
+
+
+
+
+
+class OnewireDiscoveryTests(unittest.TestCase):
+
+    ONEWIRE_PATH = '/tmp/onewire_discovery'
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL, format=u'%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s')
+        self.lost_callback = Mock()
+        self.discovery = OnewireDiscovery(logging.getLogger('OnewireDiscoveryTests'), self.ONEWIRE_PATH, self.lost_callback)
+        os.makedirs(os.path.join(self.ONEWIRE_PATH, '28-0000054c2ec2'))
+        os.makedirs(os.path.join(self.ONEWIRE_PATH, '28-0000054c2ec3'))
+        os.makedirs(os.path.join(self.ONEWIRE_PATH, 'w1_bus_master1'))
+
+    def tearDown(self):
+        self.discovery.stop_watcher()
+        if os.path.exists(self.ONEWIRE_PATH):
+            shutil.rmtree(self.ONEWIRE_PATH)
+
+    def test_get_devices(self):
+        devices = self.discovery.get_devices()
+        self.assertEqual([device['device'] for device in devices], ['28-0000054c2ec2', '28-0000054c2ec3'], 'Onewire devices are invalid')
+        self.assertEqual(devices[0]['path'], os.path.join(self.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave'), 'Device path is invalid')
+        self.assertTrue('firstseen' in devices[0], 'Field "firstseen" should exist')
+        self.assertTrue('lastseen' in devices[0], 'Field "lastseen" should exist')
+
+    def test_device_lost(self):
+        self.discovery.scan()
+        shutil.rmtree(os.path.join(self.ONEWIRE_PATH, '28-0000054c2ec3'))
+        self.discovery.scan()
+
+        self.assertEqual(len(self.discovery.get_devices()), 1, 'Lost device should not be returned')
+        self.assertEqual(self.lost_callback.call_count, 1, 'Lost callback should be called')
+        self.assertEqual(self.lost_callback.call_args[0][0]['device'], '28-0000054c2ec3', 'Lost device is invalid')
+
+        self.discovery.scan()
+        self.assertEqual(self.lost_callback.call_count, 1, 'Lost callback should be called once')
+
+    def test_device_found_again(self):
+        self.discovery.scan()
+        first_seen = self.discovery.get_devices()[0]['firstseen']
+        shutil.rmtree(os.path.join(self.ONEWIRE_PATH, '28-0000054c2ec2'))
+        self.discovery.scan()
+        os.makedirs(os.path.join(self.ONEWIRE_PATH, '28-0000054c2ec2'))
+        self.discovery.scan()
+
+        devices = self.discovery.get_devices()
+        self.assertEqual(len(devices), 2, 'Device should be found again')
+        self.assertEqual(devices[0]['firstseen'], first_seen, 'First seen time should be kept')
+
+
+
+
+
 class OnewireSensorTests(unittest.TestCase):
 
     ONEWIRE_PATH = '/tmp/onewire'
@@ -956,6 +2013,14 @@ class OnewireSensorTests(unittest.TestCase):
         self.assertEqual(len(addon.drivers), 1, 'Onewire driver should be registered')
         self.assertTrue(isinstance(addon.drivers.values()[0], OnewireDriver), 'Driver should be OnewireDriver instance')
 
+    def test_driver_lazy_init(self):
+        driver = self.get_addon().onewire_driver
+        self.assertIsNone(driver._OnewireDriver__configtxt, 'Config.txt should not be loaded at startup')
+        self.assertIsNone(driver._OnewireDriver__etcmodules, 'Etc modules should not be loaded at startup')
+
+        self.assertIsNotNone(driver.configtxt, 'Config.txt should be loaded on first use')
+        self.assertIs(driver.configtxt, driver.configtxt, 'Config.txt should be loaded once')
+
     def test_read_onewire_temperature(self):
         addon = self.get_addon()
         path = os.path.join(addon.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
@@ -979,6 +2044,103 @@ class OnewireSensorTests(unittest.TestCase):
         self.assertEqual(c, 23.75, 'Celsius value is invalid')
         self.assertEqual(f, 74.75, 'Fahrenheit value is invalid')
 
+    def test_read_onewire_temperatures(self):
+        addon = self.get_addon()
+        sensors = []
+        for (device, value) in [('28-0000054c2ec2', '23750'), ('28-0000054c2ec3', '19500'), ('28-0000054c2ec4', '85000')]:
+            path = os.path.join(addon.ONEWIRE_PATH, device, 'w1_slave')
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('7c 01 4b 46 7f ff 04 10 09 : crc=09 YES\n7c 01 4b 46 7f ff 04 10 09 t=%s' % value)
+            sensors.append({
+                'uuid': device,
+                'path': path,
+                'offset': 0,
+                'offsetunit': SensorsUtils.TEMP_CELSIUS,
+            })
+
+        temperatures = addon._read_onewire_temperatures(sensors)
+        self.assertEqual(len(temperatures), 3, 'All sensors should be read')
+        self.assertEqual(temperatures[0], (23.75, 74.75), 'First sensor value is invalid')
+        self.assertEqual(temperatures[1], (19.5, 67.1), 'Second sensor value is invalid')
+        self.assertEqual(temperatures[2], (None, None), 'Third sensor value should be invalid')
+        addon._stop()
+
+    def test_read_onewire_temperatures_with_bulk_conversion(self):
+        addon = self.get_addon()
+        addon._trigger_bulk_conversion = Mock(return_value=True)
+        addon._read_onewire_temperature = Mock(return_value=(20, 68))
+
+        temperatures = addon._read_onewire_temperatures([{'uuid': '1'}, {'uuid': '2'}])
+        self.assertEqual(temperatures, [(20, 68), (20, 68)], 'All sensors should be read')
+        self.assertEqual(addon._trigger_bulk_conversion.call_count, 1, 'Bulk conversion should be triggered once')
+        self.assertIsNone(addon._SensorOnewire__read_pool, 'Read pool should not be used with bulk conversion')
+
+    def test_trigger_bulk_conversion(self):
+        addon = self.get_addon()
+        path = os.path.join(addon.ONEWIRE_PATH, addon.ONEWIRE_BULK_READ)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('0')
+
+        self.assertTrue(addon._trigger_bulk_conversion(), 'Bulk conversion should succeed')
+        with open(path, 'r') as f:
+            self.assertEqual(f.read().strip(), 'trigger', 'Bulk conversion should be triggered')
+
+    def test_trigger_bulk_conversion_not_available(self):
+        addon = self.get_addon()
+        self.assertFalse(addon._trigger_bulk_conversion(), 'Bulk conversion should not be available')
+
+    def test_read_onewire_temperatures_bulk_conversion_time(self):
+        addon = self.get_addon()
+        addon._trigger_bulk_conversion = Mock(return_value=True)
+        addon._read_onewire_temperature = Mock(return_value=(20, 68))
+
+        addon._read_onewire_temperatures([{'uuid': '1', 'resolution': 9}, {'uuid': '2', 'resolution': 10}])
+        addon._trigger_bulk_conversion.assert_called_with(0.188)
+        addon._read_onewire_temperatures([{'uuid': '1', 'resolution': 9}, {'uuid': '2'}])
+        addon._trigger_bulk_conversion.assert_called_with(0.75)
+
+    def test_set_onewire_resolution(self):
+        addon = self.get_addon()
+        path = os.path.join(addon.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
+        os.makedirs(os.path.dirname(path))
+        resolution_path = os.path.join(os.path.dirname(path), 'resolution')
+        with open(resolution_path, 'w') as f:
+            f.write('12\n')
+
+        self.assertTrue(addon._set_onewire_resolution({'device': '28-0000054c2ec2', 'path': path, 'resolution': 9}), 'Resolution should be set')
+        with open(resolution_path, 'r') as f:
+            self.assertEqual(f.read().strip(), '9', 'Resolution should be written')
+
+    def test_task_applies_resolution_once(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'device': '28-0000054c2ec2',
+            'path': 'path',
+            'resolution': 9,
+        }
+        addon = self.get_addon()
+        addon._read_onewire_temperature = Mock(return_value=(20, 68))
+        addon._set_onewire_resolution = Mock(return_value=True)
+
+        addon._task(sensor)
+        addon._task(sensor)
+        self.assertEqual(addon._set_onewire_resolution.call_count, 1, 'Resolution should be set once on device')
+        sensor['resolution'] = 10
+        addon._task(sensor)
+        self.assertEqual(addon._set_onewire_resolution.call_count, 2, 'Updated resolution should be set on device')
+        addon._on_device_lost({'device': '28-0000054c2ec2', 'lastseen': 12345678})
+        addon._task(sensor)
+        self.assertEqual(addon._set_onewire_resolution.call_count, 3, 'Resolution should be set again after device is lost')
+
+    def test_set_onewire_resolution_not_available(self):
+        addon = self.get_addon()
+        path = os.path.join(addon.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
+        self.assertFalse(addon._set_onewire_resolution({'device': '28-0000054c2ec2', 'path': path, 'resolution': 9}), 'Resolution should not be available')
+
     def test_read_onewire_temperature_with_celsius_offset(self):
         addon = self.get_addon()
         path = os.path.join(addon.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
@@ -1027,16 +2189,65 @@ class OnewireSensorTests(unittest.TestCase):
 
         sensor = {
             'uuid': '123-456-789',
-            'type': 'temperature',
-            'subtype': 'onewire',
-            'device': 'xxxxxxx',
+            'type': 'temperature',
+            'subtype': 'onewire',
+            'device': 'xxxxxxx',
+            'path': path,
+            'offset': 0,
+            'offsetunit': SensorsUtils.TEMP_CELSIUS,
+        }
+        (c,f) = addon._read_onewire_temperature(sensor)
+        self.assertIsNone(c, 'Celsius must be None')
+        self.assertIsNone(f, 'Fahrenheit must be None')
+
+        metrics = self.module.get_sensors_metrics()
+        self.assertEqual(metrics['sensors']['123-456-789']['errors'], 1, 'Read error should be counted')
+        self.assertEqual(metrics['addons']['SensorOnewire']['latency']['count'], 1, 'Read latency should be recorded')
+
+    def test_read_onewire_temperature_with_invalid_crc(self):
+        addon = self.get_addon()
+        path = os.path.join(addon.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('7c 01 4b 46 7f ff 04 10 09 : crc=08 NO\n7c 01 4b 46 7f ff 04 10 09 t=23750')
+
+        sensor = {
+            'uuid': '123-456-789',
+            'device': '28-0000054c2ec2',
+            'path': path,
+            'offset': 0,
+            'offsetunit': SensorsUtils.TEMP_CELSIUS,
+        }
+        (c,f) = addon._read_onewire_temperature(sensor)
+        self.assertIsNone(c, 'Celsius must be None')
+
+        metrics = self.module.get_sensors_metrics()
+        self.assertEqual(metrics['sensors']['123-456-789']['crcerrors'], addon.ONEWIRE_READ_RETRIES+1, 'CRC errors should be counted')
+        self.assertEqual(metrics['sensors']['123-456-789']['retries'], addon.ONEWIRE_READ_RETRIES, 'Retries should be counted')
+        self.assertEqual(metrics['sensors']['123-456-789']['errors'], 1, 'Read error should be counted once')
+
+    def test_read_onewire_temperature_retry_succeed(self):
+        addon = self.get_addon()
+        path = os.path.join(addon.ONEWIRE_PATH, '28-0000054c2ec2', 'w1_slave')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('7c 01 4b 46 7f ff 04 10 09 : crc=09 YES\n7c 01 4b 46 7f ff 04 10 09 t=85000')
+        def fix_device(sensor):
+            with open(path, 'w') as f:
+                f.write('7c 01 4b 46 7f ff 04 10 09 : crc=09 YES\n7c 01 4b 46 7f ff 04 10 09 t=23750')
+        addon._add_read_retry = Mock(side_effect=fix_device)
+
+        sensor = {
+            'uuid': '123-456-789',
+            'device': '28-0000054c2ec2',
             'path': path,
             'offset': 0,
             'offsetunit': SensorsUtils.TEMP_CELSIUS,
         }
         (c,f) = addon._read_onewire_temperature(sensor)
-        self.assertIsNone(c, 'Celsius must be None')
-        self.assertIsNone(f, 'Fahrenheit must be None')
+        self.assertEqual(c, 23.75, 'Celsius value should be read on retry')
+        self.assertEqual(addon._add_read_retry.call_count, 1, 'Device should be read again once')
+        self.assertEqual(self.module.get_sensors_metrics()['sensors']['123-456-789']['errors'], 0, 'No read error should be counted')
 
     def test_add(self):
         self.session.mock_command('get_reserved_gpio', lambda: {
@@ -1075,6 +2286,26 @@ class OnewireSensorTests(unittest.TestCase):
         self.assertEqual(sensor['offsetunit'], SensorsUtils.TEMP_CELSIUS, 'Offset_unit should be same than param')
         self.assertTrue('interval' in sensor, '"interval" field must exist in onewire sensor')
         self.assertEqual(sensor['interval'], 120, 'Interval should be same than param')
+        self.assertTrue('resolution' in sensor, '"resolution" field must exist in onewire sensor')
+        self.assertEqual(sensor['resolution'], 12, 'Resolution should be 12 bits by default')
+
+    def test_add_with_resolution(self):
+        self.session.mock_command('get_reserved_gpio', lambda: {
+            'gpio': 'GPIO18',
+            'pin': 18,
+            'uuid': '123-456-789'
+        })
+        addon = self.get_addon()
+        addon._read_onewire_temperature = Mock(return_value=(20, 68))
+        addon._set_onewire_resolution = Mock(return_value=True)
+
+        res = addon.add('name', 'device', 'path', 120, 0, SensorsUtils.TEMP_CELSIUS, resolution=9)
+        self.assertEqual(res['sensors'][0]['resolution'], 9, 'Resolution should be same than param')
+        self.assertEqual(addon._set_onewire_resolution.call_count, 0, 'Resolution should not be set on device while validating sensor')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            addon.add('name', 'device', 'path', 120, 0, SensorsUtils.TEMP_CELSIUS, resolution=8)
+        self.assertEqual(cm.exception.message, 'Resolution must be 9, 10, 11 or 12')
 
     def test_add_invalid_params(self):
         addon = self.get_addon()
@@ -1179,6 +2410,78 @@ class OnewireSensorTests(unittest.TestCase):
         self.assertTrue('interval' in updated_sensor, '"interval" field must exist in onewire sensor')
         self.assertEqual(updated_sensor['interval'], 180, '"interval" should be updated')
 
+    def test_update_keeps_filter_params(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'deadband': 0.5,
+            'heartbeat': 600,
+        }
+        addon = self.get_addon()
+        addon._search_device = lambda k,v: {'name': 'name'} if k=='uuid' else None
+
+        updated_sensor = addon.update(sensor, 'newname', 120, 0, SensorsUtils.TEMP_CELSIUS)['sensors'][0]
+        self.assertEqual(updated_sensor['deadband'], 0.5, '"deadband" should be kept')
+        self.assertEqual(updated_sensor['heartbeat'], 600, '"heartbeat" should be kept')
+
+        updated_sensor = addon.update(sensor, 'newname', 120, 0, SensorsUtils.TEMP_CELSIUS, deadband=1.0, heartbeat=300)['sensors'][0]
+        self.assertEqual(updated_sensor['deadband'], 1.0, '"deadband" should be updated')
+        self.assertEqual(updated_sensor['heartbeat'], 300, '"heartbeat" should be updated')
+
+    def test_update_keeps_adaptive_params(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'adaptive': True,
+            'mininterval': 60,
+            'maxinterval': 600,
+        }
+        addon = self.get_addon()
+        addon._search_device = lambda k,v: {'name': 'name'} if k=='uuid' else None
+
+        updated_sensor = addon.update(sensor, 'newname', 180, 0, SensorsUtils.TEMP_CELSIUS)['sensors'][0]
+        self.assertTrue(updated_sensor['adaptive'], '"adaptive" should be kept')
+        self.assertEqual(updated_sensor['mininterval'], 60, '"mininterval" should be kept')
+        self.assertEqual(updated_sensor['maxinterval'], 600, '"maxinterval" should be kept')
+
+        updated_sensor = addon.update(sensor, 'newname', 180, 0, SensorsUtils.TEMP_CELSIUS, adaptive=False)['sensors'][0]
+        self.assertFalse(updated_sensor['adaptive'], '"adaptive" should be updated')
+
+    def test_update_keeps_oversampling_params(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'oversampling': 10,
+            'aggregation': 'max',
+        }
+        addon = self.get_addon()
+        addon._search_device = lambda k,v: {'name': 'name'} if k=='uuid' else None
+
+        updated_sensor = addon.update(sensor, 'newname', 180, 0, SensorsUtils.TEMP_CELSIUS)['sensors'][0]
+        self.assertEqual(updated_sensor['oversampling'], 10, '"oversampling" should be kept')
+        self.assertEqual(updated_sensor['aggregation'], 'max', '"aggregation" should be kept')
+
+        updated_sensor = addon.update(sensor, 'newname', 180, 0, SensorsUtils.TEMP_CELSIUS, oversampling=0)['sensors'][0]
+        self.assertEqual(updated_sensor['oversampling'], 0, '"oversampling" should be disabled')
+
+    def test_update_keeps_resolution(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'resolution': 9,
+        }
+        addon = self.get_addon()
+        addon._search_device = lambda k,v: {'name': 'name'} if k=='uuid' else None
+
+        updated_sensor = addon.update(sensor, 'newname', 180, 0, SensorsUtils.TEMP_CELSIUS)['sensors'][0]
+        self.assertEqual(updated_sensor['resolution'], 9, '"resolution" should be kept')
+        updated_sensor = addon.update(sensor, 'newname', 180, 0, SensorsUtils.TEMP_CELSIUS, resolution=11)['sensors'][0]
+        self.assertEqual(updated_sensor['resolution'], 11, '"resolution" should be updated')
+
     def test_update_invalid_params(self):
         sensor = {
             'lastupdate': 12345678,
@@ -1271,6 +2574,45 @@ class OnewireSensorTests(unittest.TestCase):
         self.assertEqual(values['celsius'], 20, 'Updated celsius value is invalid')
         self.assertEqual(values['fahrenheit'], 68, 'Updated fahrenheit value is invalid')
 
+    def test_task_failing_sensor_backoff(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'path': 'path',
+        }
+        addon = self.get_addon()
+        mock_read_temp = Mock(return_value=(None, None))
+        addon._read_onewire_temperature = mock_read_temp
+
+        for _ in range(CircuitBreaker.FAILURES_THRESHOLD + 2):
+            addon._task(sensor)
+        self.assertEqual(mock_read_temp.call_count, CircuitBreaker.FAILURES_THRESHOLD, 'Failing sensor should not be read during backoff')
+        breakers = self.module.get_sensors_metrics()['breakers']
+        self.assertEqual(breakers['123-456-789']['state'], CircuitBreaker.STATE_OPEN, 'Sensor state should be reported')
+
+    def test_bus_task(self):
+        sensor1 = {
+            'uuid': '123-456-789',
+            'name': 'name1',
+        }
+        sensor2 = {
+            'uuid': '987-654-321',
+            'name': 'name2',
+        }
+        addon = self.get_addon()
+        mock_read_temps = Mock(return_value=[(20, 68), (21, 69.8)])
+        addon._read_onewire_temperatures = mock_read_temps
+        mock_update_value = Mock()
+        addon.update_value = mock_update_value
+
+        addon._bus_task([[sensor1], [sensor2]])
+        self.assertEqual(mock_read_temps.call_count, 1, 'Sensors should be read in a single call')
+        self.assertEqual(mock_read_temps.call_args.args[0], [sensor1, sensor2], 'All sensors should be read')
+        self.assertEqual(mock_update_value.call_count, 2, 'update_value should be called for each sensor')
+        self.assertEqual(self.session.get_event_calls('sensors.temperature.update'), 2, 'Event temperature update should be sent for each sensor')
+        self.assertEqual(sensor2['celsius'], 21, 'Sensor value should be updated')
+
     def test_get_task(self):
         sensor = {
             'lastupdate': 12345678,
@@ -1289,9 +2631,59 @@ class OnewireSensorTests(unittest.TestCase):
         addon = self.get_addon()
 
         task = addon.get_task(sensor)
-        self.assertTrue(isinstance(task, Task), 'Get_task should returns a Task instance')
+        self.assertTrue(isinstance(task, SchedulerTask), 'Get_task should returns a SchedulerTask instance')
         self.assertFalse(task.is_running(), 'Task should not be launched')
 
+    def test_task_value_not_significant(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'deadband': 0.5,
+            'heartbeat': 600,
+        }
+        addon = self.get_addon()
+        addon._read_onewire_temperature = Mock(return_value=(20, 68))
+        mock_update_value = Mock()
+        addon.update_value = mock_update_value
+
+        addon._task(sensor)
+        addon._task(sensor)
+        self.assertEqual(mock_update_value.call_count, 1, 'update_value should be called only for significant value')
+        self.assertEqual(self.session.get_event_calls('sensors.temperature.update'), 1, 'Event should be sent only for significant value')
+
+    def test_get_task_per_sensor(self):
+        sensor1 = {
+            'uuid': '123-456-789',
+            'name': 'name1',
+            'interval': 120,
+        }
+        sensor2 = {
+            'uuid': '321-654-987',
+            'name': 'name2',
+            'interval': 120,
+        }
+        addon = self.get_addon()
+
+        task1 = addon.get_task(sensor1)
+        task2 = addon.get_task(sensor2)
+        self.assertNotEqual(task1, task2, 'Each sensor should have its own task')
+        self.assertEqual(task1.task_args, [sensor1], 'Task should handle its own sensor')
+
+    def test_get_task_duration(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'interval': 120,
+            'resolution': 9,
+        }
+        addon = self.get_addon()
+
+        task = addon.get_task(sensor)
+        self.assertEqual(task.duration, 0.094, 'Task duration should be sensor conversion time')
+        del sensor['resolution']
+        task = addon.get_task(sensor)
+        self.assertEqual(task.duration, 0.75, 'Task duration should be default resolution conversion time')
+
     def test_process_event_install_driver(self):
         event = {
             'startup': False,
@@ -1498,6 +2890,9 @@ class MotionGenericSensorTests(unittest.TestCase):
         with self.assertRaises(MissingParameter) as cm:
             addon.add('name', 'GPIO18', None)
         self.assertEqual(cm.exception.message, 'Parameter "inverted" is missing')
+        with self.assertRaises(InvalidParameter) as cm:
+            addon.add('name', 'GPIO18', False, -1)
+        self.assertEqual(cm.exception.message, 'Hold time must be a positive integer')
 
     def test_update(self):
         sensor = {
@@ -1585,6 +2980,21 @@ class MotionGenericSensorTests(unittest.TestCase):
             addon.update(sensor, 'name', None)
         self.assertEqual(cm.exception.message, 'Parameter "inverted" is missing')
 
+    def test_update_keeps_hold_time(self):
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'holdtime': 30,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        addon = self.get_addon()
+        addon._search_device = lambda k,v: {'name': 'name'} if k=='uuid' else None
+
+        res = addon.update(sensor, 'name', False)
+        self.assertEqual(res['sensors'][0]['holdtime'], 30, '"holdtime" should be kept')
+        res = addon.update(sensor, 'name', False, 0)
+        self.assertEqual(res['sensors'][0]['holdtime'], 0, '"holdtime" should be updated')
+
     def test_get_task(self):
         addon = self.get_addon()
 
@@ -1703,6 +3113,182 @@ class MotionGenericSensorTests(unittest.TestCase):
         self.assertEqual(self.session.get_event_calls('sensors.motion.on'), 0, 'Sensors.motion.on event not should be called')
         self.assertEqual(self.session.get_event_calls('sensors.motion.off'), 0, 'Sensors.motion.off should not be called')
 
+    def test_process_event_coalesce_motion_session(self):
+        on_event = {
+            'startup': False,
+            'event': 'gpios.gpio.on',
+            'params': {
+                'uuid': '123-456-789',
+            }
+        }
+        off_event = {
+            'startup': False,
+            'event': 'gpios.gpio.off',
+            'params': {
+                'uuid': '123-456-789',
+                'duration': 2,
+            }
+        }
+        sensor = {
+            'lastupdate': 12345678,
+            'lastduration': 123,
+            'uuid': '123-456-789',
+            'name': 'name',
+            'type': 'motion',
+            'subtype': 'generic',
+            'on': False,
+            'inverted': False,
+            'holdtime': 30,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}]
+        }
+        addon = self.get_addon()
+        addon._get_device = lambda uuid: sensor
+
+        for _ in range(3):
+            addon.process_event(on_event, sensor)
+            addon.process_event(off_event, sensor)
+        self.assertEqual(self.session.get_event_calls('sensors.motion.on'), 1, 'Sensors.motion.on should be called once per session')
+        self.assertEqual(self.session.get_event_calls('sensors.motion.off'), 0, 'Sensors.motion.off should not be called during hold time')
+        self.assertTrue(sensor['on'], 'Sensor should stay on during hold time')
+
+        #end session
+        addon._stop()
+        self.assertEqual(self.session.get_event_calls('sensors.motion.off'), 1, 'Sensors.motion.off should be called at session end')
+        self.assertEqual(self.session.get_event_last_params('sensors.motion.off')['duration'], 6, 'Session duration should be accumulated')
+        self.assertEqual(sensor['lastduration'], 6, 'Session duration should be stored')
+        self.assertFalse(sensor['on'], 'Sensor should be off')
+
+    def test_process_event_session_end_after_motion_detected_again(self):
+        on_event = {
+            'startup': False,
+            'event': 'gpios.gpio.on',
+            'params': {
+                'uuid': '123-456-789',
+            }
+        }
+        off_event = {
+            'startup': False,
+            'event': 'gpios.gpio.off',
+            'params': {
+                'uuid': '123-456-789',
+                'duration': 2,
+            }
+        }
+        sensor = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'type': 'motion',
+            'subtype': 'generic',
+            'on': False,
+            'inverted': False,
+            'holdtime': 30,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}]
+        }
+        addon = self.get_addon()
+        addon._get_device = lambda uuid: sensor
+
+        #hold time timer fires while motion is detected again
+        addon.process_event(on_event, sensor)
+        addon.process_event(off_event, sensor)
+        addon.process_event(on_event, sensor)
+        addon._end_session(sensor['uuid'])
+        self.assertTrue(sensor['on'], 'Sensor should stay on while motion is detected')
+        self.assertEqual(self.session.get_event_calls('sensors.motion.off'), 0, 'Sensors.motion.off should not be called')
+
+        #motion detected after session end starts new session
+        addon.process_event(off_event, sensor)
+        addon._stop()
+        addon.process_event(on_event, sensor)
+        self.assertTrue(sensor['on'], 'Sensor should be turned on again')
+        self.assertEqual(self.session.get_event_calls('sensors.motion.on'), 2, 'Sensors.motion.on should be called for new session')
+        addon._stop()
+
+
+
+
+
+class Dht22ReaderTests(unittest.TestCase):
+
+    HELPER_PATH = '/tmp/dht22_helper'
+    HELPER = """#!/usr/bin/env python
+import sys
+if len(sys.argv)!=2:
+    sys.stdout.write('Usage: ./dht22 <pin>|--daemon\\n')
+    sys.exit(1)
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    if line.strip()=='99':
+        sys.exit(1)
+    sys.stdout.write('{"celsius": 21.5, "humidity": 45.0, "error": "", "pin": %s}\\n' % line.strip())
+    sys.stdout.flush()
+"""
+
+    def setUp(self):
+        logging.basicConfig(level=logging.CRITICAL, format=u'%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s')
+        with open(self.HELPER_PATH, 'w') as f:
+            f.write(self.HELPER)
+        os.chmod(self.HELPER_PATH, 0o755)
+        self.reader = Dht22Reader(logging.getLogger('Dht22ReaderTests'), self.HELPER_PATH)
+
+    def tearDown(self):
+        self.reader.stop()
+        for path in (self.HELPER_PATH, self.HELPER_PATH + '.invalid'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_read(self):
+        self.assertFalse(self.reader.is_running(), 'Helper should not be started before first read')
+
+        data = self.reader.read(7)
+        self.assertEqual(data['celsius'], 21.5, 'Celsius value is invalid')
+        self.assertEqual(data['humidity'], 45.0, 'Humidity value is invalid')
+        self.assertEqual(data['pin'], 7, 'Request should be sent to helper')
+        self.assertTrue(self.reader.is_running(), 'Helper should keep running after read')
+
+    def test_read_keeps_same_helper(self):
+        self.reader.read(7)
+        pid = self.reader._Dht22Reader__process.pid
+        data = self.reader.read(11)
+
+        self.assertEqual(data['pin'], 11, 'Second request should be answered')
+        self.assertEqual(self.reader._Dht22Reader__process.pid, pid, 'Helper should not be restarted')
+
+    def test_read_restarts_dead_helper(self):
+        with self.assertRaises(Exception):
+            self.reader.read(99)
+        self.assertFalse(self.reader.is_running(), 'Dead helper should be released')
+
+        data = self.reader.read(7)
+        self.assertEqual(data['pin'], 7, 'Helper should be restarted')
+
+    def test_stop(self):
+        self.reader.read(7)
+        self.reader.stop()
+        self.assertFalse(self.reader.is_running(), 'Helper should be stopped')
+
+    def test_read_without_daemon_mode(self):
+        #binary built before daemon mode: reads any argument as pin number
+        with open(self.HELPER_PATH, 'w') as f:
+            f.write("""#!/usr/bin/env python
+import sys
+if len(sys.argv)!=2:
+    sys.stdout.write('Usage: ./dht22 <pin>\\n')
+    sys.exit(1)
+if not sys.argv[1].isdigit():
+    open(sys.argv[0] + '.invalid', 'w').close()
+    sys.exit(2)
+sys.stdout.write('{"celsius": 0.0, "humidity": 0.0, "error": "", "pin": %s}\\n' % sys.argv[1])
+""")
+
+        data = self.reader.read(7)
+        self.assertEqual(data['pin'], 7, 'Request should fall back to one-shot read')
+        self.assertFalse(self.reader.is_running(), 'No helper should keep running')
+        data = self.reader.read(11)
+        self.assertEqual(data['pin'], 11, 'Next requests should use one-shot read')
+        self.assertFalse(os.path.exists(self.HELPER_PATH + '.invalid'), 'Binary should never be launched with daemon option')
+
 
 
 
@@ -1835,6 +3421,7 @@ class Dht22SensorTests(unittest.TestCase):
         self.assertIsNone(c, 'Celsius value should be None')
         self.assertIsNone(f, 'Fahrenheit value should be None')
         self.assertIsNone(h, 'Humidity value should be None')
+        self.assertEqual(self.module.get_sensors_metrics()['addons']['SensorDht22']['errors'], 1, 'Read error should be counted')
 
     def test_add(self):
         self.session.mock_command('get_assigned_gpios', lambda: {
@@ -2094,6 +3681,94 @@ class Dht22SensorTests(unittest.TestCase):
         self.assertTrue('interval' in hum, '"interval" field must exist in dht22 sensor')
         self.assertEqual(hum['interval'], 120, 'Interval should be 120')
 
+    def test_update_keeps_filter_params(self):
+        temp = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'type': 'temperature',
+            'interval': 100,
+            'deadband': 0.5,
+            'heartbeat': 600,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        hum = {
+            'uuid': '987-654-321',
+            'name': 'name',
+            'type': 'humidity',
+            'interval': 100,
+            'deadband': 2,
+            'heartbeat': 600,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        addon = self.get_addon()
+        addon._get_dht22_devices = lambda n: (temp, hum)
+
+        res = addon.update(temp, 'name', 120, 0, SensorsUtils.TEMP_CELSIUS)
+        self.assertEqual(res['sensors'][0]['deadband'], 0.5, 'Temperature "deadband" should be kept')
+        self.assertEqual(res['sensors'][1]['deadband'], 2, 'Humidity "deadband" should be kept')
+        self.assertEqual(res['sensors'][0]['heartbeat'], 600, '"heartbeat" should be kept')
+
+        res = addon.update(temp, 'name', 120, 0, SensorsUtils.TEMP_CELSIUS, humidity_deadband=5)
+        self.assertEqual(res['sensors'][0]['deadband'], 0.5, 'Temperature "deadband" should be kept')
+        self.assertEqual(res['sensors'][1]['deadband'], 5, 'Humidity "deadband" should be updated')
+
+    def test_update_keeps_adaptive_params(self):
+        temp = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'type': 'temperature',
+            'interval': 100,
+            'adaptive': True,
+            'mininterval': 60,
+            'maxinterval': 600,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        hum = {
+            'uuid': '987-654-321',
+            'name': 'name',
+            'type': 'humidity',
+            'interval': 100,
+            'adaptive': True,
+            'mininterval': 60,
+            'maxinterval': 600,
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        addon = self.get_addon()
+        addon._get_dht22_devices = lambda n: (temp, hum)
+
+        res = addon.update(temp, 'name', 120, 0, SensorsUtils.TEMP_CELSIUS)
+        for sensor in res['sensors']:
+            self.assertTrue(sensor['adaptive'], '"adaptive" should be kept')
+            self.assertEqual(sensor['mininterval'], 60, '"mininterval" should be kept')
+            self.assertEqual(sensor['maxinterval'], 600, '"maxinterval" should be kept')
+
+    def test_update_keeps_oversampling_params(self):
+        temp = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'type': 'temperature',
+            'interval': 100,
+            'oversampling': 10,
+            'aggregation': 'min',
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        hum = {
+            'uuid': '987-654-321',
+            'name': 'name',
+            'type': 'humidity',
+            'interval': 100,
+            'oversampling': 10,
+            'aggregation': 'min',
+            'gpios': [{'gpio':'GPIO18', 'pin':18, 'uuid':'123-456-789'}],
+        }
+        addon = self.get_addon()
+        addon._get_dht22_devices = lambda n: (temp, hum)
+
+        res = addon.update(temp, 'name', 120, 0, SensorsUtils.TEMP_CELSIUS)
+        for sensor in res['sensors']:
+            self.assertEqual(sensor['oversampling'], 10, '"oversampling" should be kept')
+            self.assertEqual(sensor['aggregation'], 'min', '"aggregation" should be kept')
+
     def test_update_invalid_params(self):
         temp = {
             'lastupdate': 12345678,
@@ -2234,9 +3909,29 @@ class Dht22SensorTests(unittest.TestCase):
         addon._get_dht22_devices = lambda n: (temp, hum)
 
         task = addon.get_task(temp)
-        self.assertTrue(isinstance(task, Task), 'Get_task should returns a Task instance')
+        self.assertTrue(isinstance(task, SchedulerTask), 'Get_task should returns a SchedulerTask instance')
         self.assertFalse(task.is_running(), 'Task should not be launched')
 
+    def test_get_task_sensors(self):
+        temp = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'type': 'temperature',
+            'subtype': 'dht22',
+        }
+        hum = {
+            'uuid': '987-654-321',
+            'name': 'name',
+            'type': 'humidity',
+            'subtype': 'dht22',
+        }
+        addon = self.get_addon()
+        addon._get_dht22_devices = lambda n: (temp, hum)
+        self.assertEqual(addon.get_task_sensors(temp), [temp, hum], 'Task should handle both DHT22 sensors')
+
+        addon._get_dht22_devices = lambda n: (None, hum)
+        self.assertEqual(addon.get_task_sensors(hum), [hum], 'Task should handle only existing DHT22 sensor')
+
     def test_task(self):
         temp = {
             'lastupdate': 12345678,
@@ -2271,6 +3966,29 @@ class Dht22SensorTests(unittest.TestCase):
         self.assertEqual(self.session.get_event_calls('sensors.temperature.update'), 1, 'Temperature event should be called')
         self.assertEqual(self.session.get_event_calls('sensors.humidity.update'), 1, 'Humidity event should be called')
 
+    def test_task_values_not_significant(self):
+        temp = {
+            'uuid': '123-456-789',
+            'name': 'name',
+            'deadband': 0.5,
+        }
+        hum = {
+            'uuid': '987-654-321',
+            'name': 'name',
+            'deadband': 2,
+        }
+        addon = self.get_addon()
+        addon._read_dht22 = lambda s: (30, 86, 69)
+        mock_update_value = Mock()
+        addon.update_value = mock_update_value
+        addon._task(temp, hum)
+
+        addon._read_dht22 = lambda s: (30.2, 86.36, 72)
+        addon._task(temp, hum)
+        self.assertEqual(mock_update_value.call_count, 3, 'Update_value should be called only for significant values')
+        self.assertEqual(self.session.get_event_calls('sensors.temperature.update'), 1, 'Temperature event should be sent once')
+        self.assertEqual(self.session.get_event_calls('sensors.humidity.update'), 2, 'Humidity event should be sent twice')
+
     def test_task_temperature_only(self):
         temp = {
             'lastupdate': 12345678,